@@ -0,0 +1,59 @@
+"""access pattern indexes
+
+Revision ID: 3b7d2e9a41c6
+Revises: c5bffa78bbae
+Create Date: 2026-10-18 16:40:27.518204
+
+Indexes for how the tables are read: locations by time range and route
+and by trip, stop times by stop, and trips by route and direction.
+
+On PostgreSQL the locations index on the partitioned table is created on
+every partition, and includes the columns get_locations reads so a time
+range can be answered from the index alone. On SQLite each day table gets
+its own copy of the locations indexes.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b7d2e9a41c6'
+down_revision: Union[str, None] = 'c5bffa78bbae'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _location_tables(bind):
+    "Tables that hold locations: the partitioned table or each SQLite day"
+    if bind.dialect.name == 'postgresql':
+        return ['locations']
+    return [
+        table for table in sa.inspect(bind).get_table_names()
+        if table.startswith('locations_') and table[10:].isdigit()
+    ]
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    for table in _location_tables(bind):
+        op.create_index(
+            f'ix_{table}_request_timestamp_route_id', table,
+            ['request_timestamp', 'route_id'],
+            postgresql_include=['trip_id', 'lat', 'lon', 'bearing', 'speed'],
+        )
+        op.create_index(f'ix_{table}_trip_id', table, ['trip_id'])
+    op.create_index('ix_stop_times_stop_id', 'stop_times', ['stop_id'])
+    op.create_index(
+        'ix_trips_route_id_direction_id', 'trips', ['route_id', 'direction_id']
+    )
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    op.drop_index('ix_trips_route_id_direction_id', table_name='trips')
+    op.drop_index('ix_stop_times_stop_id', table_name='stop_times')
+    for table in _location_tables(bind):
+        op.drop_index(f'ix_{table}_trip_id', table_name=table)
+        op.drop_index(f'ix_{table}_request_timestamp_route_id', table_name=table)
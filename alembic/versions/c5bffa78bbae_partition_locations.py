@@ -0,0 +1,154 @@
+"""partition locations by service day
+
+Revision ID: c5bffa78bbae
+Revises: 20e9001f057f
+Create Date: 2026-10-18 14:02:11.902317
+
+PostgreSQL: locations becomes a natively range-partitioned table on
+request_timestamp with one partition per service day.
+SQLite: each service day moves to its own locations_YYYYMMDD table and
+locations becomes a view that unions them.
+
+Partitions for new days are created by data.partitions when locations
+are written.
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Sequence, Union
+from zoneinfo import ZoneInfo
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5bffa78bbae'
+down_revision: Union[str, None] = '20e9001f057f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TIMEZONE = ZoneInfo("Australia/Sydney")
+# SQLite's limit on the SELECTs in one compound statement
+MAX_COMPOUND_SELECT = 500
+
+
+def _columns():
+    return [
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('request_timestamp', sa.Integer(), nullable=False),
+        sa.Column('trip_id', sa.String(), nullable=False),
+        sa.Column('route_id', sa.String(), nullable=False),
+        sa.Column('schedule_relationship', sa.Integer(), nullable=False),
+        sa.Column('lat', sa.Float(), nullable=True),
+        sa.Column('lon', sa.Float(), nullable=True),
+        sa.Column('bearing', sa.Float(), nullable=True),
+        sa.Column('speed', sa.Float(), nullable=True),
+        sa.Column('timestamp', sa.Integer(), nullable=False),
+        sa.Column('congestion_level', sa.Integer(), nullable=False),
+        sa.Column('stop_id', sa.String(), nullable=False),
+        sa.Column('vehicle_id', sa.String(), nullable=False),
+        sa.Column('label', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id', 'request_timestamp'),
+        sa.ForeignKeyConstraint(['route_id'], ['routes.id']),
+        sa.ForeignKeyConstraint(['trip_id'], ['trips.id']),
+    ]
+
+
+def _day_bounds(day: date):
+    start = datetime.combine(day, time(), tzinfo=TIMEZONE)
+    end = datetime.combine(day + timedelta(days=1), time(), tzinfo=TIMEZONE)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def _days_with_data(bind, table: str):
+    "Service days between the first and last location that have rows"
+    first, last = bind.execute(sa.text(
+        f"SELECT MIN(request_timestamp), MAX(request_timestamp) FROM {table}"
+    )).one()
+    if first is None:
+        return []
+
+    day = datetime.fromtimestamp(first, TIMEZONE).date()
+    last_day = datetime.fromtimestamp(last, TIMEZONE).date()
+    days = []
+    while day <= last_day:
+        start, end = _day_bounds(day)
+        if bind.execute(sa.text(
+            f"SELECT EXISTS (SELECT 1 FROM {table} "
+            "WHERE request_timestamp >= :start AND request_timestamp < :end)"
+        ), {"start": start, "end": end}).scalar():
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def _sqlite_view(days):
+    if not days:
+        columns = [c.name for c in _columns() if isinstance(c, sa.Column)]
+        nulls = ", ".join(f"NULL AS {c}" for c in columns)
+        return f"CREATE VIEW locations AS SELECT {nulls} WHERE 0"
+    selects = [f"SELECT * FROM locations_{day:%Y%m%d}" for day in days]
+    # Nest the union so no compound select is over SQLite's limit
+    while len(selects) > MAX_COMPOUND_SELECT:
+        selects = [
+            "SELECT * FROM ("
+            + " UNION ALL ".join(selects[i:i + MAX_COMPOUND_SELECT])
+            + ")"
+            for i in range(0, len(selects), MAX_COMPOUND_SELECT)
+        ]
+    return "CREATE VIEW locations AS " + " UNION ALL ".join(selects)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    op.rename_table('locations', 'locations_unpartitioned')
+    days = _days_with_data(bind, 'locations_unpartitioned')
+
+    if bind.dialect.name == 'postgresql':
+        op.execute(
+            "ALTER TABLE locations_unpartitioned "
+            "RENAME CONSTRAINT locations_pkey TO locations_unpartitioned_pkey"
+        )
+        op.create_table('locations', *_columns(),
+            postgresql_partition_by='RANGE (request_timestamp)'
+        )
+        for day in days:
+            start, end = _day_bounds(day)
+            op.execute(
+                f"CREATE TABLE locations_{day:%Y%m%d} PARTITION OF locations "
+                f"FOR VALUES FROM ({start}) TO ({end})"
+            )
+        op.execute("INSERT INTO locations SELECT * FROM locations_unpartitioned")
+    else:
+        for day in days:
+            start, end = _day_bounds(day)
+            op.create_table(f'locations_{day:%Y%m%d}', *_columns())
+            op.execute(
+                f"INSERT INTO locations_{day:%Y%m%d} "
+                "SELECT * FROM locations_unpartitioned "
+                f"WHERE request_timestamp >= {start} AND request_timestamp < {end}"
+            )
+        op.execute(_sqlite_view(days))
+
+    op.drop_table('locations_unpartitioned')
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    op.create_table('locations_unpartitioned', *_columns())
+    op.execute("INSERT INTO locations_unpartitioned SELECT * FROM locations")
+
+    if bind.dialect.name == 'postgresql':
+        # Dropping the parent table also drops its partitions
+        op.drop_table('locations')
+        op.execute(
+            "ALTER TABLE locations_unpartitioned "
+            "RENAME CONSTRAINT locations_unpartitioned_pkey TO locations_pkey"
+        )
+    else:
+        op.execute("DROP VIEW locations")
+        tables = sa.inspect(bind).get_table_names()
+        for table in tables:
+            if table.startswith('locations_') and table[10:].isdigit():
+                op.drop_table(table)
+
+    op.rename_table('locations_unpartitioned', 'locations')
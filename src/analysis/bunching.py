@@ -7,13 +7,38 @@ row, then we could have a very fast search. However, buses could have
 non-linear routes where sorting on one field leaves the nearest buses in
 non-consecutive rows. Instead, we will do a cartesian product within
 each route and request_timestamp.
+
+The cartesian product grows with the square of the number of buses on a
+route. The grid functions avoid this by placing each bus in a lat / lon
+cell the size of the allowance, so a bus can only be bunched with buses
+in its own cell or one of the eight cells around it.
+
+Once each bus has been projected onto its route (see
+data.shapes.add_dist_traveled), the distance along the route gives the
+ordering we wanted. Sorting on it puts the next closest bus in the next
+row, even on routes that loop back on themselves.
+
+The groups are independent of each other, so they can also be split
+across processes with is_bunched_parallel.
 """
 
+from concurrent.futures import ProcessPoolExecutor
+import os
+from typing import Callable, Optional
+
+import numpy as np
 import pandas as pd
 import polars as pl
 
 LAT_ALLOWANCE = 0.002
 LON_ALLOWANCE = 0.002
+# Same units as shape_dist_traveled (metres), about the same as the
+# lat / lon allowance
+DIST_ALLOWANCE = 200
+
+# Half of the 3x3 neighbourhood. Each pair of cells is only compared
+# once and both buses in a close pair are marked as bunched.
+_NEIGHBOUR_CELLS = [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]
 
 
 def is_bunched(df: pd.DataFrame) -> pd.DataFrame:
@@ -75,3 +100,188 @@ def is_bunched_pl(df: [pl.DataFrame|pl.LazyFrame]) -> pl.DataFrame:
         return df.collect()
     except AttributeError:
         return df
+
+
+def is_bunched_grid(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Get a list of lat / lon that are bunches, using a spatial grid so that
+    each bus is only compared with buses in neighbouring cells. Gives the
+    same result as is_bunched.
+
+    Args:
+        df (pd.DataFrame): Locations with request_timestamp, short_name,
+            direction_id, lat and lon
+
+    Returns:
+        pd.DataFrame: Input dataframe with a bunched column added
+    """
+    join_on = ["request_timestamp", "short_name", "direction_id"]
+    cell_on = join_on + ["lat_cell", "lon_cell"]
+    points = (
+        df[join_on + ["lat", "lon"]]
+        .assign(row=np.arange(len(df)))
+        .dropna(subset=["lat", "lon"])
+    )
+    points["lat_cell"] = np.floor(points["lat"] / LAT_ALLOWANCE).astype("int64")
+    points["lon_cell"] = np.floor(points["lon"] / LON_ALLOWANCE).astype("int64")
+
+    bunched = np.zeros(len(df), dtype=bool)
+    for lat_step, lon_step in _NEIGHBOUR_CELLS:
+        neighbours = points.assign(
+            lat_cell=points["lat_cell"] - lat_step,
+            lon_cell=points["lon_cell"] - lon_step,
+        )
+        pairs = points.merge(neighbours, on=cell_on, suffixes=("1", "2")).query(
+            "((lat1 != lat2) or (lon1 != lon2)) "
+            f"and abs(lat1 - lat2) < {LAT_ALLOWANCE} "
+            f"and abs(lon1 - lon2) < {LON_ALLOWANCE}"
+        )
+        bunched[pairs["row1"].to_numpy()] = True
+        bunched[pairs["row2"].to_numpy()] = True
+
+    df = df.copy()
+    df["bunched"] = bunched
+    return df
+
+
+def is_bunched_grid_pl(df: [pl.DataFrame|pl.LazyFrame]) -> pl.DataFrame:
+    """
+    Get a list of lat / lon that are bunches, using a spatial grid so that
+    each bus is only compared with buses in neighbouring cells. Gives the
+    same result as is_bunched_pl.
+    """
+    join_on = ["request_timestamp", "short_name", "direction_id"]
+    cell_on = join_on + ["lat_cell", "lon_cell"]
+    df = df.with_row_index("_row")
+    points = (
+        df.select("_row", *join_on, "lat", "lon")
+        .drop_nulls(["lat", "lon"])
+        .with_columns(
+            (pl.col("lat") / LAT_ALLOWANCE).floor().cast(pl.Int64).alias("lat_cell"),
+            (pl.col("lon") / LON_ALLOWANCE).floor().cast(pl.Int64).alias("lon_cell"),
+        )
+    )
+
+    pairs = []
+    for lat_step, lon_step in _NEIGHBOUR_CELLS:
+        neighbours = points.with_columns(
+            pl.col("lat_cell") - lat_step, pl.col("lon_cell") - lon_step
+        )
+        close = points.join(neighbours, on=cell_on, how="inner").filter(
+            (
+                (pl.col("lat") != pl.col("lat_right"))
+                | (pl.col("lon") != pl.col("lon_right"))
+            )
+            & ((pl.col("lat") - pl.col("lat_right")).abs() < LAT_ALLOWANCE)
+            & ((pl.col("lon") - pl.col("lon_right")).abs() < LON_ALLOWANCE)
+        )
+        pairs.append(close.select("_row"))
+        pairs.append(close.select(pl.col("_row_right").alias("_row")))
+
+    bunches = pl.concat(pairs).unique().with_columns(pl.lit(True).alias("bunched"))
+    df = (
+        df.join(bunches, how="left", on="_row")
+        .sort("_row")
+        .drop("_row")
+        .with_columns(pl.col("bunched").fill_null(False).alias("bunched"))
+    )
+    try:
+        return df.collect()
+    except AttributeError:
+        return df
+
+
+def is_bunched_along_route(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Find bunches by comparing each bus with the buses directly ahead and
+    behind it on the route. Requires a dist_traveled column, e.g. from
+    data.shapes.add_dist_traveled. Buses at exactly the same distance are
+    treated as the same position, in the same way that is_bunched ignores
+    identical lat / lon.
+
+    Args:
+        df (pd.DataFrame): Locations with request_timestamp, short_name,
+            direction_id and dist_traveled
+
+    Returns:
+        pd.DataFrame: Input dataframe with a bunched column added
+    """
+    join_on = ["request_timestamp", "short_name", "direction_id"]
+    positions = (
+        df[join_on + ["dist_traveled"]].dropna(subset=["dist_traveled"])
+        .drop_duplicates()
+    )
+    positions["group"] = positions.groupby(join_on, dropna=False).ngroup()
+    positions = positions.sort_values(["group", "dist_traveled"])
+
+    same_group = positions["group"].eq(positions["group"].shift())
+    gap_behind = positions["dist_traveled"].diff().where(same_group)
+    gap_ahead = gap_behind.shift(-1)
+    positions["bunched"] = (gap_behind < DIST_ALLOWANCE) | (
+        gap_ahead < DIST_ALLOWANCE
+    )
+
+    df = df.join(
+        positions.drop(columns="group").set_index(join_on + ["dist_traveled"]),
+        how="left",
+        on=join_on + ["dist_traveled"],
+    )
+    df["bunched"] = df["bunched"].eq(True)
+    return df
+
+
+def _balanced_partitions(keys: pd.Series, n_partitions: int) -> np.ndarray:
+    "Assign each key to a partition so that partitions have similar row counts"
+    codes, uniques = pd.factorize(keys, use_na_sentinel=False)
+    sizes = np.bincount(codes, minlength=len(uniques))
+    loads = np.zeros(n_partitions, dtype="int64")
+    key_partition = np.empty(len(uniques), dtype="int64")
+    # Largest keys first, each to the partition with the fewest rows so far
+    for key in np.argsort(-sizes, kind="stable"):
+        key_partition[key] = np.argmin(loads)
+        loads[key_partition[key]] += sizes[key]
+    return key_partition[codes]
+
+
+def is_bunched_parallel(
+    df: pd.DataFrame,
+    workers: Optional[int] = None,
+    partition_by: str = "short_name",
+    bunching_func: Callable[[pd.DataFrame], pd.DataFrame] = is_bunched_grid,
+) -> pd.DataFrame:
+    """
+    Run a bunching function over partitions of the data in a process pool.
+    Rows are split by route or by request_timestamp, which are both part
+    of the bunching groups, so the result is identical to running
+    bunching_func on the whole dataframe.
+
+    Args:
+        df (pd.DataFrame): Locations with request_timestamp, short_name,
+            direction_id, lat and lon
+        workers (int, optional): Number of processes. Defaults to the
+            number of CPUs.
+        partition_by (str, optional): short_name or request_timestamp.
+            Defaults to "short_name".
+        bunching_func (Callable, optional): Pandas bunching function to run
+            on each partition. Defaults to is_bunched_grid.
+
+    Returns:
+        pd.DataFrame: Input dataframe with a bunched column added
+    """
+    if partition_by not in ("short_name", "request_timestamp"):
+        raise ValueError(f"Cannot partition bunching by {partition_by}")
+    workers = workers or os.cpu_count()
+    if workers == 1 or df.empty:
+        return bunching_func(df)
+
+    # More partitions than workers so that a slow partition does not
+    # leave the other workers idle
+    partition = _balanced_partitions(df[partition_by], workers * 4)
+    rows = [np.flatnonzero(partition == i) for i in range(workers * 4)]
+    rows = [r for r in rows if len(r)]
+
+    with ProcessPoolExecutor(workers) as pool:
+        results = list(pool.map(bunching_func, [df.iloc[r] for r in rows]))
+
+    order = np.argsort(np.concatenate(rows), kind="stable")
+    return pd.concat(results).iloc[order]
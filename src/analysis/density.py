@@ -0,0 +1,133 @@
+"""
+Bin bus positions into a grid so that maps can show where buses are, and
+where they bunch, without sending every position to the browser.
+
+Cells are a fixed size in metres, so the number of cells depends on the
+area shown and the cell size chosen for the zoom, not on how many
+positions there are. Points are placed in cells with array arithmetic
+and cells are counted with a single group by.
+
+Square cells are simplest. Hexagonal cells are the same distance from
+each of their neighbours, so they show density with less directional
+bias.
+"""
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from data.location_queries import BoundingBox
+
+METRES_PER_DEGREE = 111320.0
+# Metres per pixel at zoom 0 on the equator for 256 pixel web map tiles
+METRES_PER_PIXEL = 156543.03
+REFERENCE_LAT = -33.88
+CELL_PIXELS = 16
+_SQRT3 = np.sqrt(3)
+
+
+def cell_size_for_zoom(
+    zoom: float, pixels: int = CELL_PIXELS, lat: float = REFERENCE_LAT
+) -> float:
+    """Cell size in metres that covers a number of pixels at a zoom
+
+    Args:
+        zoom (float): Web map zoom level
+        pixels (int, optional): Width of a cell on screen. Defaults to
+            CELL_PIXELS.
+        lat (float, optional): Latitude of the map. Defaults to
+            REFERENCE_LAT.
+
+    Returns:
+        float: Cell size in metres
+    """
+    return pixels * METRES_PER_PIXEL * np.cos(np.radians(lat)) / 2**zoom
+
+
+def _square_cells(x: np.ndarray, y: np.ndarray, size: float):
+    "Cell indices and cell centres of a square grid"
+    i, j = np.floor(x / size), np.floor(y / size)
+    return i, j, (i + 0.5) * size, (j + 0.5) * size
+
+
+def _hex_cells(x: np.ndarray, y: np.ndarray, size: float):
+    """Axial cell indices and cell centres of a pointy top hexagon grid,
+    where size is the distance from a centre to a corner"""
+    q = (_SQRT3 / 3 * x - y / 3) / size
+    r = (2 / 3 * y) / size
+    # Round in cube coordinates, fixing the component that moved most
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    centre_x = size * (_SQRT3 * rq + _SQRT3 / 2 * rr)
+    centre_y = size * 1.5 * rr
+    return rq, rr, centre_x, centre_y
+
+
+def bin_positions(
+    df: pd.DataFrame,
+    cell_size: float,
+    grid: str = "hex",
+    bbox: Optional[BoundingBox] = None,
+) -> pd.DataFrame:
+    """Count positions in each grid cell
+
+    Args:
+        df (pd.DataFrame): Positions with lat and lon, and optionally a
+            bunched column, e.g. from analysis.bunching
+        cell_size (float): Cell size in metres. For hexagons this is the
+            distance from the centre to a corner
+        grid (str, optional): "hex" or "square". Defaults to "hex".
+        bbox (BoundingBox, optional): Only bin positions inside
+            (min_lon, min_lat, max_lon, max_lat). Defaults to None.
+
+    Raises:
+        ValueError: For an unknown grid
+
+    Returns:
+        pd.DataFrame: One row per occupied cell with the lat and lon of
+        its centre and a count. With a bunched column, bunching_rate is
+        the share of positions in the cell that were bunched
+    """
+    cells = {"hex": _hex_cells, "square": _square_cells}
+    if grid not in cells:
+        raise ValueError(f"Unknown grid {grid!r}, expected one of {list(cells)}")
+
+    lat = df["lat"].to_numpy(dtype=float)
+    lon = df["lon"].to_numpy(dtype=float)
+    keep = ~(np.isnan(lat) | np.isnan(lon))
+    if bbox is not None:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        keep &= (lon >= min_lon) & (lon <= max_lon)
+        keep &= (lat >= min_lat) & (lat <= max_lat)
+
+    # Equirectangular projection about a fixed latitude, which keeps the
+    # cells the same everywhere for a given size
+    scale = np.cos(np.radians(REFERENCE_LAT)) * METRES_PER_DEGREE
+    x, y = lon[keep] * scale, lat[keep] * METRES_PER_DEGREE
+    i, j, centre_x, centre_y = cells[grid](x, y, cell_size)
+
+    points = pd.DataFrame({
+        "i": i.astype(np.int64),
+        "j": j.astype(np.int64),
+        "lat": centre_y / METRES_PER_DEGREE,
+        "lon": centre_x / scale,
+    })
+    aggregations = {
+        "lat": ("lat", "first"),
+        "lon": ("lon", "first"),
+        "count": ("lat", "size"),
+    }
+    if "bunched" in df:
+        points["bunched"] = df["bunched"].to_numpy(dtype=float)[keep]
+        aggregations["bunching_rate"] = ("bunched", "mean")
+
+    return (
+        points.groupby(["i", "j"], sort=False)
+        .agg(**aggregations)
+        .reset_index(drop=True)
+    )
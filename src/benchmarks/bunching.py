@@ -0,0 +1,220 @@
+"""
+Benchmark the bunching implementations on synthetic feeds.
+
+Run this script from the src folder
+e.g. python -m benchmarks.bunching --rows 10000 100000 --output bench.csv
+
+Each implementation and size is run in a fresh process so that memory
+from one run does not affect the next. Each run is timed, then run again
+under tracemalloc to find the peak memory allocated by Python and numpy.
+Polars allocates outside of Python, so the peak resident memory of the
+process is also reported where the platform supports it.
+
+Implementations that run in worker processes allocate their memory in
+the workers, where tracemalloc cannot see it, so their peak Python
+memory is left empty. The largest peak resident memory of any worker is
+reported separately as peak_rss_children_mb.
+
+Once an implementation is slower than the time limit or fails, larger
+sizes are skipped for that implementation.
+"""
+import argparse
+import multiprocessing
+import os
+import platform
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import pandas as pd
+import polars as pl
+
+from analysis import bunching
+from benchmarks.synthetic import synthetic_feed_rows
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+ROWS = [10_000, 100_000, 1_000_000, 10_000_000]
+TIME_LIMIT = 120  # seconds
+
+# Each implementation is a function to prepare the input, which is not
+# timed, and the bunching function that is timed
+IMPLEMENTATIONS: Dict[str, Tuple[Callable, Callable]] = {
+    "pandas": (lambda df: df, bunching.is_bunched),
+    "pandas_grid": (lambda df: df, bunching.is_bunched_grid),
+    "pandas_grid_parallel": (lambda df: df, bunching.is_bunched_parallel),
+    "pandas_along_route": (lambda df: df, bunching.is_bunched_along_route),
+    "polars_eager": (pl.from_pandas, bunching.is_bunched_pl),
+    "polars_lazy": (lambda df: pl.from_pandas(df).lazy(), bunching.is_bunched_pl),
+    "polars_grid_eager": (pl.from_pandas, bunching.is_bunched_grid_pl),
+    "polars_grid_lazy": (
+        lambda df: pl.from_pandas(df).lazy(),
+        bunching.is_bunched_grid_pl,
+    ),
+}
+# Implementations that do their work in child processes when there is
+# more than one CPU
+MULTIPROCESS = {"pandas_grid_parallel"}
+
+
+def _peak_rss_mb(who: Optional[int] = None) -> float:
+    """Peak resident memory of this process, or with RUSAGE_CHILDREN of
+    the largest of its finished child processes"""
+    if resource is None:
+        return float("nan")
+    if who is None:
+        who = resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    if platform.system() == "Darwin":
+        return peak / 1024**2
+    return peak / 1024
+
+
+def _measure(name: str, rows: int, routes: int, buses_per_route: int, queue):
+    "Run one implementation on one size. Runs in a child process"
+    prepare, bunching_func = IMPLEMENTATIONS[name]
+    df = synthetic_feed_rows(rows, routes, buses_per_route)
+
+    data = prepare(df)
+    start = time.perf_counter()
+    result = bunching_func(data)
+    seconds = time.perf_counter() - start
+    del result
+
+    peak_python_mb = float("nan")
+    if name not in MULTIPROCESS or (os.cpu_count() or 1) == 1:
+        data = prepare(df)
+        tracemalloc.start()
+        bunching_func(data)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_python_mb = peak / 1024**2
+
+    queue.put({
+        "rows": len(df),
+        "seconds": seconds,
+        "peak_python_mb": peak_python_mb,
+        "peak_rss_mb": _peak_rss_mb(),
+        "peak_rss_children_mb": _peak_rss_mb(
+            resource.RUSAGE_CHILDREN if resource else None
+        ),
+    })
+
+
+def run_one(
+    name: str, rows: int, routes: int, buses_per_route: int, time_limit: float
+) -> dict:
+    """Measure one implementation and size in a fresh process
+
+    Returns:
+        dict: Measurements and a status of ok, timeout or failed
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(
+        target=_measure, args=(name, rows, routes, buses_per_route, queue)
+    )
+    process.start()
+    # Allow for generating the data and the second, profiled run
+    process.join(time_limit * 3)
+
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        return {"status": "timeout"}
+    if process.exitcode != 0 or queue.empty():
+        return {"status": "failed"}
+
+    result = queue.get()
+    status = "ok" if result["seconds"] <= time_limit else "timeout"
+    return result | {"status": status}
+
+
+def run_benchmarks(
+    rows=ROWS,
+    implementations=IMPLEMENTATIONS,
+    routes: int = 50,
+    buses_per_route: int = 20,
+    time_limit: float = TIME_LIMIT,
+) -> pd.DataFrame:
+    """Run every implementation at every size
+
+    Returns:
+        pd.DataFrame: One row per implementation and size
+    """
+    results = []
+    for name in implementations:
+        skip = False
+        for size in sorted(rows):
+            if skip:
+                result = {"status": "skipped"}
+            else:
+                result = run_one(name, size, routes, buses_per_route, time_limit)
+                skip = result["status"] != "ok"
+            result = {"implementation": name, "target_rows": size} | result
+            print(result)
+            results.append(result)
+
+    report = pd.DataFrame(results).assign(
+        routes=routes,
+        buses_per_route=buses_per_route,
+        python=platform.python_version(),
+        pandas=pd.__version__,
+        polars=pl.__version__,
+    )
+    return report
+
+
+def compare(report: pd.DataFrame, baseline: pd.DataFrame) -> pd.DataFrame:
+    """Compare a report with an earlier one. Ratios above 1 are slower or
+    use more memory than the baseline
+
+    Returns:
+        pd.DataFrame: Time and memory ratios for each implementation and size
+    """
+    keys = ["implementation", "target_rows"]
+    measures = ["seconds", "peak_python_mb", "peak_rss_mb", "peak_rss_children_mb"]
+    merged = report[keys + measures].merge(
+        baseline[keys + measures], on=keys, suffixes=("", "_baseline")
+    )
+    for measure in measures:
+        merged[f"{measure}_ratio"] = merged[measure] / merged[f"{measure}_baseline"]
+    return merged[keys + [f"{m}_ratio" for m in measures]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=ROWS)
+    parser.add_argument(
+        "--implementations", nargs="+", default=list(IMPLEMENTATIONS),
+        choices=list(IMPLEMENTATIONS),
+    )
+    parser.add_argument("--routes", type=int, default=50)
+    parser.add_argument("--buses-per-route", type=int, default=20)
+    parser.add_argument("--time-limit", type=float, default=TIME_LIMIT)
+    parser.add_argument("--output", type=Path, default=Path("bunching_benchmark.csv"))
+    parser.add_argument("--baseline", type=Path, help="Earlier report to compare")
+    args = parser.parse_args()
+
+    report = run_benchmarks(
+        args.rows,
+        args.implementations,
+        args.routes,
+        args.buses_per_route,
+        args.time_limit,
+    )
+    report.to_csv(args.output, index=False)
+    print(report.to_string(index=False))
+
+    if args.baseline:
+        print(compare(report, pd.read_csv(args.baseline)).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
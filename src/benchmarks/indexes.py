@@ -0,0 +1,246 @@
+"""
+Benchmark the secondary indexes on a generated SQLite database.
+
+Run this script from the src folder
+e.g. python -m benchmarks.indexes --polls 720 --output indexes.csv
+
+A database of routes, trips, stops, stop times and locations is generated,
+then each query is timed and its query plan shown without the secondary
+indexes and again with them. The queries are the ways the tables are
+read: locations for a time range joined to their route and trip, a
+route's locations in a time range, the locations of a trip, the stop
+times at a stop, and the trips of a route in one direction.
+"""
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Engine, Index, Select, create_engine, select, text
+
+from data.bulk import bulk_insert
+from data.model import Base, Location, Route, StopTime, Trip
+
+POLL_SECONDS = 30
+START_TIMESTAMP = 1694440800
+REPEATS = 5
+
+INDEXES: List[Index] = [
+    *Location.__table__.indexes,
+    *StopTime.__table__.indexes,
+    *Trip.__table__.indexes,
+]
+
+
+def generate_database(
+    con: Engine,
+    routes: int = 200,
+    trips_per_route: int = 50,
+    stops: int = 5000,
+    stops_per_trip: int = 30,
+    buses: int = 1000,
+    polls: int = 720,
+    seed: int = 0,
+):
+    """Fill an empty database with random schedule and location data
+
+    Args:
+        con (Engine): SQLAlchemy engine
+        routes (int, optional): Number of routes. Defaults to 200.
+        trips_per_route (int, optional): Defaults to 50.
+        stops (int, optional): Number of stops. Defaults to 5000.
+        stops_per_trip (int, optional): Defaults to 30.
+        buses (int, optional): Buses reporting at each poll. Defaults to 1000.
+        polls (int, optional): Number of request timestamps. Defaults to 720
+            (six hours of polling).
+        seed (int, optional): Random seed. Defaults to 0.
+    """
+    rng = np.random.default_rng(seed)
+    Base.metadata.create_all(con)
+
+    route_ids = np.array([f"r{i}" for i in range(routes)])
+    bulk_insert(pd.DataFrame({
+        "id": route_ids,
+        "agency_id": "a",
+        "short_name": [str(i) for i in range(routes)],
+        "long_name": "",
+        "description": "",
+        "type": 3,
+        "color": "",
+        "text_color": "",
+    }), Route.__tablename__, con)
+
+    trip_count = routes * trips_per_route
+    trip_ids = np.array([f"t{i}" for i in range(trip_count)])
+    trip_route = np.repeat(route_ids, trips_per_route)
+    bulk_insert(pd.DataFrame({
+        "id": trip_ids,
+        "route_id": trip_route,
+        "service_id": "1",
+        "shape_id": trip_route,
+        "trip_headsign": None,
+        "direction_id": np.arange(trip_count) % 2,
+        "wheelchair_accessible": 1,
+        "route_direction": "",
+    }), Trip.__tablename__, con)
+
+    bulk_insert(pd.DataFrame({
+        "trip_id": np.repeat(trip_ids, stops_per_trip),
+        "stop_sequence": np.tile(np.arange(stops_per_trip), trip_count),
+        "arrival_time": "",
+        "departure_time": "",
+        "stop_id": rng.integers(0, stops, trip_count * stops_per_trip).astype(str),
+        "stop_headsign": None,
+        "pickup_type": 0,
+        "drop_off_type": 0,
+        "shape_dist_traveled": 0.0,
+        "timepoint": 0,
+        "stop_note": None,
+    }), StopTime.__tablename__, con)
+
+    bus_trip = rng.integers(0, trip_count, buses)
+    for poll in range(polls):
+        timestamp = START_TIMESTAMP + poll * POLL_SECONDS
+        bulk_insert(pd.DataFrame({
+            "id": np.arange(buses).astype(str),
+            "request_timestamp": timestamp,
+            "trip_id": trip_ids[bus_trip],
+            "route_id": trip_route[bus_trip],
+            "schedule_relationship": 0,
+            "lat": rng.uniform(-34, -33.5, buses),
+            "lon": rng.uniform(150.8, 151.3, buses),
+            "bearing": rng.uniform(0, 360, buses),
+            "speed": rng.uniform(0, 20, buses),
+            "timestamp": timestamp,
+            "congestion_level": 0,
+            "stop_id": "",
+            "vehicle_id": np.arange(buses).astype(str),
+            "label": "",
+        }), Location.__tablename__, con)
+
+
+def queries(con: Engine, polls: int) -> Dict[str, Select]:
+    "The queries to time, each reading a small part of a table"
+    start = START_TIMESTAMP + (polls // 2) * POLL_SECONDS
+    end = start + 3600
+    with con.connect() as connection:
+        trip_id, route_id = connection.execute(
+            select(Location.trip_id, Location.route_id).limit(1)
+        ).one()
+    return {
+        "locations_time_range": (
+            select(
+                Location.lat,
+                Location.lon,
+                Location.bearing,
+                Location.speed,
+                Location.request_timestamp,
+                Trip.direction_id,
+                Trip.route_direction,
+                Trip.shape_id,
+                Route.short_name,
+            )
+            .join(Route, Location.route_id == Route.id)
+            .join(Trip, Location.trip_id == Trip.id)
+            .where(Location.request_timestamp >= start)
+            .where(Location.request_timestamp < end)
+        ),
+        "route_locations_time_range": (
+            select(Location.lat, Location.lon, Location.request_timestamp)
+            .where(Location.request_timestamp >= start)
+            .where(Location.request_timestamp < end)
+            .where(Location.route_id == route_id)
+        ),
+        "trip_locations": select(Location).where(Location.trip_id == trip_id),
+        "stop_times_at_stop": select(StopTime).where(StopTime.stop_id == "1"),
+        "route_direction_trips": (
+            select(Trip)
+            .where(Trip.route_id == route_id)
+            .where(Trip.direction_id == 0)
+        ),
+    }
+
+
+def query_plan(con: Engine, stmt: Select) -> str:
+    "SQLite's plan for a query"
+    sql = str(stmt.compile(con, compile_kwargs={"literal_binds": True}))
+    with con.connect() as connection:
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+    return "\n".join(row[-1] for row in rows)
+
+
+def time_query(con: Engine, stmt: Select, repeats: int = REPEATS) -> Dict:
+    "Median time to run a query and fetch every row"
+    seconds = []
+    with con.connect() as connection:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            rows = len(connection.execute(stmt).all())
+            seconds.append(time.perf_counter() - start)
+    return {"rows": rows, "seconds": statistics.median(seconds)}
+
+
+def _set_indexes(con: Engine, action: Callable):
+    with con.begin() as connection:
+        for index in INDEXES:
+            action(index, connection)
+        connection.execute(text("ANALYZE"))
+
+
+def run_benchmarks(con: Engine, polls: int, repeats: int = REPEATS) -> pd.DataFrame:
+    """Time each query and show its plan without and with the indexes
+
+    Returns:
+        pd.DataFrame: One row per query with and without indexes
+    """
+    results = []
+    for indexed in [False, True]:
+        if indexed:
+            _set_indexes(con, lambda index, c: index.create(c, checkfirst=True))
+        else:
+            _set_indexes(con, lambda index, c: index.drop(c, checkfirst=True))
+
+        for name, stmt in queries(con, polls).items():
+            plan = query_plan(con, stmt)
+            result = {"query": name, "indexes": indexed} | time_query(
+                con, stmt, repeats
+            )
+            print(result)
+            print(plan)
+            results.append(result | {"plan": plan})
+
+    report = pd.DataFrame(results)
+    before = report[~report["indexes"]].set_index("query")["seconds"]
+    report["speedup"] = report["query"].map(before) / report["seconds"]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", type=Path, help="SQLite file to create")
+    parser.add_argument("--polls", type=int, default=720)
+    parser.add_argument("--buses", type=int, default=1000)
+    parser.add_argument("--routes", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--output", type=Path, default=Path("indexes_benchmark.csv"))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        database = args.database or Path(folder) / "benchmark.db"
+        con = create_engine(f"sqlite:///{database}")
+        generate_database(
+            con, routes=args.routes, buses=args.buses, polls=args.polls
+        )
+        report = run_benchmarks(con, args.polls, args.repeats)
+        con.dispose()
+
+    report.to_csv(args.output, index=False)
+    print(report.drop(columns="plan").to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
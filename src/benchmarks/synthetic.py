@@ -0,0 +1,66 @@
+"""
+Generate synthetic vehicle positions for benchmarking.
+
+Each route is a straight line out of the city. Buses are spread along
+the route and move a little further at each poll, wrapping back to the
+start when they reach the end. The output has the columns that the
+bunching functions need, plus an id and the distance along the route.
+"""
+import numpy as np
+import pandas as pd
+
+CENTRE_LAT = -33.88357
+CENTRE_LON = 151.206
+ROUTE_LENGTH = 20_000  # metres
+METRES_PER_DEGREE = 111_000
+POLL_SECONDS = 60
+START_TIMESTAMP = 1694419200
+
+
+def synthetic_feed(
+    routes: int = 50, buses_per_route: int = 20, polls: int = 10, seed: int = 0
+) -> pd.DataFrame:
+    """Create one row per bus per poll
+
+    Args:
+        routes (int, optional): Number of routes. Defaults to 50.
+        buses_per_route (int, optional): Buses on each route at each poll.
+            Defaults to 20.
+        polls (int, optional): Number of request timestamps. Defaults to 10.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: Positions with id, request_timestamp, short_name,
+        direction_id, lat, lon and dist_traveled
+    """
+    rng = np.random.default_rng(seed)
+    buses = routes * buses_per_route
+
+    bus_route = np.repeat(np.arange(routes), buses_per_route)
+    bus_start = rng.uniform(0, ROUTE_LENGTH, buses)
+    bus_speed = rng.uniform(100, 600, buses)  # metres per poll
+    route_angle = rng.uniform(0, 2 * np.pi, routes)
+
+    poll = np.repeat(np.arange(polls), buses)
+    bus = np.tile(np.arange(buses), polls)
+    route = bus_route[bus]
+    dist = (bus_start[bus] + bus_speed[bus] * poll) % ROUTE_LENGTH
+    angle = route_angle[route]
+
+    return pd.DataFrame({
+        "id": bus.astype(str),
+        "request_timestamp": START_TIMESTAMP + poll * POLL_SECONDS,
+        "short_name": route.astype(str),
+        "direction_id": route % 2,
+        "lat": CENTRE_LAT + dist * np.sin(angle) / METRES_PER_DEGREE,
+        "lon": CENTRE_LON + dist * np.cos(angle) / METRES_PER_DEGREE,
+        "dist_traveled": dist,
+    })
+
+
+def synthetic_feed_rows(
+    rows: int, routes: int = 50, buses_per_route: int = 20, seed: int = 0
+) -> pd.DataFrame:
+    "Create a synthetic feed with about the requested number of rows"
+    polls = max(1, round(rows / (routes * buses_per_route)))
+    return synthetic_feed(routes, buses_per_route, polls, seed)
@@ -0,0 +1,143 @@
+"""
+Live map of bus positions and bunching.
+
+Every browser polls on a timer, but the locations come from one shared
+LiveWindow, so the database is read once per poll however many viewers
+there are, and only for rows newer than those already held. Each
+browser remembers the last request_timestamp it has drawn. The map is
+updated with a Patch of the latest positions and the bunching chart
+with extendData of the polls it has not seen, so the full figures are
+only sent when the page loads.
+
+Run with `python dashboard.py` from the src folder.
+"""
+from typing import Optional
+
+from dash import Dash, Input, Output, Patch, State, dcc, html, no_update
+import pandas as pd
+import plotly.graph_objects as go
+
+from analysis import bunching
+from data.live import LiveWindow
+from data.location_queries import DEFAULT_COLUMNS
+from data.locations import query_locations
+from visualisations import maps
+
+POLL_MS = 30 * 1000
+# Polls kept on the bunching chart, one per minute
+MAX_POINTS = 24 * 60
+BUNCHED_COLOUR = "#d62728"
+
+
+def _query(start: int) -> pd.DataFrame:
+    return query_locations(start=start, columns=DEFAULT_COLUMNS)
+
+
+live = LiveWindow(_query, transform=bunching.is_bunched_grid)
+
+
+def position_figure() -> go.Figure:
+    "Map with an empty trace for buses and one for bunched buses"
+    fig = maps.get_base_map(zoom=10)
+    for name, size in [("Buses", 6), ("Bunched", 12)]:
+        fig.add_trace(
+            go.Scattermapbox(
+                mode="markers",
+                lat=[],
+                lon=[],
+                name=name,
+                marker={"size": size},
+                hoverinfo="text",
+            )
+        )
+    fig.data[1].marker.color = BUNCHED_COLOUR
+    fig.update_layout(uirevision="live")
+    return fig
+
+
+def bunching_figure() -> go.Figure:
+    "Chart of the number of bunched buses in each poll"
+    fig = go.Figure(go.Scatter(x=[], y=[], mode="lines", name="Bunched buses"))
+    fig.update_layout(
+        margin={"l": 40, "t": 10, "b": 30, "r": 10},
+        xaxis={"type": "date"},
+        yaxis={"title": "Bunched buses"},
+    )
+    return fig
+
+
+def position_patch(snapshot: pd.DataFrame) -> Patch:
+    """Replace the markers with one poll of positions
+
+    Args:
+        snapshot (pd.DataFrame): Locations from one request_timestamp with
+            a bunched column
+
+    Returns:
+        Patch: Changes to the position figure
+    """
+    patch = Patch()
+    text = snapshot["short_name"].astype(str)
+    bunched = snapshot["bunched"].to_numpy(dtype=bool)
+    patch["data"][0]["lat"] = snapshot["lat"].tolist()
+    patch["data"][0]["lon"] = snapshot["lon"].tolist()
+    patch["data"][0]["text"] = text.tolist()
+    patch["data"][0]["marker"]["color"] = maps.category_colours(text).tolist()
+    patch["data"][1]["lat"] = snapshot.loc[bunched, "lat"].tolist()
+    patch["data"][1]["lon"] = snapshot.loc[bunched, "lon"].tolist()
+    patch["data"][1]["text"] = text[bunched].tolist()
+    return patch
+
+
+def bunching_points(new: pd.DataFrame) -> tuple:
+    """extendData for the bunching chart from locations a viewer has not
+    seen, one point per poll
+
+    Args:
+        new (pd.DataFrame): Locations with a bunched column
+
+    Returns:
+        tuple: Data to add, the trace to add it to and MAX_POINTS
+    """
+    counts = new.groupby("request_timestamp")["bunched"].sum().sort_index()
+    times = pd.to_datetime(counts.index, unit="s", utc=True).tz_convert(
+        "Australia/Sydney"
+    )
+    data = {
+        "x": [times.strftime("%Y-%m-%d %H:%M:%S").tolist()],
+        "y": [counts.astype(int).tolist()],
+    }
+    return data, [0], MAX_POINTS
+
+
+app = Dash(__name__, title="Bus bunching")
+app.layout = html.Div([
+    html.H3("Live bus positions"),
+    dcc.Graph(id="positions", figure=position_figure(), style={"height": "70vh"}),
+    dcc.Graph(id="bunching", figure=bunching_figure(), style={"height": "25vh"}),
+    dcc.Store(id="last-seen"),
+    dcc.Interval(id="poll", interval=POLL_MS),
+])
+
+
+@app.callback(
+    Output("positions", "figure"),
+    Output("bunching", "extendData"),
+    Output("last-seen", "data"),
+    Input("poll", "n_intervals"),
+    State("last-seen", "data"),
+)
+def update(_, last_seen: Optional[int]):
+    "Send each viewer only the polls it has not drawn yet"
+    locations = live.refresh()
+    new = live.since(last_seen)
+    if new.empty:
+        return no_update, no_update, no_update
+
+    latest = int(locations["request_timestamp"].max())
+    snapshot = locations[locations["request_timestamp"] == latest]
+    return position_patch(snapshot), bunching_points(new), latest
+
+
+if __name__ == "__main__":
+    app.run(debug=False)
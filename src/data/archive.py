@@ -0,0 +1,220 @@
+"""
+Archive raw vehicle positions to Parquet files, so that months of history
+can be analysed without reading the locations table.
+
+Each poll is first written to its own file in a staging folder. Once an
+hour has finished, its polls are rolled up into one file per route in a
+folder per service day:
+
+    archive/date=2023-09-11/route_id=2436_600/1694422800-...-0.parquet
+
+Ids are dictionary encoded in the files, coordinates are float32 and
+files are zstd compressed. scan_archive reads the archive lazily with
+polars, which skips the day and route folders and the row groups that a
+filter rules out. Ids are read as strings, so that files with different
+dictionaries can be combined without a global string cache.
+"""
+import os
+from pathlib import Path
+import time
+from typing import Dict, List, Optional, Sequence, Union
+
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from data.partitions import service_days
+
+HOUR = 3600
+COMPRESSION = "zstd"
+
+# Strings are dictionary encoded when written, see _WRITE_OPTIONS
+_ID = pa.string()
+ARCHIVE_SCHEMA = pa.schema([
+    ("id", _ID),
+    ("request_timestamp", pa.int64()),
+    ("trip_id", _ID),
+    ("route_id", _ID),
+    ("schedule_relationship", pa.int8()),
+    ("lat", pa.float32()),
+    ("lon", pa.float32()),
+    ("bearing", pa.float32()),
+    ("speed", pa.float32()),
+    ("timestamp", pa.int64()),
+    ("congestion_level", pa.int8()),
+    ("stop_id", _ID),
+    ("vehicle_id", _ID),
+    ("label", _ID),
+])
+_WRITE_OPTIONS = {"compression": COMPRESSION, "use_dictionary": True}
+PARTITIONING = ds.partitioning(
+    pa.schema([("date", pa.string()), ("route_id", pa.string())]), flavor="hive"
+)
+
+
+def to_archive_table(df: pd.DataFrame) -> pa.Table:
+    """Convert positions to the compact archive schema
+
+    Args:
+        df (pd.DataFrame): Positions from decode_positions_dataframe
+
+    Returns:
+        pa.Table: Positions with float32 coordinates and small integers
+    """
+    df = df[ARCHIVE_SCHEMA.names].copy()
+    for field in ARCHIVE_SCHEMA:
+        if not pa.types.is_string(field.type):
+            # Positions flattened without with_position_types have blanks
+            df[field.name] = pd.to_numeric(df[field.name], errors="coerce")
+    return pa.Table.from_pandas(df, schema=ARCHIVE_SCHEMA, preserve_index=False)
+
+
+def stage_poll(df: pd.DataFrame, staging_folder: Path) -> Path:
+    """Save one poll to the staging folder until its hour is rolled up
+
+    Args:
+        df (pd.DataFrame): Positions from one poll
+        staging_folder (Path): Folder of polls that are not archived yet
+
+    Returns:
+        Path: Staged file, named after the request timestamp
+    """
+    staging_folder.mkdir(parents=True, exist_ok=True)
+    request_timestamp = int(df["request_timestamp"].iloc[0])
+    path = staging_folder / f"{request_timestamp}.parquet"
+
+    # Write to a temporary name so a roll up never reads half a file
+    part_path = path.with_suffix(".part")
+    pq.write_table(to_archive_table(df), part_path, **_WRITE_OPTIONS)
+    os.replace(part_path, path)
+    return path
+
+
+def _staged_hours(staging_folder: Path) -> Dict[int, List[Path]]:
+    "Staged files grouped by the start of their hour"
+    hours = {}
+    for path in sorted(staging_folder.glob("*.parquet")):
+        hour = int(path.stem) // HOUR * HOUR
+        hours.setdefault(hour, []).append(path)
+    return hours
+
+
+def roll_up(
+    staging_folder: Path, archive_folder: Path, before: Optional[float] = None
+) -> int:
+    """Move the staged polls of each finished hour into the archive
+
+    Rolling up the same polls twice, e.g. after a crash before the staged
+    files were removed, overwrites the same archive files.
+
+    Args:
+        staging_folder (Path): Folder of staged polls
+        archive_folder (Path): Root of the archive
+        before (float, optional): Only roll up hours that end by this time.
+            Defaults to now.
+
+    Returns:
+        int: Number of positions archived
+    """
+    before = time.time() if before is None else before
+    rows = 0
+    for hour, paths in _staged_hours(staging_folder).items():
+        if hour + HOUR > before:
+            continue
+
+        table = pa.concat_tables([pq.read_table(p) for p in paths])
+        days = service_days(pd.Series(table["request_timestamp"].to_numpy()))
+        table = table.append_column(
+            "date", pa.array(days.astype(str).to_numpy(), pa.string())
+        )
+        first, last = paths[0].stem, paths[-1].stem
+        ds.write_dataset(
+            table,
+            archive_folder,
+            format="parquet",
+            partitioning=PARTITIONING,
+            basename_template=f"{first}-{last}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            file_options=ds.ParquetFileFormat().make_write_options(
+                **_WRITE_OPTIONS
+            ),
+        )
+        for path in paths:
+            path.unlink()
+        rows += len(table)
+    return rows
+
+
+def scan_archive(
+    archive_folder: Path,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    route_ids: Optional[Sequence[str]] = None,
+) -> pl.LazyFrame:
+    """Scan the archive lazily. Filters on the day and route folders and on
+    request_timestamp are pushed down to the Parquet reader, so only the
+    files and row groups that can match are read
+
+    Args:
+        archive_folder (Path): Root of the archive
+        start (int, optional): First request timestamp. Defaults to None.
+        end (int, optional): Request timestamp to stop before. Defaults to
+            None.
+        route_ids (Sequence[str], optional): Only these routes. Defaults to
+            None.
+
+    Returns:
+        pl.LazyFrame: Archived positions with date and route_id columns
+    """
+    if not any(archive_folder.glob("date=*/route_id=*/*.parquet")):
+        schema = pl.from_arrow(ARCHIVE_SCHEMA.empty_table()).schema
+        return pl.LazyFrame(schema=schema | {"date": pl.Date, "route_id": pl.String})
+
+    positions = pl.scan_parquet(
+        archive_folder / "date=*" / "route_id=*" / "*.parquet",
+        hive_partitioning=True,
+        hive_schema={"date": pl.Date, "route_id": pl.String},
+    )
+    if start is not None:
+        day = service_days(pd.Series([start])).iloc[0]
+        positions = positions.filter(
+            pl.col("date") >= day, pl.col("request_timestamp") >= start
+        )
+    if end is not None:
+        # end is exclusive, so the last day is the day of the second before
+        day = service_days(pd.Series([end - 1])).iloc[0]
+        positions = positions.filter(
+            pl.col("date") <= day, pl.col("request_timestamp") < end
+        )
+    if route_ids is not None:
+        positions = positions.filter(pl.col("route_id").is_in(list(route_ids)))
+    return positions
+
+
+def scan_archive_locations(
+    archive_folder: Path,
+    trips: Union[pl.DataFrame, pl.LazyFrame],
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    route_ids: Optional[Sequence[str]] = None,
+) -> pl.LazyFrame:
+    """Scan the archive with the trip details that analysis.bunching needs,
+    e.g. is_bunched_pl(scan_archive_locations(...))
+
+    Args:
+        archive_folder (Path): Root of the archive
+        trips (Union[pl.DataFrame, pl.LazyFrame]): trip_id with columns to
+            add such as short_name and direction_id
+        start (int, optional): First request timestamp. Defaults to None.
+        end (int, optional): Request timestamp to stop before. Defaults to
+            None.
+        route_ids (Sequence[str], optional): Only these routes. Defaults to
+            None.
+
+    Returns:
+        pl.LazyFrame: Archived positions joined to their trips
+    """
+    positions = scan_archive(archive_folder, start, end, route_ids)
+    return positions.join(trips.lazy(), on="trip_id", how="inner")
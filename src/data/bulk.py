@@ -0,0 +1,201 @@
+"""
+Bulk inserts of dataframes.
+
+DataFrame.to_sql binds parameters row by row through pandas. These
+functions use the fastest path that the database offers instead:
+COPY FROM STDIN on PostgreSQL and a single executemany inside one
+transaction on everything else. The database is detected from the
+engine, so the SQLDRIVER setting also selects the insert method.
+
+Each method can either fail on rows that already exist or skip them, so
+that retried polls and backfills only add the rows that are missing.
+"""
+import io
+
+import pandas as pd
+from sqlalchemy import Engine, Insert, MetaData, Table, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+ON_CONFLICT = ("error", "ignore")
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _records(df: pd.DataFrame) -> list:
+    "Rows as dictionaries of Python values with None for nulls"
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+def copy_insert(
+    df: pd.DataFrame, table_name: str, con: Engine, on_conflict: str = "error"
+) -> int:
+    """Insert rows with PostgreSQL COPY FROM STDIN. Supports psycopg2 and
+    psycopg 3. To skip existing rows, the rows are copied to a temporary
+    table and inserted from there with ON CONFLICT DO NOTHING
+
+    Args:
+        df (pd.DataFrame): Rows with columns named as in the table
+        table_name (str): Table to insert into
+        con (Engine): PostgreSQL engine
+        on_conflict (str, optional): error or ignore. Defaults to "error".
+
+    Returns:
+        int: Number of rows inserted
+    """
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep="\\N")
+    buffer.seek(0)
+
+    columns = ", ".join(_quote(c) for c in df.columns)
+    copy_table = _quote(table_name)
+    if on_conflict == "ignore":
+        copy_table = _quote(f"_{table_name}_copy")
+    sql = (
+        f"COPY {copy_table} ({columns}) "
+        "FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    )
+    raw = con.raw_connection()
+    try:
+        cursor = raw.cursor()
+        if on_conflict == "ignore":
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {copy_table} "
+                f"(LIKE {_quote(table_name)} INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+        if hasattr(cursor, "copy_expert"):
+            cursor.copy_expert(sql, buffer)
+        else:
+            with cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+        rows = len(df)
+        if on_conflict == "ignore":
+            cursor.execute(
+                f"INSERT INTO {_quote(table_name)} ({columns}) "
+                f"SELECT {columns} FROM {copy_table} ON CONFLICT DO NOTHING"
+            )
+            rows = cursor.rowcount
+        cursor.close()
+        raw.commit()
+    finally:
+        raw.close()
+    return rows
+
+
+def _insert_sql(table_name: str, columns: list, dialect: str, on_conflict: str):
+    "Insert statement with named parameters, optionally skipping existing rows"
+    insert, suffix = "INSERT INTO", ""
+    if on_conflict == "ignore":
+        if dialect == "sqlite":
+            insert = "INSERT OR IGNORE INTO"
+        elif dialect in ("mysql", "mariadb"):
+            insert = "INSERT IGNORE INTO"
+        elif dialect == "postgresql":
+            suffix = " ON CONFLICT DO NOTHING"
+        else:
+            raise ValueError(f"Cannot ignore conflicts on {dialect}")
+    names = ", ".join(_quote(c) for c in columns)
+    values = ", ".join(f":{c}" for c in columns)
+    return text(f"{insert} {_quote(table_name)} ({names}) VALUES ({values}){suffix}")
+
+
+def executemany_insert(
+    df: pd.DataFrame, table_name: str, con: Engine, on_conflict: str = "error"
+) -> int:
+    """Insert rows with a single executemany inside one transaction
+
+    Args:
+        df (pd.DataFrame): Rows with columns named as in the table
+        table_name (str): Table to insert into
+        con (Engine): SQLAlchemy engine
+        on_conflict (str, optional): error or ignore. Defaults to "error".
+
+    Returns:
+        int: Number of rows inserted
+    """
+    stmt = _insert_sql(table_name, list(df.columns), con.dialect.name, on_conflict)
+    with con.begin() as connection:
+        result = connection.execute(stmt, _records(df))
+    # Not every driver reports the row count for executemany
+    return result.rowcount if result.rowcount >= 0 else len(df)
+
+
+def _insert_ignore_statement(table: Table, dialect: str) -> Insert:
+    "Insert statement for a table that skips rows that already exist"
+    if dialect == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    if dialect in ("mysql", "mariadb"):
+        return table.insert().prefix_with("IGNORE")
+    raise ValueError(f"Cannot ignore conflicts on {dialect}")
+
+
+def _insert_ignore(pd_table, connection, keys, data_iter) -> int:
+    "pandas to_sql method that skips rows that already exist"
+    table = Table(pd_table.name, MetaData(), autoload_with=connection)
+    stmt = _insert_ignore_statement(table, connection.dialect.name)
+    rows = [dict(zip(keys, row)) for row in data_iter]
+    return connection.execute(stmt, rows).rowcount
+
+
+def to_sql_insert(
+    df: pd.DataFrame, table_name: str, con: Engine, on_conflict: str = "error"
+) -> int:
+    "Insert rows with pandas, as before bulk inserts were added"
+    method = _insert_ignore if on_conflict == "ignore" else None
+    rows = df.to_sql(
+        table_name,
+        con,
+        if_exists="append",
+        index=False,
+        chunksize=20000,
+        method=method,
+    )
+    return rows if rows is not None and rows >= 0 else len(df)
+
+
+INSERT_METHODS = {
+    "copy": copy_insert,
+    "executemany": executemany_insert,
+    "to_sql": to_sql_insert,
+}
+
+
+def insert_method(con: Engine) -> str:
+    "Fastest insert method for the database behind an engine"
+    if con.dialect.name == "postgresql":
+        return "copy"
+    return "executemany"
+
+
+def bulk_insert(
+    df: pd.DataFrame,
+    table_name: str,
+    con: Engine,
+    method: str = "auto",
+    on_conflict: str = "error",
+) -> int:
+    """Append a dataframe to a table using a bulk insert
+
+    Args:
+        df (pd.DataFrame): Rows with columns named as in the table
+        table_name (str): Table to insert into
+        con (Engine): SQLAlchemy engine
+        method (str, optional): copy, executemany, to_sql or auto to pick
+            from the engine's database. Defaults to "auto".
+        on_conflict (str, optional): error to fail when a primary key
+            already exists, or ignore to skip those rows. Defaults to
+            "error".
+
+    Returns:
+        int: Number of rows inserted
+    """
+    if on_conflict not in ON_CONFLICT:
+        raise ValueError(f"on_conflict must be one of {ON_CONFLICT}")
+    if df.empty:
+        return 0
+    if method == "auto":
+        method = insert_method(con)
+    return INSERT_METHODS[method](df, table_name, con, on_conflict)
@@ -0,0 +1,130 @@
+"""
+Read query results straight into polars, without building a pandas
+DataFrame first.
+
+When connectorx is installed, whole results are read by connectorx into
+Arrow memory that polars uses as is. Otherwise polars builds columns
+from the rows of the SQLAlchemy cursor. Batches always come from the
+cursor, so that only one batch is held in memory at a time.
+"""
+from typing import Iterator, Optional, Union
+
+import polars as pl
+from sqlalchemy import Engine, Executable
+
+try:
+    import connectorx
+except ImportError:  # Optional, polars reads from the cursor instead
+    connectorx = None
+
+BATCH_SIZE = 100_000
+_DTYPES = {int: pl.Int64, float: pl.Float64, str: pl.String, bool: pl.Boolean}
+
+
+def _connectorx_uri(con: Engine) -> Optional[str]:
+    "Connection string for connectorx, or None when it cannot be used"
+    url = con.url
+    backend = url.get_backend_name()
+    if connectorx is None or backend not in ("postgresql", "sqlite"):
+        return None
+    if backend == "sqlite" and url.database in (None, "", ":memory:"):
+        return None
+    if backend == "postgresql" and not url.host:
+        # connectorx cannot connect through a unix socket
+        return None
+    return url.set(drivername=backend).render_as_string(hide_password=False)
+
+
+def schema_of(stmt: Executable) -> dict:
+    """Polars dtypes of the columns a select statement returns, so that
+    every read and batch has the same schema even when values are null
+
+    Args:
+        stmt (Executable): SQLAlchemy select, or a text query which has no
+            known columns
+
+    Returns:
+        dict: Polars dtype of each column with a known Python type
+    """
+    schema = {}
+    for column in getattr(stmt, "selected_columns", []):
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            continue
+        if python_type in _DTYPES:
+            schema[column.name] = _DTYPES[python_type]
+    return schema
+
+
+def _sql(stmt: Executable, con: Engine) -> str:
+    "Query as SQL text with its parameters filled in"
+    return str(stmt.compile(con, compile_kwargs={"literal_binds": True}))
+
+
+def read_polars(
+    stmt: Executable,
+    con: Engine,
+    lazy: bool = False,
+    schema_overrides: Optional[dict] = None,
+) -> Union[pl.DataFrame, pl.LazyFrame]:
+    """Read the whole result of a query into polars
+
+    Args:
+        stmt (Executable): SQLAlchemy select or text query
+        con (Engine): SQLAlchemy engine
+        lazy (bool, optional): Return a LazyFrame. Defaults to False.
+        schema_overrides (dict, optional): Polars dtypes for some columns.
+            Defaults to the dtypes from schema_of.
+
+    Returns:
+        Union[pl.DataFrame, pl.LazyFrame]: Query result
+    """
+    schema_overrides = schema_overrides or schema_of(stmt)
+    uri = _connectorx_uri(con)
+    if uri is not None:
+        df = pl.read_database_uri(_sql(stmt, con), uri, engine="connectorx")
+        if schema_overrides:
+            df = df.cast(schema_overrides)
+    else:
+        with con.connect() as connection:
+            df = pl.read_database(
+                stmt,
+                connection,
+                schema_overrides=schema_overrides,
+                infer_schema_length=None,
+            )
+    return df.lazy() if lazy else df
+
+
+def iter_polars(
+    stmt: Executable,
+    con: Engine,
+    batch_size: int = BATCH_SIZE,
+    schema_overrides: Optional[dict] = None,
+) -> Iterator[pl.DataFrame]:
+    """Read the result of a query into polars a batch of rows at a time
+
+    Args:
+        stmt (Executable): SQLAlchemy select or text query
+        con (Engine): SQLAlchemy engine
+        batch_size (int, optional): Rows in each batch. Defaults to
+            BATCH_SIZE.
+        schema_overrides (dict, optional): Polars dtypes for some columns.
+            Defaults to the dtypes from schema_of.
+
+    Yields:
+        pl.DataFrame: Up to batch_size rows of the result
+    """
+    schema_overrides = schema_overrides or schema_of(stmt)
+    with con.connect() as connection:
+        # Fetch from the server in batches too, rather than all at once
+        connection = connection.execution_options(stream_results=True)
+        yield from pl.read_database(
+            stmt,
+            connection,
+            iter_batches=True,
+            batch_size=batch_size,
+            schema_overrides=schema_overrides,
+            infer_schema_length=None,
+        )
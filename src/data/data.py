@@ -13,6 +13,7 @@ FILENAME_SCHEDULE = 'gtfs.zip'
 
 path = Path(os.getenv("DATA_PATH"))
 zip_path = Path(path / FILENAME_SCHEDULE)
+archive_path = Path(path / "archive")
 
 con_str = os.getenv("SQLDRIVER")
 engine = create_engine(con_str)
@@ -0,0 +1,165 @@
+"""
+Download large files in chunks to a temporary file.
+
+The ETag and Last-Modified headers of each download are saved next to
+the file, so that the next request can ask the server to skip the
+download when nothing has changed. Those validators are only recorded as
+loaded by mark_loaded, once the caller has processed the file, so a file
+that was downloaded but failed to load is offered again. Interrupted
+downloads are resumed with a Range request, and the file is only replaced
+once the download is complete and verified.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Callable, Optional
+
+import requests
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _metadata_path(path: Path) -> Path:
+    return path.with_name(f"{path.name}.json")
+
+
+def _read_metadata(path: Path) -> dict:
+    try:
+        return json.loads(_metadata_path(path).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _loaded_path(path: Path) -> Path:
+    return path.with_name(f"{path.name}.loaded.json")
+
+
+def _is_loaded(path: Path) -> bool:
+    "Whether the saved file is the one last marked as loaded"
+    try:
+        loaded = json.loads(_loaded_path(path).read_text())
+    except (FileNotFoundError, ValueError):
+        return False
+    return loaded == _read_metadata(path)
+
+
+def mark_loaded(path: Path):
+    """Record that a downloaded file has been processed, so that
+    download_file returns False until the file changes on the server
+
+    Args:
+        path (Path): File saved by download_file
+    """
+    path = Path(path)
+    _loaded_path(path).write_text(json.dumps(_read_metadata(path)))
+
+
+def _discard(partial: Path):
+    "Delete a partial download and its validators"
+    partial.unlink(missing_ok=True)
+    _metadata_path(partial).unlink(missing_ok=True)
+
+
+def _write_metadata(path: Path, response: requests.Response):
+    metadata = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    _metadata_path(path).write_text(json.dumps(metadata))
+
+
+def _expected_size(response: requests.Response) -> Optional[int]:
+    "Full size of the file from the response headers, if known"
+    if response.headers.get("Content-Encoding"):
+        # Content-Length is the compressed size
+        return None
+    if response.status_code == 206:
+        total = response.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length")
+    return int(length) if length else None
+
+
+def download_file(
+    url: str,
+    path: Path,
+    validate: Optional[Callable[[Path], bool]] = None,
+    **request_details,
+) -> bool:
+    """Download a file if it has changed since the last download.
+
+    A partial download that the server can no longer resume, because the
+    range is not satisfiable or the resumed file is the wrong size, is
+    discarded and the download restarted from the beginning.
+
+    Args:
+        url (str): URL to download
+        path (Path): Where to save the file
+        validate (Callable[[Path], bool], optional): Check of the downloaded
+            file before it replaces the existing one. Defaults to None.
+        request_details: Passed to requests.get, e.g. headers and timeout
+
+    Raises:
+        ValueError: The download was incomplete or failed validation
+
+    Returns:
+        bool: True if a new file was saved, or the saved file has not been
+            marked as loaded. False if it was unchanged and loaded
+    """
+    path = Path(path)
+    partial = path.with_name(f"{path.name}.part")
+    headers = dict(request_details.pop("headers", {}))
+
+    metadata = _read_metadata(path)
+    if path.exists():
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+
+    while True:
+        # Resume only if the server can tell us the partial file is still
+        # current
+        partial_metadata = _read_metadata(partial)
+        validator = partial_metadata.get("etag") or partial_metadata.get(
+            "last_modified"
+        )
+        resume = partial.exists() and bool(validator)
+        if resume:
+            headers["Range"] = f"bytes={partial.stat().st_size}-"
+            headers["If-Range"] = validator
+        else:
+            headers.pop("Range", None)
+            headers.pop("If-Range", None)
+
+        with requests.get(
+            url, headers=headers, stream=True, **request_details
+        ) as response:
+            if response.status_code == 304:
+                return not _is_loaded(path)
+            if response.status_code == 416 and resume:
+                _discard(partial)
+                continue
+            response.raise_for_status()
+
+            _write_metadata(partial, response)
+            mode = "ab" if response.status_code == 206 else "wb"
+            with open(partial, mode) as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+
+            expected = _expected_size(response)
+            size = partial.stat().st_size
+        if expected is None or size == expected:
+            break
+        _discard(partial)
+        if response.status_code != 206:
+            raise ValueError(f"Downloaded {size} of {expected} bytes from {url}")
+
+    if validate is not None and not validate(partial):
+        _discard(partial)
+        raise ValueError(f"Download from {url} failed validation")
+
+    os.replace(partial, path)
+    os.replace(_metadata_path(partial), _metadata_path(path))
+    return True
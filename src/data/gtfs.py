@@ -0,0 +1,96 @@
+"""
+Read GTFS schedule files using the table definitions in data.model.
+
+Only the registered _gtfs_fields_ are parsed, with types taken from the
+SQLAlchemy columns, so columns that are not loaded never reach memory.
+Files can be read in chunks so that large files such as stop_times.txt
+are never held in memory all at once.
+"""
+from typing import IO, Dict, Iterator, List
+
+import pandas as pd
+from sqlalchemy import Float, Integer, Table
+
+CHUNKSIZE = 20000
+
+
+def column_mapping(table: Table) -> Dict[str, str]:
+    "GTFS field names mapped to the table's column names"
+    new_cols = [c.name for c in table.__table__.columns]
+    return dict(zip(table._gtfs_fields_, new_cols))
+
+
+def column_dtypes(table: Table) -> Dict[str, str]:
+    """pandas types to read each GTFS field as, from the table's column
+    types. Integers are nullable and anything else is read as text so
+    that ids are never converted to numbers"""
+    dtypes = {}
+    for field, column in zip(table._gtfs_fields_, table.__table__.columns):
+        if isinstance(column.type, Integer):
+            dtypes[field] = "Int64"
+        elif isinstance(column.type, Float):
+            dtypes[field] = "float64"
+        else:
+            dtypes[field] = "str"
+    return dtypes
+
+
+def read_gtfs_chunks(
+    table: Table, file: IO, chunksize: int = CHUNKSIZE
+) -> Iterator[pd.DataFrame]:
+    """Read a GTFS file in chunks, keeping only the fields the table needs
+
+    Args:
+        table (Table): SQLAlchemy table, used to get the fields to expect
+        file (IO): Open file, e.g. from zipfile.ZipFile.open
+        chunksize (int, optional): Rows per chunk. Defaults to CHUNKSIZE.
+
+    Yields:
+        pd.DataFrame: Chunk with the table's column names
+    """
+    mapping = column_mapping(table)
+    reader = pd.read_csv(
+        file, usecols=list(mapping), dtype=column_dtypes(table), chunksize=chunksize
+    )
+    for chunk in reader:
+        yield chunk[list(mapping)].rename(columns=mapping)
+
+
+def read_gtfs(table: Table, file: IO) -> pd.DataFrame:
+    "Read a whole GTFS file, keeping only the fields the table needs"
+    mapping = column_mapping(table)
+    df = pd.read_csv(file, usecols=list(mapping), dtype=column_dtypes(table))
+    return df[list(mapping)].rename(columns=mapping)
+
+
+def dependency_levels(tables: List[Table]) -> List[List[Table]]:
+    """Group tables so that each table's foreign keys only refer to tables
+    in earlier groups. Tables within a group can be loaded at the same time
+
+    Args:
+        tables (List[Table]): SQLAlchemy tables, e.g. _gtfs_table_registry_
+
+    Returns:
+        List[List[Table]]: Groups of tables in load order
+    """
+    names = {table.__tablename__ for table in tables}
+    depends_on = {
+        table.__tablename__: {
+            fk.column.table.name
+            for fk in table.__table__.foreign_keys
+            if fk.column.table.name in names
+            and fk.column.table.name != table.__tablename__
+        }
+        for table in tables
+    }
+
+    levels, loaded, remaining = [], set(), list(tables)
+    while remaining:
+        level = [t for t in remaining if depends_on[t.__tablename__] <= loaded]
+        if not level:
+            cycle = [t.__tablename__ for t in remaining]
+            raise ValueError(f"Foreign keys form a cycle between {cycle}")
+        levels.append(level)
+        loaded |= {t.__tablename__ for t in level}
+        remaining = [t for t in remaining if t not in level]
+    return levels
@@ -0,0 +1,113 @@
+"""
+Keep the most recent locations in memory for live views.
+
+Only rows newer than the last request_timestamp already held are read
+from the database, and rows older than the window are dropped, so each
+refresh reads one poll of locations and memory stays bounded. Every
+viewer shares the same window. A refresh that comes sooner than
+min_interval after the last one reuses it, so many viewers polling at
+once still only query the database once per poll.
+
+The window is shared between the threads of one process. Separate
+server processes each keep their own.
+"""
+import threading
+import time
+from typing import Callable, Optional
+
+import pandas as pd
+
+WINDOW_SECONDS = 60 * 60
+MIN_INTERVAL = 10  # seconds
+
+
+class LiveWindow:
+    """Locations from the last window_seconds, refreshed incrementally
+
+    Args:
+        query (Callable[[int], pd.DataFrame]): Reads locations with a
+            request_timestamp at or after a timestamp
+        transform (Callable[[pd.DataFrame], pd.DataFrame], optional):
+            Applied once to each batch of new rows, e.g. to add a bunched
+            column. Defaults to None.
+        window_seconds (int, optional): Seconds of history to keep before
+            the latest request_timestamp. Defaults to WINDOW_SECONDS.
+        min_interval (float, optional): Seconds between database reads.
+            Defaults to MIN_INTERVAL.
+        clock (Callable[[], float], optional): Current Unix time. Defaults
+            to time.time.
+    """
+
+    def __init__(
+        self,
+        query: Callable[[int], pd.DataFrame],
+        transform: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+        window_seconds: int = WINDOW_SECONDS,
+        min_interval: float = MIN_INTERVAL,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.query = query
+        self.transform = transform
+        self.window_seconds = window_seconds
+        self.min_interval = min_interval
+        self.clock = clock
+        self.locations: Optional[pd.DataFrame] = None
+        self.last_refresh: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def latest(self) -> Optional[int]:
+        "Latest request_timestamp held"
+        if self.locations is None or self.locations.empty:
+            return None
+        return int(self.locations["request_timestamp"].max())
+
+    def refresh(self) -> pd.DataFrame:
+        """Read locations newer than those held, unless the last read was
+        less than min_interval ago
+
+        Returns:
+            pd.DataFrame: Every location in the window
+        """
+        with self._lock:
+            now = self.clock()
+            if (
+                self.last_refresh is not None
+                and now - self.last_refresh < self.min_interval
+            ):
+                return self.locations
+
+            latest = self.latest
+            start = int(now) - self.window_seconds if latest is None else latest + 1
+            new = self.query(start)
+            if self.transform is not None and not new.empty:
+                new = self.transform(new)
+
+            if self.locations is None or self.locations.empty:
+                locations = new
+            elif new.empty:
+                locations = self.locations
+            else:
+                locations = pd.concat([self.locations, new], ignore_index=True)
+
+            if not locations.empty:
+                oldest = locations["request_timestamp"].max() - self.window_seconds
+                locations = locations[locations["request_timestamp"] > oldest]
+            self.locations = locations.reset_index(drop=True)
+            self.last_refresh = now
+            return self.locations
+
+    def since(self, timestamp: Optional[int]) -> pd.DataFrame:
+        """Locations a viewer has not seen yet, without reading the database
+
+        Args:
+            timestamp (int, optional): Latest request_timestamp the viewer
+                has, or None for a new viewer
+
+        Returns:
+            pd.DataFrame: Locations after that timestamp
+        """
+        locations = self.locations
+        if locations is None or timestamp is None:
+            return locations if locations is not None else pd.DataFrame()
+        return locations[locations["request_timestamp"] > timestamp]
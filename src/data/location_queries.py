@@ -0,0 +1,112 @@
+"""
+Build location queries with the filters and columns in SQL, so that only
+the rows and columns that are needed are read from the database.
+
+Locations are joined to their trip and route only when a filter or column
+needs them.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import ColumnElement, Engine, Select, select
+
+from data.model import Route, Trip
+from data.partitions import locations_source
+
+DEFAULT_COLUMNS = [
+    "lat",
+    "lon",
+    "bearing",
+    "speed",
+    "request_timestamp",
+    "direction_id",
+    "route_direction",
+    "shape_id",
+    "short_name",
+]
+
+TRIP_COLUMNS: Dict[str, ColumnElement] = {
+    "service_id": Trip.service_id,
+    "shape_id": Trip.shape_id,
+    "trip_headsign": Trip.trip_headsign,
+    "direction_id": Trip.direction_id,
+    "route_direction": Trip.route_direction,
+}
+ROUTE_COLUMNS: Dict[str, ColumnElement] = {
+    "short_name": Route.short_name,
+    "long_name": Route.long_name,
+    "color": Route.color,
+}
+
+# min_lon, min_lat, max_lon, max_lat
+BoundingBox = Tuple[float, float, float, float]
+
+
+def select_locations(
+    con: Engine,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    short_names: Optional[Sequence[str]] = None,
+    direction_id: Optional[int] = None,
+    bbox: Optional[BoundingBox] = None,
+    columns: Optional[List[str]] = None,
+) -> Select:
+    """Select locations with filters and a column list
+
+    Args:
+        con (Engine): SQLAlchemy engine
+        start (int, optional): First request timestamp. Defaults to None.
+        end (int, optional): Request timestamp to stop before. Defaults to
+            None.
+        short_names (Sequence[str], optional): Only these routes. Defaults to
+            None.
+        direction_id (int, optional): Only this direction. Defaults to None.
+        bbox (BoundingBox, optional): Only locations inside
+            (min_lon, min_lat, max_lon, max_lat). Defaults to None.
+        columns (List[str], optional): Columns of locations, trips
+            (TRIP_COLUMNS) or routes (ROUTE_COLUMNS). Defaults to
+            DEFAULT_COLUMNS.
+
+    Raises:
+        ValueError: When a column is not a location, trip or route column
+
+    Returns:
+        Select: Statement to read with pd.read_sql or a connection
+    """
+    locations = locations_source(con, start, end)
+    columns = columns or DEFAULT_COLUMNS
+
+    selected = []
+    for name in columns:
+        if name in locations.c:
+            selected.append(locations.c[name])
+        elif name in TRIP_COLUMNS:
+            selected.append(TRIP_COLUMNS[name])
+        elif name in ROUTE_COLUMNS:
+            selected.append(ROUTE_COLUMNS[name])
+        else:
+            raise ValueError(f"Unknown location column {name!r}")
+
+    join_trip = direction_id is not None or any(c in TRIP_COLUMNS for c in columns)
+    join_route = short_names is not None or any(c in ROUTE_COLUMNS for c in columns)
+
+    stmt = select(*selected).select_from(locations)
+    if join_route:
+        stmt = stmt.join(Route, locations.c.route_id == Route.id)
+    if join_trip:
+        stmt = stmt.join(Trip, locations.c.trip_id == Trip.id)
+
+    if start is not None:
+        stmt = stmt.where(locations.c.request_timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(locations.c.request_timestamp < end)
+    if short_names is not None:
+        stmt = stmt.where(Route.short_name.in_(short_names))
+    if direction_id is not None:
+        stmt = stmt.where(Trip.direction_id == direction_id)
+    if bbox is not None:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        stmt = stmt.where(
+            locations.c.lon.between(min_lon, max_lon),
+            locations.c.lat.between(min_lat, max_lat),
+        )
+    return stmt
@@ -1,27 +1,129 @@
 "Fetch locations"
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
 from sqlalchemy import select
 import pandas as pd
+import polars as pl
 
-from data.model import Location, Route, Trip
+from data.model import Location
 from data.data import engine
+from data.columnar import read_polars
+from data.location_queries import DEFAULT_COLUMNS, BoundingBox, select_locations
 
 
-def get_locations() -> pd.DataFrame:
-    stmt = (
-        select(
-            Location.lat,
-            Location.lon,
-            Location.bearing,
-            Location.speed,
-            Location.request_timestamp,
-            Trip.direction_id,
-            Trip.route_direction,
-            Route.short_name,
-        )
-        .select_from(Location)
-        .join(Route, Location.route_id == Route.id)
-        .join(Trip, Location.trip_id == Trip.id)
+def query_locations(
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    short_names: Optional[Sequence[str]] = None,
+    direction_id: Optional[int] = None,
+    bbox: Optional[BoundingBox] = None,
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """Get the locations that match some filters, with only some columns.
+    The filters and columns are part of the SQL query, and with a time
+    range only the partitions for those service days are read
+
+    Args:
+        start (int, optional): First request timestamp. Defaults to None.
+        end (int, optional): Request timestamp to stop before. Defaults to
+            None.
+        short_names (Sequence[str], optional): Only these routes. Defaults to
+            None.
+        direction_id (int, optional): Only this direction. Defaults to None.
+        bbox (BoundingBox, optional): Only locations inside
+            (min_lon, min_lat, max_lon, max_lat). Defaults to None.
+        columns (List[str], optional): Columns to return. Defaults to
+            DEFAULT_COLUMNS.
+
+    Returns:
+        pd.DataFrame: Locations
+    """
+    stmt = select_locations(
+        engine, start, end, short_names, direction_id, bbox, columns
     )
+    return pd.read_sql(stmt, engine)
+
+
+def query_locations_polars(
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    short_names: Optional[Sequence[str]] = None,
+    direction_id: Optional[int] = None,
+    bbox: Optional[BoundingBox] = None,
+    columns: Optional[List[str]] = None,
+    lazy: bool = False,
+) -> Union[pl.DataFrame, pl.LazyFrame]:
+    """Same as query_locations, but read straight into polars, e.g. for
+    is_bunched_pl
+
+    Args:
+        lazy (bool, optional): Return a LazyFrame. Defaults to False.
+
+    Returns:
+        Union[pl.DataFrame, pl.LazyFrame]: Locations
+    """
+    stmt = select_locations(
+        engine, start, end, short_names, direction_id, bbox, columns
+    )
+    return read_polars(stmt, engine, lazy)
+
+
+def get_locations(
+    start: Optional[int] = None, end: Optional[int] = None
+) -> pd.DataFrame:
+    """Get locations with their route and trip details. With a time range,
+    only the partitions for those service days are read
 
-    locations = pd.read_sql(stmt, engine)
-    return locations
\ No newline at end of file
+    Args:
+        start (int, optional): First request timestamp. Defaults to None.
+        end (int, optional): Request timestamp to stop before. Defaults to
+            None.
+
+    Returns:
+        pd.DataFrame: Locations
+    """
+    return query_locations(start, end)
+
+
+def get_request_timestamps(after: Optional[int] = None) -> List[int]:
+    """Get each distinct request_timestamp in the locations table
+
+    Args:
+        after (int, optional): Only include timestamps after this one.
+            Defaults to None.
+
+    Returns:
+        List[int]: Sorted request timestamps
+    """
+    stmt = select(Location.request_timestamp).distinct()
+    if after is not None:
+        stmt = stmt.where(Location.request_timestamp > after)
+    stmt = stmt.order_by(Location.request_timestamp)
+
+    with engine.connect() as con:
+        return list(con.scalars(stmt))
+
+
+def iter_location_windows(
+    window_polls: int = 60, after: Optional[int] = None
+) -> Iterator[Tuple[int, pd.DataFrame]]:
+    """Read locations one window of request timestamps at a time, so that
+    only one window is held in memory
+
+    Args:
+        window_polls (int, optional): Number of request timestamps in each
+            window. Defaults to 60 (one hour of polling).
+        after (int, optional): Only include timestamps after this one.
+            Defaults to None.
+
+    Yields:
+        Tuple[int, pd.DataFrame]: First request timestamp in the window and
+        the locations (with their id) in that window
+    """
+    timestamps = get_request_timestamps(after)
+    for start in range(0, len(timestamps), window_polls):
+        window = timestamps[start:start + window_polls]
+        locations = query_locations(
+            window[0], window[-1] + 1, columns=DEFAULT_COLUMNS + ["id"]
+        )
+        yield window[0], locations
\ No newline at end of file
@@ -1,7 +1,7 @@
 "SQLAlchemy model"
 from typing import List
 
-from sqlalchemy import ForeignKey, String, Table
+from sqlalchemy import Connection, ForeignKey, Index, MetaData, String, Table
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
@@ -24,6 +24,42 @@ def _simple_repr(cls, attrs):
     )
 
 
+def copy_table(cls: Table, name: str) -> Table:
+    """Copy a table definition under a new name, e.g. for shadow tables or
+    partitions. Indexes are not copied because index names must be unique,
+    so the caller creates them when needed
+
+    Args:
+        cls (Table): Mapped class or table to copy
+        name (str): Name of the new table
+
+    Returns:
+        SQLAlchemy Table: The new table, not yet created in the database
+    """
+    table = getattr(cls, "__table__", cls)
+    # Foreign keys in the copy need the tables they refer to
+    metadata = MetaData()
+    for other in table.metadata.sorted_tables:
+        other.to_metadata(metadata)
+    new_table = table.to_metadata(metadata, name=name)
+    for index in list(new_table.indexes):
+        new_table.indexes.remove(index)
+    return new_table
+
+
+def begin_ddl(connection: Connection):
+    """Open the transaction explicitly on SQLite, so that table and view
+    changes commit or roll back together. The sqlite3 driver only starts
+    a transaction before DML, so each DDL statement would otherwise commit
+    on its own. Other databases already have transactional DDL
+
+    Args:
+        connection (Connection): Connection inside engine.begin()
+    """
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("BEGIN")
+
+
 def register_gtfs(cls: Table):
     """Function decorator to make it easy to keep track of which classes
     need to be filled with GTFS data. Once the register is filled, we
@@ -199,7 +235,7 @@ class StopTime(Base):
     stop_sequence: Mapped[int] = mapped_column(primary_key=True)
     arrival_time: Mapped[str]
     departure_time: Mapped[str]
-    stop_id: Mapped[str] = mapped_column(ForeignKey("stops.id"))
+    stop_id: Mapped[str] = mapped_column(ForeignKey("stops.id"), index=True)
     stop_headsign: Mapped[str] = mapped_column(nullable=True)
     pickup_type: Mapped[int]
     drop_off_type: Mapped[int]
@@ -235,6 +271,9 @@ class Trip(Base):
         "route_direction",
     )
     _gtfs_file_ = "trips"
+    __table_args__ = (
+        Index("ix_trips_route_id_direction_id", "route_id", "direction_id"),
+    )
 
     id: Mapped[str] = mapped_column(primary_key=True)
     route_id: Mapped[str] = mapped_column(ForeignKey("routes.id"))
@@ -259,6 +298,17 @@ class Trip(Base):
 
 class Location(Base):
     __tablename__ = "locations"
+    __table_args__ = (
+        # Covers the columns get_locations reads for a time range, so
+        # PostgreSQL can answer it from the index alone
+        Index(
+            "ix_locations_request_timestamp_route_id",
+            "request_timestamp",
+            "route_id",
+            postgresql_include=["trip_id", "lat", "lon", "bearing", "speed"],
+        ),
+        Index("ix_locations_trip_id", "trip_id"),
+    )
 
     id: Mapped[str] = mapped_column(primary_key=True)
     request_timestamp: Mapped[int] = mapped_column(primary_key=True)
@@ -293,3 +343,18 @@ class Location(Base):
             "vehicle_id",
         ]
         return _simple_repr(self, attrs)
+
+
+class BunchingEvent(Base):
+    __tablename__ = "bunching_events"
+
+    id: Mapped[str] = mapped_column(primary_key=True)
+    request_timestamp: Mapped[int] = mapped_column(primary_key=True)
+    short_name: Mapped[str]
+    direction_id: Mapped[int]
+    lat: Mapped[float]
+    lon: Mapped[float]
+
+    def __repr__(self) -> str:
+        attrs = ["id", "request_timestamp", "short_name", "lat", "lon"]
+        return _simple_repr(self, attrs)
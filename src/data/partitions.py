@@ -0,0 +1,265 @@
+"""
+Locations are stored in one partition per service day so that queries
+over a time range only read the days they need, and old days can be
+removed by dropping a whole partition.
+
+On PostgreSQL, locations is a natively partitioned table with one range
+partition of request_timestamp per day, and the database routes inserts
+and prunes partitions itself. SQLite has no partitioning, so each day is
+its own table and locations is a view over all of them. Inserts go to
+the day's table and time range queries only union the tables they need.
+
+Service days follow the agency timezone, from local midnight to
+midnight.
+"""
+from datetime import date, datetime, time, timedelta
+import re
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+from sqlalchemy import (
+    Engine, FromClause, Index, Table, column, inspect, select, table, text,
+    union_all
+)
+
+from data.bulk import bulk_insert
+from data.model import Location, begin_ddl, copy_table
+
+TIMEZONE = ZoneInfo("Australia/Sydney")
+# SQLite's limit on the SELECTs in one compound statement
+MAX_COMPOUND_SELECT = 500
+PARTITION_PREFIX = f"{Location.__tablename__}_"
+_PARTITION_PATTERN = re.compile(rf"^{PARTITION_PREFIX}(\d{{8}})$")
+
+
+def service_days(timestamps: pd.Series) -> pd.Series:
+    "Service day of each request timestamp"
+    local = pd.to_datetime(timestamps, unit="s", utc=True).dt.tz_convert(TIMEZONE)
+    return local.dt.date
+
+
+def day_bounds(day: date) -> Tuple[int, int]:
+    "First request timestamp in a day and the first in the next day"
+    start = datetime.combine(day, time(), tzinfo=TIMEZONE)
+    end = datetime.combine(day + timedelta(days=1), time(), tzinfo=TIMEZONE)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+def is_partitioned(con: Engine) -> bool:
+    "Whether the partitioning migration has been applied"
+    if con.dialect.name == "postgresql":
+        stmt = text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p "
+            "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :name)"
+        )
+        with con.connect() as connection:
+            return connection.scalar(stmt, {"name": Location.__tablename__})
+    return Location.__tablename__ in inspect(con).get_view_names()
+
+
+def list_partitions(con: Engine) -> List[date]:
+    "Service days that have a partition, in order"
+    days = []
+    for name in inspect(con).get_table_names():
+        if match := _PARTITION_PATTERN.match(name):
+            days.append(datetime.strptime(match.group(1), "%Y%m%d").date())
+    return sorted(days)
+
+
+def partition_indexes(partition: Table) -> List[Index]:
+    """Copies of the locations indexes for a SQLite day table. PostgreSQL
+    creates these on each partition from the indexes on locations itself
+
+    Args:
+        partition (Table): Day table from copy_table
+
+    Returns:
+        List[Index]: Indexes named after the day table
+    """
+    prefix = f"ix_{Location.__tablename__}_"
+    return [
+        Index(
+            index.name.replace(prefix, f"ix_{partition.name}_", 1),
+            *[partition.c[c.name] for c in index.columns],
+        )
+        for index in Location.__table__.indexes
+    ]
+
+
+def _union_all_sql(selects: List[str]) -> str:
+    """UNION ALL of SELECT statements, nested in subqueries so that no
+    compound statement has more than MAX_COMPOUND_SELECT terms"""
+    while len(selects) > MAX_COMPOUND_SELECT:
+        selects = [
+            "SELECT * FROM ("
+            + " UNION ALL ".join(selects[i:i + MAX_COMPOUND_SELECT])
+            + ")"
+            for i in range(0, len(selects), MAX_COMPOUND_SELECT)
+        ]
+    return " UNION ALL ".join(selects)
+
+
+def _rebuild_view(connection, days: List[date]):
+    "Point the SQLite locations view at the current day tables"
+    columns = [c.name for c in Location.__table__.columns]
+    if days:
+        body = _union_all_sql(
+            [f'SELECT * FROM "{partition_name(day)}"' for day in days]
+        )
+    else:
+        nulls = ", ".join(f"NULL AS {c}" for c in columns)
+        body = f"SELECT {nulls} WHERE 0"
+    connection.execute(text(f'DROP VIEW IF EXISTS "{Location.__tablename__}"'))
+    connection.execute(text(f'CREATE VIEW "{Location.__tablename__}" AS {body}'))
+
+
+def create_partitioned_view(con: Engine):
+    """Create the SQLite locations view over the day tables already in the
+    database, as the partitioning migration does, e.g. for a new database
+    or after day tables have been copied in
+
+    Args:
+        con (Engine): SQLAlchemy engine for a database without a locations
+            table
+
+    Raises:
+        ValueError: The database is PostgreSQL, where locations is a
+            partitioned table created by the migration
+    """
+    if con.dialect.name == "postgresql":
+        raise ValueError("PostgreSQL locations are partitioned by the migration")
+    days = list_partitions(con)
+    with con.begin() as connection:
+        begin_ddl(connection)
+        _rebuild_view(connection, days)
+
+
+def create_partition(con: Engine, day: date):
+    """Create the partition for a service day if it does not exist
+
+    Args:
+        con (Engine): SQLAlchemy engine
+        day (date): Service day
+    """
+    name = partition_name(day)
+    if con.dialect.name == "postgresql":
+        start, end = day_bounds(day)
+        with con.begin() as connection:
+            connection.execute(text(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF '
+                f'"{Location.__tablename__}" FOR VALUES FROM ({start}) TO ({end})'
+            ))
+        return
+
+    days = list_partitions(con)
+    if day in days:
+        return
+    with con.begin() as connection:
+        begin_ddl(connection)
+        partition = copy_table(Location, name)
+        partition.create(connection)
+        for index in partition_indexes(partition):
+            index.create(connection)
+        _rebuild_view(connection, sorted(days + [day]))
+
+
+def drop_partition(con: Engine, day: date):
+    """Remove a whole service day of locations
+
+    Args:
+        con (Engine): SQLAlchemy engine
+        day (date): Service day
+    """
+    with con.begin() as connection:
+        if con.dialect.name != "postgresql":
+            begin_ddl(connection)
+            remaining = [d for d in list_partitions(con) if d != day]
+            _rebuild_view(connection, sorted(remaining))
+        connection.execute(text(f'DROP TABLE IF EXISTS "{partition_name(day)}"'))
+
+
+def drop_partitions_before(con: Engine, day: date) -> List[date]:
+    """Remove every service day before a day, e.g. to keep a fixed history
+
+    Returns:
+        List[date]: Service days that were removed
+    """
+    dropped = [d for d in list_partitions(con) if d < day]
+    for old_day in dropped:
+        drop_partition(con, old_day)
+    return dropped
+
+
+def write_locations(
+    df: pd.DataFrame, con: Engine, on_conflict: str = "ignore"
+) -> int:
+    """Save locations to the partition for their service day, creating
+    partitions as needed
+
+    Args:
+        df (pd.DataFrame): Locations that match the locations table
+        con (Engine): SQLAlchemy engine
+        on_conflict (str, optional): Passed to bulk_insert. Defaults to
+            "ignore".
+
+    Returns:
+        int: Number of rows inserted
+    """
+    if not is_partitioned(con):
+        return bulk_insert(df, Location.__tablename__, con, on_conflict=on_conflict)
+
+    rows = 0
+    for day, day_df in df.groupby(service_days(df["request_timestamp"])):
+        create_partition(con, day)
+        table_name = Location.__tablename__
+        if con.dialect.name != "postgresql":
+            table_name = partition_name(day)
+        rows += bulk_insert(day_df, table_name, con, on_conflict=on_conflict)
+    return rows
+
+
+def locations_source(
+    con: Engine, start: Optional[int] = None, end: Optional[int] = None
+) -> FromClause:
+    """Table to select locations from between two request timestamps. On
+    partitioned SQLite this is a union of only the day tables in range.
+    Elsewhere it is the locations table, which PostgreSQL prunes itself.
+    The caller still filters on request_timestamp
+
+    Args:
+        con (Engine): SQLAlchemy engine
+        start (int, optional): First request timestamp. Defaults to None.
+        end (int, optional): Request timestamp to stop before. Defaults to
+            None.
+
+    Returns:
+        FromClause: Table or subquery with the locations columns
+    """
+    locations = Location.__table__
+    if con.dialect.name == "postgresql" or not is_partitioned(con):
+        return locations
+
+    days = [
+        day for day in list_partitions(con)
+        if (start is None or day_bounds(day)[1] > start)
+        and (end is None or day_bounds(day)[0] < end)
+    ]
+    if not days:
+        return select(locations).where(False).subquery(locations.name)
+    names = [c.name for c in locations.columns]
+    selects = [
+        select(table(partition_name(day), *[column(n) for n in names]))
+        for day in days
+    ]
+    # Nest the union so no compound select is over SQLite's limit
+    while len(selects) > MAX_COMPOUND_SELECT:
+        selects = [
+            select(union_all(*selects[i:i + MAX_COMPOUND_SELECT]).subquery())
+            for i in range(0, len(selects), MAX_COMPOUND_SELECT)
+        ]
+    return union_all(*selects).subquery(locations.name)
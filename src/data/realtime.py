@@ -6,9 +6,13 @@ from protobuf_to_dict import protobuf_to_dict
 from typing import List
 import pandas as pd
 from datetime import datetime
+import time
 
 from data.model import Location
-from data.data import engine
+from data.archive import roll_up, stage_poll
+from data.data import archive_path, engine
+from data.partitions import write_locations
+from data.positions import decode_positions_dataframe, with_position_types
 
 
 load_dotenv()
@@ -96,7 +100,21 @@ def get_positions_dataframe(positions:List[dict]) -> pd.DataFrame:
     # Example for debugging: Forget to search for ['entity']
     df = pd.DataFrame([flatten_entity(e) for e in positions['entity']])
     df['request_timestamp'] = positions['header']['timestamp']
-    return df
+    return with_position_types(df)
+
+
+def download_positions() -> bytes:
+    "Download the latest vehicle positions as a protobuf message"
+    response = requests.get(BUS_POSITION_URI, **request_details, timeout=60)
+    return response.content
+
+
+def decode_positions(content: bytes) -> List[dict]:
+    "Convert a protobuf message of vehicle positions to a dictionary"
+    feed = gtfs_realtime_pb2.FeedMessage() #pylint: disable=E1101
+    feed.ParseFromString(content)
+    positions = protobuf_to_dict(feed)
+    return positions
 
 
 def get_latest_positions() -> List[dict]:
@@ -105,22 +123,42 @@ def get_latest_positions() -> List[dict]:
     Returns:
         dict: _description_
     """
-    response = requests.get(BUS_POSITION_URI, **request_details, timeout=60)
-    feed = gtfs_realtime_pb2.FeedMessage() #pylint: disable=E1101
-    feed.ParseFromString(response.content)
-    positions = protobuf_to_dict(feed)
-    return positions
+    return decode_positions(download_positions())
+
+
+def get_latest_positions_dataframe() -> pd.DataFrame:
+    "Download the latest positions and decode them straight to a dataframe"
+    return decode_positions_dataframe(download_positions())
 
 
 def upload_realtime(df: pd.DataFrame, log:bool = True):
-    "Save pandas dataframe to database"
-    df.to_sql("locations", engine, if_exists="append", index=False)
+    """Save pandas dataframe to database. Locations that were already
+    saved, e.g. by a retried poll, are skipped rather than failing the
+    whole batch"""
+    start = time.perf_counter()
+    rows = write_locations(df, engine, on_conflict="ignore")
+    rate = len(df) / max(time.perf_counter() - start, 1e-9)
     if log:
-        print(f"Saved {len(df)} locations at {datetime.now()}")
+        print(
+            f"Saved {rows} locations at {datetime.now()} ({rate:,.0f} rows/s, "
+            f"{len(df) - rows} already saved)"
+        )
+
+
+def archive_realtime(df: pd.DataFrame, log: bool = True):
+    """Stage a poll for the Parquet archive, and move any finished hours
+    of staged polls into the archive"""
+    if df.empty:
+        return
+    staging_path = archive_path / "staging"
+    stage_poll(df, staging_path)
+    rows = roll_up(staging_path, archive_path)
+    if log and rows:
+        print(f"Archived {rows} positions at {datetime.now()}")
 
 
 def fetch_and_upload_positions():
     "Complete a full cycle of uploading bus positions"
-    positions = get_latest_positions()
-    df = get_positions_dataframe(positions)
-    upload_realtime(df)
\ No newline at end of file
+    df = get_latest_positions_dataframe()
+    upload_realtime(df)
+    archive_realtime(df)
\ No newline at end of file
@@ -0,0 +1,40 @@
+"Fetch static schedule tables"
+from sqlalchemy import select
+import pandas as pd
+
+from data import simplify
+from data.model import Shape
+from data.data import engine, path, zip_path
+
+SHAPE_CACHE = path / "cache"
+
+
+def get_shapes() -> pd.DataFrame:
+    """Get every shape point, named to match the GTFS shapes file after
+    data.shapes.restructure
+
+    Returns:
+        pd.DataFrame: Shape points with shape_id, shape_pt_sequence, lat,
+        lon and shape_dist_traveled
+    """
+    stmt = select(
+        Shape.id.label("shape_id"),
+        Shape.sequence.label("shape_pt_sequence"),
+        Shape.lat,
+        Shape.lon,
+        Shape.dist_traveled.label("shape_dist_traveled"),
+    )
+
+    shapes = pd.read_sql(stmt, engine)
+    return shapes
+
+
+def get_simplified_shapes() -> pd.DataFrame:
+    """Get every shape point with its simplification level, cached for the
+    current feed in gtfs.zip
+
+    Returns:
+        pd.DataFrame: Shape points as get_shapes with a level column
+    """
+    version = simplify.feed_version(zip_path)
+    return simplify.cached_levels(get_shapes, SHAPE_CACHE, version)
@@ -0,0 +1,247 @@
+"""
+Hold the static schedule in memory as numpy arrays, for analysis code
+that needs the whole network without the ORM or re-reading gtfs.zip.
+
+String ids are interned: each kind of id (route, trip, stop, shape) has
+one sorted array of ids, and every table stores integer codes into it.
+Stop times are sorted by trip and shape points by shape, so the rows of
+one trip or shape are a contiguous range found from an offsets array.
+
+A store is saved as one .npy file per array and loaded with memory
+mapping, so a worker process can open the whole network almost
+instantly and only pages in the parts it reads.
+"""
+from pathlib import Path
+from typing import Dict, IO, Optional
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from data.gtfs import read_gtfs
+from data.model import Route, Shape, Stop, StopTime, Trip
+
+# Columns kept for each table, by model column name
+STORE_COLUMNS = {
+    "routes": ["id", "short_name", "long_name", "type", "color"],
+    "trips": ["id", "route_id", "service_id", "shape_id", "direction_id"],
+    "stops": ["id", "name", "lat", "lon"],
+    "stop_times": [
+        "trip_id",
+        "stop_sequence",
+        "stop_id",
+        "arrival_time",
+        "departure_time",
+        "shape_dist_traveled",
+    ],
+    "shapes": ["id", "sequence", "lat", "lon", "dist_traveled"],
+}
+
+# Which kind of id each id column holds
+ID_KINDS = {
+    ("routes", "id"): "route",
+    ("trips", "id"): "trip",
+    ("trips", "route_id"): "route",
+    ("trips", "shape_id"): "shape",
+    ("stops", "id"): "stop",
+    ("stop_times", "trip_id"): "trip",
+    ("stop_times", "stop_id"): "stop",
+    ("shapes", "id"): "shape",
+}
+TIME_COLUMNS = {("stop_times", "arrival_time"), ("stop_times", "departure_time")}
+
+# Tables whose rows are grouped by an id, with the column and its kind
+GROUPED_BY = {"stop_times": ("trip_id", "trip"), "shapes": ("id", "shape")}
+SORT_BY = {"stop_times": "stop_sequence", "shapes": "sequence"}
+
+MODELS = {
+    "routes": Route,
+    "trips": Trip,
+    "stops": Stop,
+    "stop_times": StopTime,
+    "shapes": Shape,
+}
+
+
+def time_to_seconds(times: pd.Series) -> np.ndarray:
+    """Convert GTFS HH:MM:SS times, which can pass 24:00:00, to seconds
+    after midnight. Missing times are -1"""
+    parts = times.fillna("").astype(str).str.split(":", expand=True)
+    if parts.shape[1] < 3:
+        return np.full(len(times), -1, dtype=np.int32)
+    numbers = parts.iloc[:, :3].apply(pd.to_numeric, errors="coerce")
+    seconds = numbers[0] * 3600 + numbers[1] * 60 + numbers[2]
+    return seconds.fillna(-1).to_numpy(dtype=np.int32)
+
+
+def _string_array(values: pd.Series) -> np.ndarray:
+    "Fixed width unicode array, which unlike object arrays can be memory mapped"
+    return values.fillna("").astype(str).to_numpy(dtype=str)
+
+
+def _value_array(values: pd.Series) -> np.ndarray:
+    "Numeric column as a plain numpy array, with missing integers as -1"
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return values.fillna(-1).to_numpy(dtype=np.int64)
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return values.to_numpy(dtype=np.float64, na_value=np.nan)
+    return _string_array(values)
+
+
+class ScheduleStore:
+    """Columns of the schedule tables as numpy arrays
+
+    Attributes:
+        ids (Dict[str, np.ndarray]): Sorted ids of each kind. A code is a
+            position in one of these arrays
+        tables (Dict[str, Dict[str, np.ndarray]]): Columns of each table.
+            Id columns hold codes
+        offsets (Dict[str, np.ndarray]): For stop_times and shapes, rows
+            offsets[code] to offsets[code + 1] belong to the trip or shape
+            with that code
+    """
+
+    def __init__(
+        self,
+        ids: Dict[str, np.ndarray],
+        tables: Dict[str, Dict[str, np.ndarray]],
+        offsets: Dict[str, np.ndarray],
+    ):
+        self.ids = ids
+        self.tables = tables
+        self.offsets = offsets
+
+    @classmethod
+    def from_frames(cls, frames: Dict[str, pd.DataFrame]) -> "ScheduleStore":
+        """Build a store from schedule tables
+
+        Args:
+            frames (Dict[str, pd.DataFrame]): Tables named as in
+                STORE_COLUMNS, with model column names as from
+                data.gtfs.read_gtfs
+
+        Returns:
+            ScheduleStore: Store with interned ids and offsets
+        """
+        ids = {}
+        for kind in sorted(set(ID_KINDS.values())):
+            values = [
+                frames[table][column]
+                for (table, column), column_kind in ID_KINDS.items()
+                if column_kind == kind
+            ]
+            ids[kind] = np.unique(_string_array(pd.concat(values)))
+
+        tables = {}
+        offsets = {}
+        for table, columns in STORE_COLUMNS.items():
+            df = frames[table]
+            arrays = {}
+            for column in columns:
+                if (table, column) in ID_KINDS:
+                    kind = ID_KINDS[(table, column)]
+                    codes = np.searchsorted(ids[kind], _string_array(df[column]))
+                    arrays[column] = codes.astype(np.int32)
+                elif (table, column) in TIME_COLUMNS:
+                    arrays[column] = time_to_seconds(df[column])
+                else:
+                    arrays[column] = _value_array(df[column])
+
+            if table in GROUPED_BY:
+                column, kind = GROUPED_BY[table]
+                order = np.lexsort((arrays[SORT_BY[table]], arrays[column]))
+                arrays = {name: values[order] for name, values in arrays.items()}
+                counts = np.bincount(arrays[column], minlength=len(ids[kind]))
+                offsets[table] = np.concatenate([[0], np.cumsum(counts)])
+            tables[table] = arrays
+
+        return cls(ids, tables, offsets)
+
+    @classmethod
+    def from_gtfs_zip(cls, zip_path: Path) -> "ScheduleStore":
+        "Build a store straight from a GTFS zip file"
+        frames = {}
+        with zipfile.ZipFile(zip_path) as z:
+            for table, model in MODELS.items():
+                with z.open(f"{model._gtfs_file_}.txt") as f:
+                    frames[table] = _read(model, f)
+        return cls.from_frames(frames)
+
+    def code(self, kind: str, id: str) -> int:
+        """Integer code of an id
+
+        Raises:
+            KeyError: When the id is not in the schedule
+        """
+        ids = self.ids[kind]
+        code = int(np.searchsorted(ids, id))
+        if code == len(ids) or ids[code] != id:
+            raise KeyError(f"Unknown {kind} id {id!r}")
+        return code
+
+    def _group(self, table: str, kind: str, id: str) -> Dict[str, np.ndarray]:
+        code = self.code(kind, id)
+        start, end = self.offsets[table][code], self.offsets[table][code + 1]
+        columns = self.tables[table]
+        return {name: values[start:end] for name, values in columns.items()}
+
+    def trip_stop_times(self, trip_id: str) -> Dict[str, np.ndarray]:
+        "Stop times of one trip in stop sequence order, without copying"
+        return self._group("stop_times", "trip", trip_id)
+
+    def shape_points(self, shape_id: str) -> Dict[str, np.ndarray]:
+        "Points of one shape in sequence order, without copying"
+        return self._group("shapes", "shape", shape_id)
+
+    def to_frame(self, table: str) -> pd.DataFrame:
+        "One table as a DataFrame with its ids decoded"
+        df = pd.DataFrame(dict(self.tables[table]))
+        for (id_table, column), kind in ID_KINDS.items():
+            if id_table == table:
+                df[column] = self.ids[kind][df[column].to_numpy()]
+        return df
+
+    def save(self, folder: Path):
+        """Save each array to its own .npy file
+
+        Args:
+            folder (Path): Folder to save to, created if needed
+        """
+        folder.mkdir(parents=True, exist_ok=True)
+        for kind, values in self.ids.items():
+            np.save(folder / f"ids.{kind}.npy", values)
+        for table, arrays in self.tables.items():
+            for column, values in arrays.items():
+                np.save(folder / f"{table}.{column}.npy", values)
+        for table, values in self.offsets.items():
+            np.save(folder / f"offsets.{table}.npy", values)
+
+    @classmethod
+    def load(cls, folder: Path, mmap: bool = True) -> "ScheduleStore":
+        """Load a saved store
+
+        Args:
+            folder (Path): Folder the store was saved to
+            mmap (bool, optional): Memory map the arrays rather than
+                reading them. Defaults to True.
+
+        Returns:
+            ScheduleStore: The saved store
+        """
+        mmap_mode: Optional[str] = "r" if mmap else None
+
+        def load_array(name: str) -> np.ndarray:
+            return np.load(folder / f"{name}.npy", mmap_mode=mmap_mode)
+
+        ids = {kind: load_array(f"ids.{kind}") for kind in set(ID_KINDS.values())}
+        tables = {
+            table: {column: load_array(f"{table}.{column}") for column in columns}
+            for table, columns in STORE_COLUMNS.items()
+        }
+        offsets = {table: load_array(f"offsets.{table}") for table in GROUPED_BY}
+        return cls(ids, tables, offsets)
+
+
+def _read(model, file: IO) -> pd.DataFrame:
+    "Only the stored columns of one GTFS file"
+    return read_gtfs(model, file)[STORE_COLUMNS[model.__tablename__]]
@@ -1,4 +1,10 @@
+from typing import List, TypeVar
+
+import numpy as np
 import pandas as pd
+import polars as pl
+
+Frame = TypeVar("Frame", pl.DataFrame, pl.LazyFrame)
 
 
 def restructure(df:pd.DataFrame) -> pd.DataFrame:
@@ -15,6 +21,43 @@ def restructure(df:pd.DataFrame) -> pd.DataFrame:
         'shape_pt_lon': 'lon'
     })
 
+EARTH_RADIUS = 6371000.0
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great circle distance in metres between arrays of points in degrees
+
+    Returns:
+        Distances with the same shape as the inputs
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def initial_bearing(lat1, lon1, lat2, lon2):
+    """Bearing in degrees clockwise from north to head from the first
+    points to the second points
+
+    Returns:
+        Bearings from 0 up to 360
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    x = np.sin(lon2 - lon1) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(lon2 - lon1)
+    return np.degrees(np.arctan2(x, y)) % 360
+
+
+def _next_in_shape(df: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    """The next row's values within the same shape, from one shift of the
+    whole sorted frame. The last point of each shape has no next point"""
+    ids = df["shape_id"]
+    return df[columns].shift(-1).where(ids == ids.shift(-1), axis=0)
+
+
 def add_end_lat_lon(df:pd.DataFrame) -> pd.DataFrame:
     """Add the end lat and lon. Requires the dataframe to be sorted
 
@@ -25,10 +68,144 @@ def add_end_lat_lon(df:pd.DataFrame) -> pd.DataFrame:
         pd.DataFrame: DataFrame with end_lat and end_lon added
     """
     df = df.sort_values(["shape_id", "shape_pt_sequence"])
-    
-    df[['end_lat', 'end_lon']] = (df
-        .groupby('shape_id')[['lat', 'lon']]
-        .transform(lambda df: df.shift(-1))
+    df[['end_lat', 'end_lon']] = _next_in_shape(df, ['lat', 'lon']).to_numpy()
+    return df
+
+
+def add_segments(df: pd.DataFrame) -> pd.DataFrame:
+    """Treat each shape point as the start of a segment to the next point
+    and add the segment geometry. The last point of each shape has no
+    segment, so its end, length and bearing are null
+
+    Args:
+        df (pd.DataFrame): Shapes with shape_id, shape_pt_sequence, lat
+            and lon
+
+    Returns:
+        pd.DataFrame: Shapes sorted by shape and sequence, with end_lat,
+        end_lon, segment_length in metres, cumulative_length in metres
+        from the start of the shape to this point, and bearing in degrees
+    """
+    df = add_end_lat_lon(df)
+    lat, lon = df["lat"].to_numpy(float), df["lon"].to_numpy(float)
+    end_lat, end_lon = df["end_lat"].to_numpy(float), df["end_lon"].to_numpy(float)
+    length = haversine(lat, lon, end_lat, end_lon)
+
+    # Running total over all shapes, less the total where each shape starts
+    total = np.concatenate([[0], np.cumsum(np.nan_to_num(length))[:-1]])
+    shape_start = (df["shape_id"] != df["shape_id"].shift()).to_numpy()
+    start_total = np.maximum.accumulate(np.where(shape_start, total, 0))
+
+    return df.assign(
+        segment_length=length,
+        cumulative_length=total - start_total,
+        bearing=initial_bearing(lat, lon, end_lat, end_lon),
     )
 
-    return df
+
+def _haversine_expr(lat1: pl.Expr, lon1: pl.Expr, lat2: pl.Expr, lon2: pl.Expr):
+    a = (
+        ((lat2 - lat1) / 2).sin() ** 2
+        + lat1.cos() * lat2.cos() * ((lon2 - lon1) / 2).sin() ** 2
+    )
+    return 2 * EARTH_RADIUS * a.sqrt().arcsin()
+
+
+def _bearing_expr(lat1: pl.Expr, lon1: pl.Expr, lat2: pl.Expr, lon2: pl.Expr):
+    x = (lon2 - lon1).sin() * lat2.cos()
+    y = lat1.cos() * lat2.sin() - lat1.sin() * lat2.cos() * (lon2 - lon1).cos()
+    return pl.arctan2(x, y).degrees() % 360
+
+
+def add_segments_polars(df: Frame) -> Frame:
+    """polars version of add_segments, for a DataFrame or LazyFrame
+
+    Args:
+        df (Frame): Shapes with shape_id, shape_pt_sequence, lat and lon
+
+    Returns:
+        Frame: Shapes sorted by shape and sequence with the same added
+        columns as add_segments
+    """
+    same_shape = pl.col("shape_id") == pl.col("shape_id").shift(-1)
+    end = {
+        f"end_{c}": pl.when(same_shape).then(pl.col(c).shift(-1)).cast(pl.Float64)
+        for c in ["lat", "lon"]
+    }
+    radians = [
+        pl.col(c).cast(pl.Float64).radians()
+        for c in ["lat", "lon", "end_lat", "end_lon"]
+    ]
+    return (
+        df.sort("shape_id", "shape_pt_sequence")
+        .with_columns(**end)
+        .with_columns(segment_length=_haversine_expr(*radians))
+        .with_columns(
+            cumulative_length=(
+                pl.col("segment_length").fill_null(0).cum_sum()
+                - pl.col("segment_length").fill_null(0)
+            ).over("shape_id"),
+            bearing=_bearing_expr(*radians),
+        )
+    )
+
+
+def add_dist_traveled(
+    locations: pd.DataFrame, shapes: pd.DataFrame, chunk_size: int = 2048
+) -> pd.DataFrame:
+    """Project each location onto the shape of its trip to find how far
+    along the route it is. Each location is matched to the closest
+    segment of its shape and the shape_dist_traveled is interpolated
+    along that segment.
+
+    Args:
+        locations (pd.DataFrame): Locations with shape_id, lat and lon
+        shapes (pd.DataFrame): Shapes with shape_id, shape_pt_sequence,
+            lat, lon and shape_dist_traveled
+        chunk_size (int, optional): Locations compared with a shape at
+            once. Limits memory on long shapes. Defaults to 2048.
+
+    Returns:
+        pd.DataFrame: Locations with dist_traveled added. Locations
+        without a matching shape have a null dist_traveled
+    """
+    segments = add_end_lat_lon(shapes)
+    segments["end_dist"] = _next_in_shape(
+        segments, ["shape_dist_traveled"]
+    )["shape_dist_traveled"]
+    segments = segments.dropna(subset=["end_lat", "end_lon", "end_dist"])
+    segments_by_shape = segments.groupby("shape_id").indices
+
+    lat = locations["lat"].to_numpy(dtype=float)
+    lon = locations["lon"].to_numpy(dtype=float)
+    dist_traveled = np.full(len(locations), np.nan)
+
+    for shape_id, rows in locations.groupby("shape_id").indices.items():
+        if shape_id not in segments_by_shape:
+            continue
+        seg = segments.iloc[segments_by_shape[shape_id]]
+        # Scale longitude so that distances are roughly equal in each axis
+        scale = np.cos(np.radians(seg["lat"].mean()))
+        start_x = seg["lon"].to_numpy() * scale
+        start_y = seg["lat"].to_numpy()
+        seg_x = seg["end_lon"].to_numpy() * scale - start_x
+        seg_y = seg["end_lat"].to_numpy() - start_y
+        seg_len2 = seg_x**2 + seg_y**2
+        seg_len2[seg_len2 == 0] = np.inf
+        start_dist = seg["shape_dist_traveled"].to_numpy()
+        seg_dist = seg["end_dist"].to_numpy() - start_dist
+
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            x = lon[chunk, None] * scale - start_x
+            y = lat[chunk, None] - start_y
+            t = np.clip((x * seg_x + y * seg_y) / seg_len2, 0, 1)
+            d2 = (x - t * seg_x) ** 2 + (y - t * seg_y) ** 2
+            closest = np.argmin(d2, axis=1)
+            step = np.arange(len(chunk))
+            dist_traveled[chunk] = (
+                start_dist[closest] + t[step, closest] * seg_dist[closest]
+            )
+
+    dist_traveled[np.isnan(lat) | np.isnan(lon)] = np.nan
+    return locations.assign(dist_traveled=dist_traveled)
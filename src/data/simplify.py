@@ -0,0 +1,179 @@
+"""
+Simplify shapes for drawing on a map.
+
+Shapes are simplified with Douglas-Peucker, run on every shape at once:
+each round splits every open segment of every shape at its furthest
+point, so the work is a few array passes rather than a recursion per
+shape. The distance at which each point would be dropped is turned into
+the coarsest level that still keeps it, so any level is a single filter.
+
+Levels depend only on the schedule, so they are cached on disk keyed by
+the feed version and only computed again when a new feed is loaded.
+"""
+import hashlib
+from pathlib import Path
+from typing import Callable, Sequence
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+# Largest distance in metres a point can be from the simplified line at
+# each level. Level 0 keeps every point
+TOLERANCES = (0.0, 2.0, 10.0, 40.0, 160.0, 640.0)
+
+# Metres per pixel at zoom 0 on the equator for 256 pixel web map tiles
+METRES_PER_PIXEL = 156543.03
+METRES_PER_DEGREE = 111320.0
+
+
+def feed_version(zip_path: Path) -> str:
+    """Version of a GTFS feed, from feed_info.txt when it has one and
+    otherwise a hash of the zip file"""
+    with zipfile.ZipFile(zip_path) as z:
+        if "feed_info.txt" in z.namelist():
+            with z.open("feed_info.txt") as f:
+                feed_info = pd.read_csv(f, dtype=str)
+            versions = feed_info.get("feed_version", pd.Series(dtype=str)).dropna()
+            if len(versions):
+                return versions.iloc[0]
+
+    digest = hashlib.sha256()
+    with open(zip_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def _importance(df: pd.DataFrame, smallest: float) -> np.ndarray:
+    """Distance in metres at which Douglas-Peucker drops each point.
+    Shape ends are never dropped. Points below smallest are left at 0"""
+    n = len(df)
+    ids = df["shape_id"].to_numpy()
+    lat = df["lat"].to_numpy(dtype=float)
+    lon = df["lon"].to_numpy(dtype=float)
+    scale = np.cos(np.radians(df.groupby("shape_id")["lat"].transform("mean")))
+    x = lon * scale.to_numpy() * METRES_PER_DEGREE
+    y = lat * METRES_PER_DEGREE
+
+    importance = np.zeros(n)
+    ends = np.ones(n, dtype=bool)
+    if n:
+        ends[1:-1] = (ids[1:-1] != ids[:-2]) | (ids[1:-1] != ids[2:])
+    importance[ends] = np.inf
+    kept = ends.copy()
+    # Points in segments that are already within the smallest tolerance
+    settled = ends.copy()
+
+    while True:
+        kept_rows = np.flatnonzero(kept)
+        rows = np.flatnonzero(~settled)
+        if not len(rows):
+            break
+        # Every point not yet kept lies on the segment between the kept
+        # points either side of it, which are always in the same shape
+        right = kept_rows[np.searchsorted(kept_rows, rows)]
+        left = kept_rows[np.searchsorted(kept_rows, rows) - 1]
+
+        seg_x, seg_y = x[right] - x[left], y[right] - y[left]
+        px, py = x[rows] - x[left], y[rows] - y[left]
+        seg_len2 = seg_x**2 + seg_y**2
+        # Closed loops start and end at the same point
+        seg_len2[seg_len2 == 0] = np.inf
+        t = np.clip((px * seg_x + py * seg_y) / seg_len2, 0, 1)
+        dist = np.hypot(px - t * seg_x, py - t * seg_y)
+
+        # Furthest point of each segment
+        order = np.lexsort((-dist, left))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = left[order][1:] != left[order][:-1]
+        furthest = order[first]
+        close = dist[furthest] < smallest
+        settled[rows[np.isin(left, left[furthest[close]])]] = True
+        furthest = furthest[~close]
+        if not len(furthest):
+            break
+
+        # A point can never outlast the point that created its segment
+        parent = np.minimum(importance[left[furthest]], importance[right[furthest]])
+        importance[rows[furthest]] = np.minimum(dist[furthest], parent)
+        kept[rows[furthest]] = True
+        settled[rows[furthest]] = True
+
+    return importance
+
+
+def simplification_levels(
+    shapes: pd.DataFrame, tolerances: Sequence[float] = TOLERANCES
+) -> pd.DataFrame:
+    """Find the simplification levels that keep each shape point
+
+    Args:
+        shapes (pd.DataFrame): Shapes with shape_id, shape_pt_sequence,
+            lat and lon
+        tolerances (Sequence[float], optional): Tolerance in metres of
+            each level, starting from 0. Defaults to TOLERANCES.
+
+    Returns:
+        pd.DataFrame: Shapes sorted by shape and sequence with a level
+        column. A point is drawn at a level if its level is at least that
+        level
+    """
+    shapes = shapes.sort_values(["shape_id", "shape_pt_sequence"])
+    smallest = tolerances[1] if len(tolerances) > 1 else np.inf
+    importance = _importance(shapes, smallest)
+    level = np.searchsorted(tolerances, importance, side="right") - 1
+    return shapes.assign(level=np.maximum(level, 0).astype(np.int8))
+
+
+def cached_levels(
+    get_shapes: Callable[[], pd.DataFrame], folder: Path, version: str
+) -> pd.DataFrame:
+    """Simplification levels of every shape, computed once per feed version
+
+    Args:
+        get_shapes (Callable[[], pd.DataFrame]): Loads the shapes, only
+            called when the cache is missing
+        folder (Path): Cache folder
+        version (str): Feed version, e.g. from feed_version
+
+    Returns:
+        pd.DataFrame: Shapes with a level column, as simplification_levels
+    """
+    path = folder / f"shapes_{version}.parquet"
+    if path.exists():
+        return pd.read_parquet(path)
+
+    levels = simplification_levels(get_shapes())
+    folder.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f"{path.name}.part")
+    levels.to_parquet(partial, index=False)
+    partial.replace(path)
+    for old in folder.glob("shapes_*.parquet"):
+        if old != path:
+            old.unlink()
+    return levels
+
+
+def level_for_zoom(
+    zoom: float, lat: float = -33.88, tolerances: Sequence[float] = TOLERANCES
+) -> int:
+    """Coarsest level whose tolerance is no more than a pixel at a zoom
+
+    Args:
+        zoom (float): Web map zoom level
+        lat (float, optional): Latitude of the map centre. Defaults to
+            Sydney.
+        tolerances (Sequence[float], optional): Tolerance of each level.
+            Defaults to TOLERANCES.
+
+    Returns:
+        int: Level to draw
+    """
+    pixel = METRES_PER_PIXEL * np.cos(np.radians(lat)) / 2**zoom
+    return int(np.searchsorted(tolerances, pixel, side="right") - 1)
+
+
+def select_level(shapes: pd.DataFrame, level: int) -> pd.DataFrame:
+    "Points of shapes with a level column that are drawn at a level"
+    return shapes[shapes["level"] >= level]
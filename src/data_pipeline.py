@@ -1,5 +1,89 @@
 #%%[markdown]
 # # Advanced data analytics data pipeline
+# Find bunching across the full locations history one window of
+# request timestamps at a time. Peak memory is bounded by one window
+# rather than by the size of the history.
 
 #%%
-print("More to come...")
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+from sqlalchemy import func, select
+from tqdm import tqdm
+
+from analysis import bunching
+from data.bulk import bulk_insert
+from data.data import engine
+from data.locations import iter_location_windows
+from data.model import BunchingEvent
+
+
+WINDOW_POLLS = 60  # one hour of one-minute polls
+WORKERS = 1
+EVENT_COLUMNS = [c.name for c in BunchingEvent.__table__.columns]
+
+
+def find_bunching_events(
+    locations: pd.DataFrame, workers: int = WORKERS
+) -> pd.DataFrame:
+    """Run bunching on a window of locations and keep the bunched buses
+
+    Args:
+        locations (pd.DataFrame): Locations from iter_location_windows
+        workers (int, optional): Processes to split the routes across.
+            Defaults to WORKERS.
+
+    Returns:
+        pd.DataFrame: Bunched locations that match the bunching_events table
+    """
+    bunched = bunching.is_bunched_parallel(locations, workers)
+    return bunched.loc[bunched["bunched"], EVENT_COLUMNS]
+
+
+def last_processed_timestamp() -> Optional[int]:
+    "Latest request_timestamp already saved to bunching_events"
+    stmt = select(func.max(BunchingEvent.request_timestamp))
+    with engine.connect() as con:
+        return con.scalar(stmt)
+
+
+def run_bunching(
+    window_polls: int = WINDOW_POLLS,
+    parquet_folder: Path = None,
+    workers: int = WORKERS,
+):
+    """Stream the locations history through the bunching algorithm.
+
+    Results are saved to the bunching_events table, continuing from the
+    last timestamp already saved. If a parquet folder is given, the whole
+    history is processed again and each window is saved to its own file
+    in that folder instead.
+
+    Args:
+        window_polls (int, optional): Request timestamps per window.
+            Defaults to WINDOW_POLLS.
+        parquet_folder (Path, optional): Folder for parquet output.
+            Defaults to None.
+        workers (int, optional): Processes used for each window. Defaults
+            to WORKERS.
+    """
+    after = None
+    if parquet_folder is None:
+        after = last_processed_timestamp()
+    else:
+        parquet_folder.mkdir(parents=True, exist_ok=True)
+
+    for window_start, locations in tqdm(iter_location_windows(window_polls, after)):
+        events = find_bunching_events(locations, workers)
+        if parquet_folder is None:
+            bulk_insert(
+                events, BunchingEvent.__tablename__, engine, on_conflict="ignore"
+            )
+        else:
+            events.to_parquet(parquet_folder / f"{window_start}.parquet", index=False)
+
+
+#%%
+if __name__ == "__main__":
+    run_bunching()
@@ -1,14 +1,16 @@
+import asyncio
 from datetime import datetime, timedelta
 import sched, time
-from typing import Sequence
+from typing import Iterator, Sequence
 
-from data import realtime
+from data import positions, realtime
 
 
 START_HOUR = 7
 START_MINUTE = 0
 WAIT_TIME = 60  # seconds
 MAX_ITERS = 120
+LATE_TOLERANCE = 5  # seconds
 
 
 def generate_fetch_times(start_time=datetime.now(), wait_time=60, max_iters=60):
@@ -53,12 +55,108 @@ def schedule_fetch(scheduler: sched.scheduler, fetch_times: Sequence):
         print(f"Fetching failed: {datetime.now()}")
 
 
+def _print_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
+
+
+async def fetch_positions(fetch_time: float, write_queue: asyncio.Queue):
+    """Download and decode one poll, then queue it to be saved. The
+    download and decode run in threads so that the event loop is free to
+    start the next poll on time
+
+    Args:
+        fetch_time (float): Scheduled time of the poll
+        write_queue (asyncio.Queue): Queue of dataframes to be saved
+    """
+    lateness = time.time() - fetch_time
+    if lateness > LATE_TOLERANCE:
+        print(f"Poll for {_print_time(fetch_time)} started {lateness:.0f}s late")
+
+    try:
+        content = await asyncio.to_thread(realtime.download_positions)
+        df = await asyncio.to_thread(positions.decode_positions_dataframe, content)
+    except Exception as e:  # pylint: disable=broad-except
+        print(f"Fetching failed for {_print_time(fetch_time)}: {e!r}")
+        return
+
+    write_queue.put_nowait(df)
+    if (waiting := write_queue.qsize()) > 1:
+        print(f"{waiting} polls are waiting to be saved")
+
+
+async def write_positions(write_queue: asyncio.Queue):
+    """Save queued polls to the database and the Parquet archive one at a
+    time until None is received. A slow save only delays the saves behind
+    it, never a fetch
+
+    Args:
+        write_queue (asyncio.Queue): Queue of dataframes to be saved
+    """
+    while (df := await write_queue.get()) is not None:
+        try:
+            await asyncio.to_thread(realtime.upload_realtime, df)
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"Saving failed: {datetime.now()}: {e!r}")
+        try:
+            await asyncio.to_thread(realtime.archive_realtime, df)
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"Archiving failed: {datetime.now()}: {e!r}")
+
+
+async def run_fetch_loop(fetch_times: Iterator[float], wait_time: int = WAIT_TIME):
+    """Start a poll at each fetch time without waiting for earlier polls
+    to finish downloading or saving. Polls skipped because the loop fell
+    behind are reported
+
+    Args:
+        fetch_times (Iterator[float]): Timestamps from generate_fetch_times
+        wait_time (int, optional): Expected seconds between polls. Defaults
+            to WAIT_TIME.
+    """
+    write_queue = asyncio.Queue()
+    writer = asyncio.create_task(write_positions(write_queue))
+    polls = set()
+
+    previous_time = None
+    for fetch_time in fetch_times:
+        await asyncio.sleep(max(0, fetch_time - time.time()))
+
+        if previous_time is not None:
+            missed = round((fetch_time - previous_time) / wait_time) - 1
+            if missed > 0:
+                print(f"Missed {missed} polls before {_print_time(fetch_time)}")
+        previous_time = fetch_time
+
+        poll = asyncio.create_task(fetch_positions(fetch_time, write_queue))
+        polls.add(poll)
+        poll.add_done_callback(polls.discard)
+
+    print("Last fetch has been reached")
+    await asyncio.gather(*polls)
+    await write_queue.put(None)
+    await writer
+
+
+def next_start_time(now: datetime) -> datetime:
+    "START_HOUR:START_MINUTE on the day after now"
+    tomorrow = now + timedelta(days=1)
+    return tomorrow.replace(
+        hour=START_HOUR, minute=START_MINUTE, second=0, microsecond=0
+    )
+
+
+def main_async():
+    "Generate times for today and fetch them with the asyncio loop"
+    fetch_times = generate_fetch_times(
+        next_start_time(datetime.now()), WAIT_TIME, MAX_ITERS
+    )
+    asyncio.run(run_fetch_loop(fetch_times, WAIT_TIME))
+
+
 def main():
     "Generate times for today"
-    now = datetime.now()
-    tomorrow = (now.year, now.month, now.day + 1)
     fetch_times = generate_fetch_times(
-        datetime(*tomorrow, START_HOUR, START_MINUTE), WAIT_TIME, MAX_ITERS
+        next_start_time(datetime.now()), WAIT_TIME, MAX_ITERS
     )
 
     scheduler = sched.scheduler(time.time, time.sleep)
@@ -67,4 +165,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    main_async()
@@ -3,18 +3,24 @@ Run this script from the pythontraining folder
 e.g. python -m data.hydrate
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import os
 from pathlib import Path
-from typing import IO
+from typing import IO, List, Optional, Tuple
 import zipfile
-import requests
 
 import pandas as pd
 from dotenv import load_dotenv
-from sqlalchemy import Table, delete
+from sqlalchemy import (
+    Connection, Table, bindparam, delete, insert, inspect, select, text, tuple_,
+    update
+)
 
+from data.bulk import bulk_insert
+from data.download import download_file, mark_loaded
 from data.data import zip_path, engine, Session
-from data.model import _gtfs_table_registry_
+from data.gtfs import CHUNKSIZE, dependency_levels, read_gtfs, read_gtfs_chunks
+from data.model import _gtfs_table_registry_, begin_ddl, copy_table
 
 
 load_dotenv()
@@ -27,9 +33,25 @@ BASE_URL = "https://api.transport.nsw.gov.au"
 BUS_POSITION_URI = f"{BASE_URL}/v1/gtfs/vehiclepos/buses"
 BUS_SCHEDULE_URI = f"{BASE_URL}/v1/gtfs/schedule/buses"
 FERRY_POSITION = f"{BASE_URL}/v1/gtfs/historical"
+SHADOW_SUFFIX = "_shadow"
 
-def download_gtfs():
-    """Download GTFS data and save to the configured zip folder
+def _valid_zip(path: Path) -> bool:
+    "Check that a downloaded file is a complete zip"
+    if not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as z:
+        return z.testzip() is None
+
+
+def download_gtfs() -> bool:
+    """Download GTFS data and save to the configured zip folder. The
+    download is skipped if the schedule has not changed since the last
+    download, and an interrupted download is resumed. Call mark_loaded
+    on zip_path once the schedule is in the database, otherwise the same
+    schedule is returned again by the next call
+
+    Returns:
+        bool: True if there is a schedule that has not been loaded
     """
     headers = {
         "Authorization": f"apikey {api_key}"
@@ -37,17 +59,15 @@ def download_gtfs():
     request_details = {
         "timeout": 50,
         "headers": headers,
-        "stream": True
     }
     # On our network, we need to add a certificate or the request will fail
     # Look at the readme for instructions on how to set this up
     if cert:=os.getenv("CERT", None):
         request_details['verify'] = cert
 
-    response = requests.get(BUS_SCHEDULE_URI, **request_details)
-
-    with open(zip_path, "wb") as f:
-        f.write(response.content)
+    return download_file(
+        BUS_SCHEDULE_URI, zip_path, validate=_valid_zip, **request_details
+    )
 
 
 def replace_table(table: Table, df: pd.DataFrame):
@@ -78,13 +98,39 @@ def get_df(table: Table, file: IO) -> pd.DataFrame:
     Returns:
         pd.DataFrame: Pandas dataframe of the CSV
     """
-    df_raw = pd.read_csv(file)
-    cols_to_include = table._gtfs_fields_
-    new_cols = [c.name for c in table.__table__.columns]
-    col_mapping = dict(zip(cols_to_include, new_cols))
+    return read_gtfs(table, file)
+
+
+def clear_table(table: Table):
+    "Delete every row in a table"
+    stmt = delete(table).where(1==1)
+    with Session() as session:
+        session.execute(stmt)
+        session.commit()
+
+
+def stream_table(
+    table: Table, file: IO, chunksize: int = CHUNKSIZE, clear: bool = True
+) -> int:
+    """Replace the data in a table, reading and saving one chunk at a time
+    so that memory stays flat whatever the size of the file
+
+    Args:
+        table (Table): SQLAlchemy table
+        file (IO): Open GTFS file for the table
+        chunksize (int, optional): Rows per chunk. Defaults to CHUNKSIZE.
+        clear (bool, optional): Delete existing rows first. Defaults to True.
+
+    Returns:
+        int: Number of rows saved
+    """
+    if clear:
+        clear_table(table)
 
-    df_result = df_raw[list(cols_to_include)].rename(columns=col_mapping)
-    return df_result
+    rows = 0
+    for chunk in read_gtfs_chunks(table, file, chunksize):
+        rows += bulk_insert(chunk, table.__tablename__, engine)
+    return rows
 
 
 def upload_gtfs_files():
@@ -95,10 +141,463 @@ def upload_gtfs_files():
         for table in _gtfs_table_registry_:
             print(table.__tablename__)
             with z.open(f"{table._gtfs_file_}.txt") as f:
-                table_data = get_df(table, f)
-                replace_table(table, table_data)
+                stream_table(table, f)
+
+
+def _load_table(table: Table) -> int:
+    "Load one table from its own handle on the zip file, for use in a thread"
+    with zipfile.ZipFile(zip_path) as z:
+        with z.open(f"{table._gtfs_file_}.txt") as f:
+            return stream_table(table, f, clear=False)
+
+
+def upload_gtfs_files_parallel(workers: Optional[int] = None):
+    """Upload all CSV files from the GTFS zip, loading tables that do not
+    depend on each other at the same time. Existing rows are deleted
+    children first, then tables are loaded parents first, following the
+    foreign keys in data.model. Each thread has its own connection.
+
+    SQLite only allows one writer at a time, so tables are loaded one at
+    a time there.
+
+    Args:
+        workers (int, optional): Tables to load at once. Defaults to every
+            table in a group.
+    """
+    levels = dependency_levels(_gtfs_table_registry_)
+    if engine.dialect.name == "sqlite":
+        workers = 1
+
+    for level in reversed(levels):
+        for table in level:
+            clear_table(table)
+
+    for level in levels:
+        with ThreadPoolExecutor(workers or len(level)) as pool:
+            for table, rows in zip(level, pool.map(_load_table, level)):
+                print(f"{table.__tablename__}: {rows} rows")
+
+
+def create_shadow_table(table: Table) -> Table:
+    """Create an empty copy of a table to load into. Indexes are left out
+    so that they are built once after loading rather than row by row
+
+    Args:
+        table (Table): SQLAlchemy table
+
+    Returns:
+        Table: The shadow table
+    """
+    shadow = copy_table(table, f"{table.__tablename__}{SHADOW_SUFFIX}")
+    shadow.drop(engine, checkfirst=True)
+    shadow.create(engine)
+    return shadow
+
+
+def _foreign_keys_to(
+    connection: Connection, table_name: str
+) -> Tuple[List[str], List[str]]:
+    """Statements that recreate the foreign keys from other tables to a
+    table on PostgreSQL.
+
+    Partitions are skipped, as they take their foreign keys from the
+    partitioned parent. Keys on ordinary tables are added NOT VALID so the
+    swap does not scan them, and validated after it commits. PostgreSQL
+    does not allow NOT VALID keys on partitioned tables, so those are
+    checked when they are added.
+
+    Args:
+        connection (Connection): Connection inside the swap transaction
+        table_name (str): Table the foreign keys refer to
+
+    Returns:
+        Tuple[List[str], List[str]]: Statements to add the keys, and
+            statements to validate them once the swap has committed
+    """
+    kinds = dict(connection.execute(text(
+        "SELECT relname, CASE WHEN relispartition THEN 'partition' "
+        "ELSE relkind::text END FROM pg_class "
+        "WHERE relnamespace = current_schema()::regnamespace"
+    )).all())
+    inspector = inspect(connection)
+    statements, validations = [], []
+    for other in inspector.get_table_names():
+        skip = other.endswith(SHADOW_SUFFIX) or kinds.get(other) == "partition"
+        if skip or other == table_name:
+            continue
+        partitioned = kinds.get(other) == "p"
+        for fk in inspector.get_foreign_keys(other):
+            if fk["referred_table"] != table_name:
+                continue
+            statements.append(
+                f'ALTER TABLE "{other}" ADD CONSTRAINT "{fk["name"]}" '
+                f'FOREIGN KEY ({", ".join(fk["constrained_columns"])}) '
+                f'REFERENCES "{table_name}" ({", ".join(fk["referred_columns"])})'
+                f'{"" if partitioned else " NOT VALID"}'
+            )
+            if not partitioned:
+                validations.append(
+                    f'ALTER TABLE "{other}" VALIDATE CONSTRAINT "{fk["name"]}"'
+                )
+    return statements, validations
+
+
+def swap_shadow_tables(pairs: List[Tuple[Table, Table]]):
+    """Replace tables with their loaded shadows in one transaction, so that
+    readers see either the old or the new data for every table and never a
+    partial load or a mix of old and new tables.
+
+    On PostgreSQL the indexes are built on the shadows before the swap and
+    renamed afterwards, and foreign keys are pointed at the new tables.
+    SQLite cannot rename indexes, so they are built inside the swap
+    transaction, which readers in WAL mode do not wait for.
+
+    Args:
+        pairs (List[Tuple[Table, Table]]): Each SQLAlchemy table with its
+            loaded shadow table from create_shadow_table
+    """
+    postgres = engine.dialect.name == "postgresql"
+
+    if postgres:
+        with engine.begin() as connection:
+            for table, shadow in pairs:
+                for index in table.__table__.indexes:
+                    connection.execute(text(
+                        f'CREATE {"UNIQUE " if index.unique else ""}INDEX '
+                        f'"{index.name}{SHADOW_SUFFIX}" ON "{shadow.name}" '
+                        f'({", ".join(c.name for c in index.columns)})'
+                    ))
+
+    foreign_keys, validations = [], []
+    with engine.begin() as connection:
+        if postgres:
+            for table, _ in pairs:
+                statements, checks = _foreign_keys_to(connection, table.__tablename__)
+                foreign_keys += statements
+                validations += checks
+        else:
+            begin_ddl(connection)
+            # Stop SQLite from pointing other tables' foreign keys at the
+            # renamed old tables
+            connection.execute(text("PRAGMA legacy_alter_table = ON"))
+
+        for table, shadow in pairs:
+            name = table.__tablename__
+            connection.execute(text(f'ALTER TABLE "{name}" RENAME TO "{name}_old"'))
+            connection.execute(text(f'ALTER TABLE "{shadow.name}" RENAME TO "{name}"'))
+        for table, _ in pairs:
+            connection.execute(text(
+                f'DROP TABLE "{table.__tablename__}_old"'
+                f'{" CASCADE" if postgres else ""}'
+            ))
+
+        for table, shadow in pairs:
+            name = table.__tablename__
+            if postgres:
+                connection.execute(text(
+                    f'ALTER TABLE "{name}" RENAME CONSTRAINT '
+                    f'"{shadow.name}_pkey" TO "{name}_pkey"'
+                ))
+                for index in table.__table__.indexes:
+                    connection.execute(text(
+                        f'ALTER INDEX "{index.name}{SHADOW_SUFFIX}" '
+                        f'RENAME TO "{index.name}"'
+                    ))
+            else:
+                for index in table.__table__.indexes:
+                    index.create(connection)
+        for statement in foreign_keys:
+            connection.execute(text(statement))
+        if not postgres:
+            connection.execute(text("PRAGMA legacy_alter_table = OFF"))
+
+    if validations:
+        with engine.begin() as connection:
+            for statement in validations:
+                connection.execute(text(statement))
+
+
+def swap_shadow_table(table: Table, shadow: Table):
+    """Replace a table with its loaded shadow in one transaction
+
+    Args:
+        table (Table): SQLAlchemy table
+        shadow (Table): Loaded shadow table from create_shadow_table
+    """
+    swap_shadow_tables([(table, shadow)])
+
+
+def load_shadow_table(
+    table: Table, file: IO, chunksize: int = CHUNKSIZE
+) -> Tuple[Table, int]:
+    """Load a GTFS file into a new shadow table, leaving the live table as
+    it is
+
+    Args:
+        table (Table): SQLAlchemy table
+        file (IO): Open GTFS file for the table
+        chunksize (int, optional): Rows per chunk. Defaults to CHUNKSIZE.
+
+    Returns:
+        Tuple[Table, int]: The shadow table and the number of rows loaded
+    """
+    shadow = create_shadow_table(table)
+    rows = 0
+    for chunk in read_gtfs_chunks(table, file, chunksize):
+        rows += bulk_insert(chunk, shadow.name, engine)
+    return shadow, rows
+
+
+def shadow_load_table(table: Table, file: IO, chunksize: int = CHUNKSIZE) -> int:
+    """Load a GTFS file into a shadow table and swap it in
+
+    Args:
+        table (Table): SQLAlchemy table
+        file (IO): Open GTFS file for the table
+        chunksize (int, optional): Rows per chunk. Defaults to CHUNKSIZE.
+
+    Returns:
+        int: Number of rows loaded
+    """
+    shadow, rows = load_shadow_table(table, file, chunksize)
+    swap_shadow_table(table, shadow)
+    return rows
+
+
+def reload_gtfs_files_shadow():
+    """Reload every table from the GTFS zip through shadow tables, so the
+    live tables are never empty or half filled while loading. Every shadow
+    is loaded before any is swapped in, and all are swapped in together,
+    so a failed load leaves the old schedule in place and readers never
+    see new trips with old stop times
+    """
+    pairs = []
+    with zipfile.ZipFile(zip_path) as z:
+        for table in _gtfs_table_registry_:
+            with z.open(f"{table._gtfs_file_}.txt") as f:
+                shadow, rows = load_shadow_table(table, f)
+            pairs.append((table, shadow))
+            print(f"{table.__tablename__}: {rows} rows")
+    swap_shadow_tables(pairs)
+
+
+def primary_key(table: Table) -> List[str]:
+    "Names of the primary key columns of a table"
+    return [c.name for c in table.__table__.primary_key.columns]
+
+
+def _row_hash(df: pd.DataFrame, columns: List[str]) -> pd.Series:
+    "Hash of the non-key values in each row"
+    values = df[columns].astype(object).where(df[columns].notna(), None)
+    return pd.util.hash_pandas_object(values.astype(str), index=False)
+
+
+def _align_types(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    "Cast the loaded data to the types read from the CSV where possible"
+    old = old.copy()
+    for column, dtype in new.dtypes.items():
+        try:
+            old[column] = old[column].astype(dtype)
+        except (TypeError, ValueError):
+            pass
+    return old
+
+
+def diff_table(
+    old: pd.DataFrame, new: pd.DataFrame, keys: List[str]
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Compare the loaded rows of a table with the rows from a new feed
+
+    Args:
+        old (pd.DataFrame): Rows currently in the database
+        new (pd.DataFrame): Rows from the new GTFS file
+        keys (List[str]): Primary key columns
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]: New rows to
+        insert, new rows that replace changed rows, and the keys of rows
+        to delete
+    """
+    old = _align_types(old[list(new.columns)], new)
+    values = [c for c in new.columns if c not in keys]
+    new_hashes = new[keys].assign(_hash=_row_hash(new, values).to_numpy())
+    old_hashes = old[keys].assign(_hash=_row_hash(old, values).to_numpy())
+
+    merged = new_hashes.merge(
+        old_hashes, on=keys, how="outer", indicator=True, suffixes=("", "_old")
+    )
+    inserted = merged.loc[merged["_merge"] == "left_only", keys]
+    updated = merged.loc[
+        (merged["_merge"] == "both") & (merged["_hash"] != merged["_hash_old"]),
+        keys,
+    ]
+    deleted = merged.loc[merged["_merge"] == "right_only", keys]
+
+    inserts = new.merge(inserted, on=keys)
+    updates = new.merge(updated, on=keys)
+    return inserts, updates, deleted
+
+
+def _python_values(df: pd.DataFrame) -> pd.DataFrame:
+    """Values as Python scalars with None for nulls, as drivers cannot bind
+    numpy integers from Int64 columns. SQLite binds them as blobs that
+    match no rows"""
+    return df.astype(object).where(df.notna(), None)
+
+
+def delete_keys(
+    table: Table,
+    keys: pd.DataFrame,
+    batch_size: int = 500,
+    connection: Optional[Connection] = None,
+):
+    """Delete rows by primary key in batches
+
+    Args:
+        table (Table): SQLAlchemy table
+        keys (pd.DataFrame): Primary key values of the rows to delete
+        batch_size (int, optional): Keys per statement. Defaults to 500.
+        connection (Connection, optional): Connection whose transaction
+            the deletes are part of. Defaults to a transaction of their
+            own.
+    """
+    if connection is None:
+        with engine.begin() as connection:
+            return delete_keys(table, keys, batch_size, connection)
+
+    columns = [getattr(table, c) for c in keys.columns]
+    key_column = columns[0] if len(columns) == 1 else tuple_(*columns)
+    rows = list(_python_values(keys).itertuples(index=False, name=None))
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        if len(columns) == 1:
+            batch = [row[0] for row in batch]
+        connection.execute(delete(table).where(key_column.in_(batch)))
+
+
+def update_rows(connection: Connection, table: Table, df: pd.DataFrame):
+    """Update changed rows in place by primary key, so that rows in other
+    tables that refer to them are never left without a parent
+
+    Args:
+        connection (Connection): Connection to run the updates in
+        table (Table): SQLAlchemy table
+        df (pd.DataFrame): New values of the rows, including their keys
+    """
+    if df.empty:
+        return
+    sql_table = table.__table__
+    keys = primary_key(table)
+    # Key parameters are renamed so they do not clash with the SET values
+    stmt = update(sql_table).where(
+        *[sql_table.c[key] == bindparam(f"_key_{key}") for key in keys]
+    )
+    records = _python_values(df).to_dict("records")
+    for record in records:
+        for key in keys:
+            record[f"_key_{key}"] = record[key]
+    connection.execute(stmt, records)
+
+
+def insert_rows(connection: Connection, table: Table, df: pd.DataFrame):
+    "Insert rows with an executemany in the connection's transaction"
+    if df.empty:
+        return
+    records = _python_values(df).to_dict("records")
+    connection.execute(insert(table.__table__), records)
+
+
+def table_changes(
+    table: Table, df: pd.DataFrame
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Compare the rows loaded for a table with a new feed
+
+    Args:
+        table (Table): SQLAlchemy table
+        df (pd.DataFrame): Pandas dataframe that matches the table schema
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]: Rows to insert,
+        rows to update and keys of rows to delete, as from diff_table
+    """
+    old = pd.read_sql(select(table.__table__), engine)
+    return diff_table(old, df, primary_key(table))
+
+
+def _counts(table: Table, changes: Tuple[pd.DataFrame, ...]) -> dict:
+    inserts, updates, deletes = changes
+    return {
+        "table": table.__tablename__,
+        "inserts": len(inserts),
+        "updates": len(updates),
+        "deletes": len(deletes),
+    }
+
+
+def refresh_table(table: Table, df: pd.DataFrame, dry_run: bool = False) -> dict:
+    """Apply only the differences between the loaded data and a new feed,
+    in one transaction. Changed rows are updated in place
+
+    Args:
+        table (Table): SQLAlchemy table
+        df (pd.DataFrame): Pandas dataframe that matches the table schema
+        dry_run (bool, optional): Count the changes without applying them.
+            Defaults to False.
+
+    Returns:
+        dict: Number of inserted, updated and deleted rows
+    """
+    changes = table_changes(table, df)
+    if not dry_run:
+        inserts, updates, deletes = changes
+        with engine.begin() as connection:
+            delete_keys(table, deletes, connection=connection)
+            update_rows(connection, table, updates)
+            insert_rows(connection, table, inserts)
+    return _counts(table, changes)
+
+
+def refresh_gtfs_files(dry_run: bool = False) -> pd.DataFrame:
+    """Incrementally refresh all tables from the GTFS zip, rather than
+    deleting and reloading every row.
+
+    Every change is applied in one transaction, so readers never see one
+    table refreshed and another not. Rows are deleted children first and
+    updated and inserted parents first, following the foreign keys in
+    data.model, so no row is ever left without its parent.
+
+    Args:
+        dry_run (bool, optional): Only report the number of changes.
+            Defaults to False.
+
+    Returns:
+        pd.DataFrame: Number of changes for each table
+    """
+    levels = dependency_levels(_gtfs_table_registry_)
+    tables = [table for level in levels for table in level]
+
+    changes = {}
+    with zipfile.ZipFile(zip_path) as z:
+        for table in tables:
+            with z.open(f"{table._gtfs_file_}.txt") as f:
+                changes[table] = table_changes(table, get_df(table, f))
+            print(_counts(table, changes[table]))
+
+    if not dry_run:
+        with engine.begin() as connection:
+            for table in reversed(tables):
+                delete_keys(table, changes[table][2], connection=connection)
+            for table in tables:
+                inserts, updates, _ = changes[table]
+                update_rows(connection, table, updates)
+                insert_rows(connection, table, inserts)
+
+    return pd.DataFrame([_counts(table, changes[table]) for table in tables])
 
 
 if __name__ == "__main__":
-    download_gtfs()
-    upload_gtfs_files()
+    if download_gtfs():
+        refresh_gtfs_files()
+        mark_loaded(zip_path)
+    else:
+        print("Schedule has not changed since the last download")
@@ -1,33 +1,172 @@
+from typing import List, Optional
+
+import numpy as np
 import pandas as pd
+import plotly.colors
 import plotly.graph_objects as go
 
+from analysis import density
+from data import simplify
+from data.location_queries import BoundingBox
+
+DEFAULT_ZOOM = 6
+
+
+def category_colours(values:pd.Series) -> np.ndarray:
+    """A colour from the qualitative palette for each value. Colours come
+    from a hash of the value, so a route keeps its colour between calls"""
+    palette = np.array(plotly.colors.qualitative.Plotly)
+    codes = pd.util.hash_array(values.astype(str).to_numpy(dtype=object))
+    return palette[codes % len(palette)]
+
+
+def with_separators(df:pd.DataFrame, group:str, columns:List[str]) -> pd.DataFrame:
+    """Join groups of rows into one set of columns with a null row after
+    each group, so that one line trace draws each group as its own line
+
+    Args:
+        df (pd.DataFrame): Rows in drawing order within each group
+        group (str): Column that groups rows, e.g. shape_id
+        columns (List[str]): Columns to keep
+
+    Returns:
+        pd.DataFrame: Rows of each group followed by a null row
+    """
+    df = df.sort_values(group, kind="stable")
+    keys = df[group].to_numpy()
+    group_end = np.append(keys[1:] != keys[:-1], len(keys) > 0)
+    # Each row moves down by the number of groups before it
+    position = np.arange(len(df)) + np.cumsum(group_end) - group_end
+    separator = np.flatnonzero(group_end) + np.arange(group_end.sum()) + 1
+
+    size = len(df) + len(separator)
+    joined = {}
+    for column in columns:
+        values = df[column].to_numpy()
+        if values.dtype.kind == "f":
+            out = np.full(size, np.nan)
+        else:
+            out = np.full(size, None, dtype=object)
+        out[position] = values
+        joined[column] = out
+    return pd.DataFrame(joined)
 
-def add_positions(fig:go.Figure, lat_lon:pd.DataFrame) -> go.Figure:
+
+def add_positions(
+    fig:go.Figure, lat_lon:pd.DataFrame, color:Optional[str]="route_id"
+) -> go.Figure:
+    """Add vehicle positions as one marker trace
+
+    Args:
+        fig (go.Figure): Map to add to
+        lat_lon (pd.DataFrame): Positions with lat and lon
+        color (str, optional): Column to colour and name markers by, if
+            the positions have it. Defaults to "route_id".
+
+    Returns:
+        go.Figure: The map
+    """
+    marker = {}
+    text = None
+    if color is not None and color in lat_lon:
+        marker["color"] = category_colours(lat_lon[color])
+        text = lat_lon[color]
     fig.add_trace(
         go.Scattermapbox(
             mode = "markers",
             lon=lat_lon['lon'],
-            lat=lat_lon['lat']
+            lat=lat_lon['lat'],
+            marker=marker,
+            text=text,
+            hoverinfo="text" if text is not None else None,
+            showlegend=False,
         )
     )
 
     return fig
 
-def add_routes(fig:go.Figure, route_shapes:pd.DataFrame) -> go.Figure:
-    for id, df_id in route_shapes.groupby("shape_id"):
+def add_routes(
+    fig:go.Figure,
+    route_shapes:pd.DataFrame,
+    batched:bool=True,
+    color:Optional[str]=None,
+) -> go.Figure:
+    """Add a line for each shape
+
+    Args:
+        fig (go.Figure): Map to add to
+        route_shapes (pd.DataFrame): Shape points with shape_id, lat and
+            lon, in sequence order
+        batched (bool, optional): Draw every shape in one trace, split by
+            null points, rather than a trace per shape. Defaults to True.
+        color (str, optional): Column with a line colour for each shape,
+            e.g. route colours. Batched shapes get a trace per colour.
+            Defaults to None.
+
+    Returns:
+        go.Figure: The map
+    """
+    if not batched:
+        for id, df_id in route_shapes.groupby("shape_id"):
+            fig.add_trace(
+                go.Scattermapbox(
+                    mode = "lines",
+                    lon = df_id['lon'],
+                    lat = df_id['lat'],
+                    name = id
+                )
+            )
+        return fig
+
+    if color is None:
+        groups = [(None, route_shapes)]
+    else:
+        groups = route_shapes.groupby(color, sort=False)
+    for line_color, df_color in groups:
+        lines = with_separators(
+            df_color, "shape_id", ["lat", "lon", "shape_id"]
+        )
         fig.add_trace(
             go.Scattermapbox(
                 mode = "lines",
-                lon = df_id['lon'],
-                lat = df_id['lat'],
-                name = id
+                lon = lines['lon'],
+                lat = lines['lat'],
+                text = lines['shape_id'],
+                hoverinfo = "text",
+                line = {"color": line_color} if line_color else {},
+                showlegend = False,
             )
         )
-    
+
+    return fig
+
+
+def add_density(fig:go.Figure, cells:pd.DataFrame, z:str="count") -> go.Figure:
+    """Add binned positions as a density layer
+
+    Args:
+        fig (go.Figure): Map to add to
+        cells (pd.DataFrame): Cells from analysis.density.bin_positions
+        z (str, optional): Cell value to show, e.g. count or
+            bunching_rate. Defaults to "count".
+
+    Returns:
+        go.Figure: The map
+    """
+    fig.add_trace(
+        go.Densitymapbox(
+            lat=cells['lat'],
+            lon=cells['lon'],
+            z=cells[z],
+            radius=10,
+            colorbar={"title": z},
+        )
+    )
+
     return fig
 
 
-def get_base_map(title=None) -> go.Figure:
+def get_base_map(title=None, zoom:float=DEFAULT_ZOOM) -> go.Figure:
     fig = go.Figure()
 
     fig.update_layout(
@@ -36,7 +175,7 @@ def get_base_map(title=None) -> go.Figure:
         mapbox = {
             'center': {'lon': 151.206, 'lat': -33.88357},
             'style': "carto-positron",
-            'zoom': 6
+            'zoom': zoom
         },
         geo = dict(
             scope = 'asia',
@@ -50,13 +189,60 @@ def get_base_map(title=None) -> go.Figure:
     return fig
 
 
-def routemap(route_shapes:pd.DataFrame) -> go.Figure:
-    fig = get_base_map("Example bus routes")
-    add_routes(fig, route_shapes)
+def routemap(
+    route_shapes:pd.DataFrame, zoom:Optional[float]=None, batched:bool=True
+) -> go.Figure:
+    """Map of route shapes, simplified to the detail visible at the zoom
+
+    Args:
+        route_shapes (pd.DataFrame): Shapes, ideally with the level column
+            from data.simplify.cached_levels. Levels are computed here if
+            missing
+        zoom (float, optional): Map zoom. Defaults to the base map zoom.
+        batched (bool, optional): Passed to add_routes. Defaults to True.
+
+    Returns:
+        go.Figure: Map with a line for each shape
+    """
+    zoom = DEFAULT_ZOOM if zoom is None else zoom
+    if "level" not in route_shapes:
+        route_shapes = simplify.simplification_levels(route_shapes)
+    level = simplify.level_for_zoom(zoom)
+
+    fig = get_base_map("Example bus routes", zoom)
+    add_routes(fig, simplify.select_level(route_shapes, level), batched)
     return fig
 
 
-def position_map(lat_lon) -> go.Figure:
+def position_map(lat_lon, color:Optional[str]="route_id") -> go.Figure:
     fig = get_base_map("Example bus routes")
-    add_positions(fig, lat_lon)
+    add_positions(fig, lat_lon, color)
+    return fig
+
+
+def density_map(
+    lat_lon:pd.DataFrame,
+    zoom:float=DEFAULT_ZOOM,
+    bbox:Optional[BoundingBox]=None,
+    z:str="count",
+    grid:str="hex",
+) -> go.Figure:
+    """Map of where positions are, binned on the server into cells sized
+    for the zoom, so the figure holds cells rather than positions
+
+    Args:
+        lat_lon (pd.DataFrame): Positions with lat and lon, and a bunched
+            column to show bunching_rate
+        zoom (float, optional): Map zoom. Defaults to DEFAULT_ZOOM.
+        bbox (BoundingBox, optional): Viewport to bin. Defaults to None.
+        z (str, optional): count or bunching_rate. Defaults to "count".
+        grid (str, optional): hex or square. Defaults to "hex".
+
+    Returns:
+        go.Figure: Map with a density layer
+    """
+    cell_size = density.cell_size_for_zoom(zoom)
+    cells = density.bin_positions(lat_lon, cell_size, grid, bbox)
+    fig = get_base_map("Bus positions", zoom)
+    add_density(fig, cells, z)
     return fig
@@ -0,0 +1,41 @@
+"Fixtures for modules that read the database settings when imported"
+from pathlib import Path
+import sys
+
+import pytest
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.orm import sessionmaker
+
+from data.model import Base
+
+SRC = Path(__file__).parents[1] / "src"
+
+
+@pytest.fixture
+def data_env(monkeypatch, tmp_path):
+    """Settings for data.data, which reads DATA_PATH and SQLDRIVER from the
+    environment the first time it is imported"""
+    monkeypatch.setenv("DATA_PATH", str(tmp_path))
+    monkeypatch.setenv("SQLDRIVER", f"sqlite:///{tmp_path / 'unused.db'}")
+
+
+@pytest.fixture
+def engine(data_env, monkeypatch, tmp_path):
+    """Empty SQLite database with every table, used in place of the
+    data.data engine and Session by modules imported before or during the
+    test"""
+    from data import data
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(engine)
+    monkeypatch.setattr(data, "engine", engine)
+    monkeypatch.setattr(data, "Session", session)
+    for module in list(sys.modules.values()):
+        in_src = SRC in Path(getattr(module, "__file__", None) or "/").parents
+        if in_src and isinstance(getattr(module, "engine", None), Engine):
+            monkeypatch.setattr(module, "engine", engine)
+        if in_src and isinstance(getattr(module, "Session", None), sessionmaker):
+            monkeypatch.setattr(module, "Session", session)
+    yield engine
+    engine.dispose()
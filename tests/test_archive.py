@@ -0,0 +1,65 @@
+"Test the Parquet archive of positions"
+import pandas as pd
+import polars as pl
+import pyarrow.parquet as pq
+
+from data import archive
+
+
+def make_poll(request_timestamp) -> pd.DataFrame:
+    "Positions as decoded from the feed, with blanks for missing fields"
+    return pd.DataFrame({
+        'id': ['a', 'b', 'c'],
+        'trip_id': ['t1', 't2', 't3'],
+        'route_id': ['r1', 'r1', 'r2'],
+        'schedule_relationship': [0, 0, ''],
+        'lat': [-33.8, None, -33.9],
+        'lon': [151.2, None, 151.1],
+        'bearing': [90.0, None, 180.0],
+        'speed': [5.0, None, 0.0],
+        'timestamp': request_timestamp,
+        'congestion_level': [1, 1, ''],
+        'stop_id': '',
+        'vehicle_id': ['v1', 'v2', 'v3'],
+        'label': '',
+        'request_timestamp': request_timestamp,
+    })
+
+
+def test_roll_up(tmp_path):
+    "Finished hours move from staging to day and route folders"
+    staging, archive_folder = tmp_path / 'staging', tmp_path / 'archive'
+    # The first poll is on 2023-09-11 in Sydney and the others on the 12th
+    for request_timestamp in [1694440740, 1694440800, 1694444400]:
+        archive.stage_poll(make_poll(request_timestamp), staging)
+
+    assert archive.roll_up(staging, archive_folder, before=1694444400) == 6
+    assert [p.name for p in staging.iterdir()] == ['1694444400.parquet']
+    assert (archive_folder / 'date=2023-09-12' / 'route_id=r2').is_dir()
+
+    schema = pl.read_parquet(next(archive_folder.rglob('*.parquet'))).schema
+    assert schema['lat'] == pl.Float32
+    assert schema['trip_id'] == pl.String
+    metadata = pq.read_metadata(next(archive_folder.rglob('*.parquet')))
+    trip_id = metadata.schema.names.index('trip_id')
+    assert 'RLE_DICTIONARY' in metadata.row_group(0).column(trip_id).encodings
+
+
+def test_scan_archive(tmp_path):
+    "Filters on time and route only return matching positions"
+    staging, archive_folder = tmp_path / 'staging', tmp_path / 'archive'
+    assert archive.scan_archive(archive_folder).collect().is_empty()
+
+    for request_timestamp in [1694440740, 1694440800, 1694440860]:
+        archive.stage_poll(make_poll(request_timestamp), staging)
+    archive.roll_up(staging, archive_folder, before=1694444400)
+
+    positions = archive.scan_archive(
+        archive_folder, start=1694440800, end=1694440860, route_ids=['r1']
+    ).collect()
+    assert positions['request_timestamp'].to_list() == [1694440800] * 2
+    assert positions['route_id'].to_list() == ['r1', 'r1']
+
+    trips = pl.DataFrame({'trip_id': ['t1', 't3'], 'short_name': ['1', '2']})
+    locations = archive.scan_archive_locations(archive_folder, trips).collect()
+    assert sorted(locations['short_name'].unique()) == ['1', '2']
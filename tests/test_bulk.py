@@ -0,0 +1,60 @@
+"Test bulk inserts"
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine
+from sqlalchemy.dialects import mysql
+
+from data import bulk
+
+
+@pytest.mark.parametrize("method", ["auto", "executemany", "to_sql"])
+def test_bulk_insert(method):
+    "Rows and nulls are saved"
+    engine = create_engine("sqlite://")
+    with engine.begin() as con:
+        con.exec_driver_sql("CREATE TABLE example (id TEXT, lat REAL, n INTEGER)")
+    df = pd.DataFrame({
+        'id': ['a', 'b', 'c'],
+        'lat': [-33.1, np.nan, -33.2],
+        'n': [1, 2, 3],
+    })
+
+    assert bulk.bulk_insert(df, "example", engine, method) == 3
+    assert bulk.bulk_insert(df.iloc[:0], "example", engine, method) == 0
+    saved = pd.read_sql("SELECT * FROM example", engine)
+    pd.testing.assert_frame_equal(df, saved)
+
+
+@pytest.mark.parametrize("method", ["executemany", "to_sql"])
+def test_bulk_insert_ignore(method):
+    "Rows with an existing primary key are skipped"
+    engine = create_engine("sqlite://")
+    with engine.begin() as con:
+        con.exec_driver_sql(
+            "CREATE TABLE example (id TEXT, ts INTEGER, lat REAL, "
+            "PRIMARY KEY (id, ts))"
+        )
+    df = pd.DataFrame({'id': ['a', 'b'], 'ts': [1, 1], 'lat': [-33.1, -33.2]})
+    retry = pd.DataFrame({'id': ['b', 'a'], 'ts': [1, 2], 'lat': [-33.3, -33.4]})
+
+    assert bulk.bulk_insert(df, "example", engine, method, "ignore") == 2
+    assert bulk.bulk_insert(retry, "example", engine, method, "ignore") == 1
+    saved = pd.read_sql("SELECT * FROM example ORDER BY ts, id", engine)
+    assert saved['lat'].tolist() == [-33.1, -33.2, -33.4]
+
+    with pytest.raises(Exception):
+        bulk.bulk_insert(df, "example", engine, method)
+
+
+def test_insert_ignore_dialects():
+    "Both insert-ignore paths support MySQL and reject unknown databases"
+    table = Table('t', MetaData(), Column('id', Integer, primary_key=True))
+    stmt = bulk._insert_ignore_statement(table, 'mysql')
+    assert str(stmt.compile(dialect=mysql.dialect())).startswith('INSERT IGNORE')
+    assert 'INSERT IGNORE' in str(bulk._insert_sql('t', ['id'], 'mysql', 'ignore'))
+
+    with pytest.raises(ValueError):
+        bulk._insert_ignore_statement(table, 'oracle')
+    with pytest.raises(ValueError):
+        bulk._insert_sql('t', ['id'], 'oracle', 'ignore')
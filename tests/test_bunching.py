@@ -5,18 +5,23 @@ For this exercise, both Polars and Pandas are expected to give the same
 results. This function is able to test all variations and differnt 
 datasets.
 """
+import numpy as np
 import pandas as pd
 import polars as pl
 from polars import testing # pylint:disable=W0611
 import pytest
 
 from analysis import bunching
+from benchmarks.synthetic import synthetic_feed
 
 
 TEST_LIBRARIES = [
     (pd, "DataFrame", bunching.is_bunched),
     (pl, "DataFrame", bunching.is_bunched_pl),
     (pl, "LazyFrame", bunching.is_bunched_pl),
+    (pd, "DataFrame", bunching.is_bunched_grid),
+    (pl, "DataFrame", bunching.is_bunched_grid_pl),
+    (pl, "LazyFrame", bunching.is_bunched_grid_pl),
 ]
 
 DATASETS = {
@@ -39,6 +44,16 @@ DATASETS = {
             'lon': [105, 105],
         },
         'bunched': {'bunched': [False, False]}
+    },
+    "neighbouring_cells": {
+        'input_data': {
+            'request_timestamp': [1, 1, 1, 1],
+            'short_name': ['a', 'a', 'a', 'b'],
+            'direction_id': [0, 0, 0, 0],
+            'lat': [-33.1001, -33.0989, -33.1041, -33.1001],
+            'lon': [105.0001, 104.9989, 105, 105.0001],
+        },
+        'bunched': {'bunched': [True, True, False, False]}
     }
 }
 
@@ -58,3 +73,50 @@ def test_bunches_are_found(lib, frame_type, bunching_func, dataset_name):
         expected_df = expected_df.collect()
 
     lib.testing.assert_frame_equal(expected_df, actual_df)
+
+
+def test_bunches_along_route():
+    "Buses that pass close together on a loop are not bunched"
+    df = pd.DataFrame({
+        'request_timestamp': [1, 1, 1, 1, 2],
+        'short_name': ['a', 'a', 'a', 'a', 'a'],
+        'direction_id': [0, 0, 0, 0, 0],
+        'lat': [-33.1, -33.1, -33.2, -33.2005, -33.2],
+        'lon': [105, 105, 105, 105, 105],
+        'dist_traveled': [100, 9000, 4000, 4150, 4100],
+    })
+    actual_df = bunching.is_bunched_along_route(df)
+
+    expected_df = df.assign(bunched=[False, False, True, True, False])
+    pd.testing.assert_frame_equal(expected_df, actual_df)
+
+
+@pytest.mark.parametrize("partition_by", ["short_name", "request_timestamp"])
+def test_parallel_matches_serial(partition_by):
+    "Splitting the bunching across processes gives the serial result"
+    rng = np.random.default_rng(0)
+    n = 500
+    df = pd.DataFrame({
+        'request_timestamp': rng.integers(0, 5, n),
+        'short_name': rng.choice(['a', 'b', 'c', 'd'], n),
+        'direction_id': rng.integers(0, 2, n),
+        'lat': -33.8 + rng.random(n) * 0.02,
+        'lon': 151 + rng.random(n) * 0.02,
+    }, index=rng.permutation(n))
+
+    expected_df = bunching.is_bunched_grid(df)
+    actual_df = bunching.is_bunched_parallel(df, workers=2, partition_by=partition_by)
+    pd.testing.assert_frame_equal(expected_df, actual_df)
+
+
+def test_implementations_agree_on_synthetic_feed():
+    "All lat / lon implementations find the same bunches on a larger feed"
+    df = synthetic_feed(routes=5, buses_per_route=30, polls=3)
+    expected = bunching.is_bunched(df)['bunched'].to_numpy()
+
+    assert expected.any()
+    assert (bunching.is_bunched_grid(df)['bunched'].to_numpy() == expected).all()
+    for frame in [pl.from_pandas(df), pl.from_pandas(df).lazy()]:
+        for bunching_func in [bunching.is_bunched_pl, bunching.is_bunched_grid_pl]:
+            actual = bunching_func(frame)['bunched'].to_numpy()
+            assert (actual == expected).all()
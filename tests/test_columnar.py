@@ -0,0 +1,52 @@
+"Test reading query results into polars"
+import polars as pl
+import pytest
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table
+from sqlalchemy import create_engine, insert, select
+
+from data import columnar
+
+metadata = MetaData()
+readings = Table(
+    'readings', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String),
+    Column('value', Float, nullable=True),
+)
+
+
+@pytest.fixture(params=['connectorx', 'cursor'])
+def engine(request, tmp_path, monkeypatch):
+    "SQLite database read by connectorx, when installed, and by the cursor"
+    if request.param == 'cursor':
+        monkeypatch.setattr(columnar, 'connectorx', None)
+    elif columnar.connectorx is None:
+        pytest.skip('connectorx is not installed')
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.db'}")
+    metadata.create_all(engine)
+    with engine.begin() as con:
+        con.execute(insert(readings), [
+            {'id': 1, 'name': 'a', 'value': 1.5},
+            {'id': 2, 'name': 'b', 'value': None},
+            {'id': 3, 'name': 'c', 'value': None},
+        ])
+    return engine
+
+
+def test_read_polars(engine):
+    "The whole result is read with the dtypes of the columns"
+    stmt = select(readings.c.name, readings.c.value).where(readings.c.id > 1)
+    df = columnar.read_polars(stmt, engine)
+    assert df.schema == {'name': pl.String, 'value': pl.Float64}
+    assert df['name'].to_list() == ['b', 'c']
+
+    lazy = columnar.read_polars(stmt, engine, lazy=True)
+    assert isinstance(lazy, pl.LazyFrame)
+
+
+def test_iter_polars(engine):
+    "Batches have the same schema even when a batch is all null"
+    batches = list(columnar.iter_polars(select(readings), engine, batch_size=2))
+    assert [len(b) for b in batches] == [2, 1]
+    assert batches[1].schema == batches[0].schema
+    assert pl.concat(batches)['id'].to_list() == [1, 2, 3]
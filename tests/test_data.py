@@ -1,5 +1,7 @@
 "Test simple data processing"
+import numpy as np
 import pandas as pd
+import polars as pl
 
 from data import shapes
 
@@ -30,4 +32,47 @@ def test_add_end_lat_lon():
         'end_lon': [7, 6, None, 10.2, 8, None]
     }).reset_index(drop=True)
     df = shapes.add_end_lat_lon(df_in).reset_index(drop=True)
-    assert(df.equals(df_out))
\ No newline at end of file
+    assert(df.equals(df_out))
+
+
+def test_add_dist_traveled():
+    "Project locations onto their shape"
+    shapes_df = pd.DataFrame({
+        'shape_id': ['a', 'a', 'a', 'b', 'b'],
+        'shape_pt_sequence': [1, 2, 3, 1, 2],
+        'lat': [0, 0, 1, 0, 1],
+        'lon': [0, 1, 1, 0, 0],
+        'shape_dist_traveled': [0, 100, 200, 0, 100],
+    })
+    locations_df = pd.DataFrame({
+        'shape_id': ['a', 'a', 'b', 'c'],
+        'lat': [0.1, 0.5, 0.25, 0],
+        'lon': [0.5, 1.1, 0, 0],
+    })
+    df = shapes.add_dist_traveled(locations_df, shapes_df)
+    assert(df['dist_traveled'].iloc[:3].round(6).tolist() == [50, 150, 25])
+    assert(df['dist_traveled'].isna().tolist() == [False, False, False, True])
+
+
+def test_add_segments():
+    "Segment lengths and bearings, with distance restarting on each shape"
+    df_in = pd.DataFrame({
+        'shape_id': ['b', 'a', 'a', 'a', 'b'],
+        'shape_pt_sequence': [2, 3, 1, 2, 1],
+        'lat': [0, 1, 0, 0, 0],
+        'lon': [1, 1, 0, 1, 0],
+    })
+    df = shapes.add_segments(df_in).reset_index(drop=True)
+
+    degree = shapes.EARTH_RADIUS * np.pi / 180
+    assert df['shape_id'].tolist() == ['a', 'a', 'a', 'b', 'b']
+    np.testing.assert_allclose(
+        df['segment_length'], [degree, degree, np.nan, degree, np.nan]
+    )
+    np.testing.assert_allclose(
+        df['cumulative_length'], [0, degree, 2 * degree, 0, degree]
+    )
+    np.testing.assert_allclose(df['bearing'], [90, 0, np.nan, 90, np.nan])
+
+    df_pl = shapes.add_segments_polars(pl.from_pandas(df_in)).to_pandas()
+    pd.testing.assert_frame_equal(df_pl, df, check_dtype=False)
@@ -0,0 +1,107 @@
+"Test streaming bunching over the locations history on SQLite"
+import pandas as pd
+import pytest
+
+from data.bulk import bulk_insert
+
+TIMESTAMPS = [60, 120, 180, 240, 300]
+
+
+def make_locations(timestamps) -> pd.DataFrame:
+    "Two buses on the same trip, close together in every poll"
+    rows = len(timestamps)
+    return pd.DataFrame({
+        'id': ['a'] * rows + ['b'] * rows,
+        'request_timestamp': list(timestamps) * 2,
+        'trip_id': 't1',
+        'route_id': 'r1',
+        'schedule_relationship': 0,
+        'lat': [-33.8] * rows + [-33.8005] * rows,
+        'lon': 151.2,
+        'bearing': 0.0,
+        'speed': 0.0,
+        'timestamp': 0,
+        'congestion_level': 0,
+        'stop_id': '',
+        'vehicle_id': '',
+        'label': '',
+    })
+
+
+@pytest.fixture
+def history(engine):
+    "One route with a trip and five polls of locations"
+    bulk_insert(pd.DataFrame({
+        'id': ['r1'],
+        'agency_id': 'a',
+        'short_name': ['1'],
+        'long_name': '',
+        'description': '',
+        'type': 3,
+        'color': '',
+        'text_color': '',
+    }), 'routes', engine)
+    bulk_insert(pd.DataFrame({
+        'id': ['t1'],
+        'route_id': ['r1'],
+        'service_id': '1',
+        'shape_id': 's',
+        'trip_headsign': None,
+        'direction_id': [0],
+        'wheelchair_accessible': 1,
+        'route_direction': '',
+    }), 'trips', engine)
+    bulk_insert(make_locations(TIMESTAMPS), 'locations', engine)
+    return engine
+
+
+def test_iter_location_windows(history):
+    "Windows hold whole polls, never more than window_polls of them"
+    from data.locations import iter_location_windows
+
+    windows = list(iter_location_windows(window_polls=2))
+    assert [start for start, _ in windows] == [60, 180, 300]
+    assert [sorted(df['request_timestamp'].unique()) for _, df in windows] == [
+        [60, 120], [180, 240], [300]
+    ]
+    assert all(len(df) == 2 * df['request_timestamp'].nunique() for _, df in windows)
+
+    after = list(iter_location_windows(window_polls=2, after=120))
+    assert [start for start, _ in after] == [180, 300]
+
+
+def test_run_bunching_resumes(history, monkeypatch):
+    "Each run only processes the polls after the last saved event"
+    import data_pipeline
+
+    seen_after = []
+    iter_location_windows = data_pipeline.iter_location_windows
+
+    def record_after(window_polls, after):
+        seen_after.append(after)
+        return iter_location_windows(window_polls, after)
+
+    monkeypatch.setattr(data_pipeline, 'iter_location_windows', record_after)
+
+    data_pipeline.run_bunching(window_polls=2)
+    events = pd.read_sql_table('bunching_events', history)
+    assert len(events) == 2 * len(TIMESTAMPS)
+    assert data_pipeline.last_processed_timestamp() == 300
+
+    bulk_insert(make_locations([360, 420]), 'locations', history)
+    data_pipeline.run_bunching(window_polls=2)
+    events = pd.read_sql_table('bunching_events', history)
+    assert seen_after == [None, 300]
+    assert sorted(events['request_timestamp'].unique()) == TIMESTAMPS + [360, 420]
+    assert not events.duplicated(['id', 'request_timestamp']).any()
+
+
+def test_run_bunching_parquet(history, tmp_path):
+    "Parquet output reprocesses the whole history, a file per window"
+    import data_pipeline
+
+    data_pipeline.run_bunching(window_polls=2, parquet_folder=tmp_path / 'events')
+    files = sorted(p.name for p in (tmp_path / 'events').iterdir())
+    assert files == ['180.parquet', '300.parquet', '60.parquet']
+    events = pd.read_parquet(tmp_path / 'events')
+    assert len(events) == 2 * len(TIMESTAMPS)
@@ -0,0 +1,59 @@
+"Test binning positions into grid cells"
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis import density
+from visualisations import maps
+
+
+@pytest.fixture
+def positions():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "lat": -33.88 + rng.uniform(-0.05, 0.05, 5000),
+        "lon": 151.2 + rng.uniform(-0.05, 0.05, 5000),
+        "bunched": rng.random(5000) < 0.25,
+    })
+
+
+@pytest.mark.parametrize("grid", ["hex", "square"])
+def test_bin_positions(positions, grid):
+    "Every position is counted once, in the cell whose centre is nearest"
+    cells = density.bin_positions(positions, 500, grid)
+
+    assert cells["count"].sum() == len(positions)
+    assert cells["bunching_rate"].between(0, 1).all()
+    rate = (cells["bunching_rate"] * cells["count"]).sum() / len(positions)
+    assert rate == pytest.approx(positions["bunched"].mean())
+
+    # No position is further from its cell centre than a cell corner
+    scale = np.cos(np.radians(density.REFERENCE_LAT))
+    dx = (positions["lon"].to_numpy()[:, None] - cells["lon"].to_numpy()) * scale
+    dy = positions["lat"].to_numpy()[:, None] - cells["lat"].to_numpy()
+    nearest = np.hypot(dx, dy).min(axis=1) * density.METRES_PER_DEGREE
+    corner = 500 if grid == "hex" else 500 * np.sqrt(2) / 2
+    assert nearest.max() <= corner + 1e-6
+
+
+def test_bin_positions_bbox(positions):
+    "Only positions in the viewport are binned"
+    bbox = (151.2, -33.88, 151.25, -33.83)
+    cells = density.bin_positions(positions.drop(columns="bunched"), 500, bbox=bbox)
+    inside = positions["lon"].between(151.2, 151.25) & positions["lat"].between(
+        -33.88, -33.83
+    )
+    assert cells["count"].sum() == inside.sum()
+    assert "bunching_rate" not in cells
+
+    with pytest.raises(ValueError):
+        density.bin_positions(positions, 500, "triangle")
+
+
+def test_density_map(positions):
+    "Closer zooms use smaller cells, drawn as one density layer"
+    assert density.cell_size_for_zoom(14) < density.cell_size_for_zoom(10)
+    fig = maps.density_map(positions, zoom=12, z="bunching_rate")
+    assert len(fig.data) == 1
+    assert fig.data[0].type == "densitymapbox"
+    assert len(fig.data[0].z) < len(positions)
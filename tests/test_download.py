@@ -0,0 +1,134 @@
+"Test conditional and resumable downloads against a local server"
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+
+import pytest
+
+from data import download
+
+
+CONTENT = bytes(range(256)) * 1000
+ETAG = '"v1"'
+
+
+class Handler(BaseHTTPRequestHandler):
+    "Serves CONTENT with ETag and Range support and counts requests"
+    requests = []
+    # Added to the full size in Content-Range, to serve an inconsistent resume
+    extra_total = 0
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        Handler.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        if (byte_range := self.headers.get("Range")) and \
+                self.headers.get("If-Range") == ETAG:
+            start = int(byte_range.split("=")[1].rstrip("-"))
+            if start >= len(CONTENT):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(CONTENT)}")
+                self.end_headers()
+                return
+            total = len(CONTENT) + Handler.extra_total
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(CONTENT) - 1}/{total}"
+            )
+        else:
+            self.send_response(200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(CONTENT) - start))
+        self.end_headers()
+        self.wfile.write(CONTENT[start:])
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@pytest.fixture(name="url")
+def fixture_url():
+    "Run the server for one test"
+    Handler.requests = []
+    Handler.extra_total = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/gtfs.zip"
+    server.shutdown()
+
+
+def test_download_skips_unchanged(url, tmp_path):
+    "A second download is skipped when the ETag matches"
+    path = tmp_path / "gtfs.zip"
+    assert download.download_file(url, path, timeout=5)
+    assert path.read_bytes() == CONTENT
+    download.mark_loaded(path)
+    assert not download.download_file(url, path, timeout=5)
+    assert Handler.requests[-1]["If-None-Match"] == ETAG
+
+
+def test_download_until_loaded(url, tmp_path):
+    "An unchanged file is offered again until it is marked as loaded"
+    path = tmp_path / "gtfs.zip"
+    assert download.download_file(url, path, timeout=5)
+    # e.g. loading the schedule failed
+    assert download.download_file(url, path, timeout=5)
+    assert Handler.requests[-1]["If-None-Match"] == ETAG
+    assert len(Handler.requests) == 2
+    assert path.read_bytes() == CONTENT
+
+    download.mark_loaded(path)
+    assert not download.download_file(url, path, timeout=5)
+
+
+def test_download_resumes(url, tmp_path):
+    "A partial download is continued with a Range request"
+    path = tmp_path / "gtfs.zip"
+    (tmp_path / "gtfs.zip.part").write_bytes(CONTENT[:1000])
+    (tmp_path / "gtfs.zip.part.json").write_text(json.dumps({"etag": ETAG}))
+
+    assert download.download_file(url, path, timeout=5)
+    assert Handler.requests[-1]["Range"] == "bytes=1000-"
+    assert path.read_bytes() == CONTENT
+    assert not (tmp_path / "gtfs.zip.part").exists()
+
+
+def test_download_keeps_file_when_invalid(url, tmp_path):
+    "A download that fails validation does not replace the existing file"
+    path = tmp_path / "gtfs.zip"
+    path.write_bytes(b"old")
+
+    with pytest.raises(ValueError):
+        download.download_file(url, path, validate=lambda p: False, timeout=5)
+    assert path.read_bytes() == b"old"
+
+
+def test_download_restarts_unsatisfiable_range(url, tmp_path):
+    "A partial download the server cannot resume is discarded"
+    path = tmp_path / "gtfs.zip"
+    (tmp_path / "gtfs.zip.part").write_bytes(CONTENT + b"extra")
+    (tmp_path / "gtfs.zip.part.json").write_text(json.dumps({"etag": ETAG}))
+
+    assert download.download_file(url, path, timeout=5)
+    assert [r.get("Range") for r in Handler.requests] == [
+        f"bytes={len(CONTENT) + 5}-", None
+    ]
+    assert path.read_bytes() == CONTENT
+
+
+def test_download_restarts_wrong_size(url, tmp_path):
+    "A resumed download of the wrong size is downloaded again in full"
+    path = tmp_path / "gtfs.zip"
+    (tmp_path / "gtfs.zip.part").write_bytes(CONTENT[:1000])
+    (tmp_path / "gtfs.zip.part.json").write_text(json.dumps({"etag": ETAG}))
+    Handler.extra_total = 5
+
+    assert download.download_file(url, path, timeout=5)
+    assert [r.get("Range") for r in Handler.requests] == ["bytes=1000-", None]
+    assert path.read_bytes() == CONTENT
+    assert not (tmp_path / "gtfs.zip.part").exists()
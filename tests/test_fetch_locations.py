@@ -0,0 +1,59 @@
+"Test the asyncio fetch loop with the network and database stubbed out"
+import asyncio
+from datetime import datetime
+import time
+
+import pandas as pd
+import pytest
+
+WRITE_SECONDS = 0.3
+POLL_SECONDS = 0.1
+
+
+@pytest.fixture
+def fetch_locations(data_env):
+    import fetch_locations
+    return fetch_locations
+
+
+def test_next_start_time(fetch_locations):
+    "The start time rolls over the end of a month and a year"
+    start = fetch_locations.next_start_time(datetime(2023, 12, 31, 22, 15, 30))
+    assert start == datetime(
+        2024, 1, 1, fetch_locations.START_HOUR, fetch_locations.START_MINUTE
+    )
+
+
+def test_slow_writes_do_not_delay_fetches(fetch_locations, monkeypatch):
+    "Each poll starts on time even when every save takes several polls"
+    downloads, saved = [], []
+
+    def download_positions():
+        downloads.append(time.time())
+        return len(downloads)
+
+    def upload_realtime(df):
+        time.sleep(WRITE_SECONDS)
+        saved.append(df["poll"].iloc[0])
+
+    monkeypatch.setattr(
+        fetch_locations.realtime, "download_positions", download_positions
+    )
+    monkeypatch.setattr(
+        fetch_locations.positions,
+        "decode_positions_dataframe",
+        lambda content: pd.DataFrame({"poll": [content]}),
+    )
+    monkeypatch.setattr(fetch_locations.realtime, "upload_realtime", upload_realtime)
+    monkeypatch.setattr(fetch_locations.realtime, "archive_realtime", lambda df: None)
+
+    start = time.time() + 0.05
+    fetch_times = [start + i * POLL_SECONDS for i in range(4)]
+    asyncio.run(fetch_locations.run_fetch_loop(iter(fetch_times), POLL_SECONDS))
+
+    assert len(downloads) == 4
+    lateness = [d - t for d, t in zip(downloads, fetch_times)]
+    assert max(lateness) < POLL_SECONDS / 2
+    # Saves ran one after another and finished long after the last fetch
+    assert saved == [1, 2, 3, 4]
+    assert time.time() - start >= 4 * WRITE_SECONDS
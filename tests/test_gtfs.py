@@ -0,0 +1,37 @@
+"Test reading GTFS schedule files"
+import io
+
+import pandas as pd
+
+from data import gtfs
+from data.model import Stop, _gtfs_table_registry_
+
+
+STOPS_CSV = """stop_id,stop_code,stop_name,stop_lat,stop_lon,location_type,wheelchair_boarding
+200039,200039,Central Station,-33.882,151.206,,1
+200054,,Circular Quay,-33.861,151.211,1,
+2000421,2000421,Town Hall,-33.873,151.207,,0
+"""
+
+
+def test_read_gtfs_chunks():
+    "Only registered fields are read, renamed and typed from the model"
+    chunks = list(gtfs.read_gtfs_chunks(Stop, io.BytesIO(STOPS_CSV.encode()), 2))
+
+    assert [len(c) for c in chunks] == [2, 1]
+    df = pd.concat(chunks, ignore_index=True)
+    assert list(df.columns) == ['id', 'name', 'lat', 'lon', 'wheelchair_boarding']
+    assert df['id'].tolist() == ['200039', '200054', '2000421']
+    assert str(df['wheelchair_boarding'].dtype) == 'Int64'
+    assert df['wheelchair_boarding'].isna().tolist() == [False, True, False]
+
+
+def test_dependency_levels():
+    "Tables are only loaded after the tables their foreign keys refer to"
+    levels = gtfs.dependency_levels(_gtfs_table_registry_)
+    names = [sorted(t.__tablename__ for t in level) for level in levels]
+    assert names == [
+        ['agencies', 'calendar', 'routes', 'shapes', 'stops'],
+        ['trips'],
+        ['stop_times'],
+    ]
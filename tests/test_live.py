@@ -0,0 +1,88 @@
+"Test the shared live window of locations and the dashboard updates"
+import importlib
+
+import pandas as pd
+import pytest
+
+from data.live import LiveWindow
+
+
+class FakeDatabase:
+    "Locations table that records the queries made to it"
+
+    def __init__(self):
+        self.rows = pd.DataFrame({"request_timestamp": [], "lat": []})
+        self.starts = []
+
+    def poll(self, timestamp: int, buses: int = 2):
+        new = pd.DataFrame({
+            "request_timestamp": [timestamp] * buses,
+            "lat": [-33.88] * buses,
+        })
+        self.rows = pd.concat([self.rows, new], ignore_index=True)
+
+    def query(self, start: int) -> pd.DataFrame:
+        self.starts.append(start)
+        return self.rows[self.rows["request_timestamp"] >= start]
+
+
+def test_live_window():
+    "Only new rows are read, old rows are dropped and reads are shared"
+    database = FakeDatabase()
+    now = [1000.0]
+    live = LiveWindow(
+        database.query, window_seconds=120, min_interval=10, clock=lambda: now[0]
+    )
+    database.poll(800)
+    database.poll(900)
+
+    assert live.refresh()["request_timestamp"].tolist() == [900, 900]
+    assert database.starts == [880]
+
+    # A second viewer within min_interval shares the first read
+    database.poll(960)
+    live.refresh()
+    assert database.starts == [880]
+    assert live.since(900).empty
+
+    now[0] = 1020
+    database.poll(1020)
+    locations = live.refresh()
+    assert database.starts == [880, 901]
+    assert locations["request_timestamp"].tolist() == [960, 960, 1020, 1020]
+    assert live.since(960)["request_timestamp"].tolist() == [1020, 1020]
+    assert live.latest == 1020
+
+
+@pytest.fixture
+def dashboard(data_env):
+    return importlib.import_module("dashboard")
+
+
+def test_dashboard_update(dashboard, monkeypatch):
+    "Each viewer gets a patch of the latest poll and the polls it missed"
+    locations = pd.DataFrame({
+        "request_timestamp": [60, 60, 120, 120],
+        "short_name": ["100", "200", "100", "200"],
+        "lat": [-33.88, -33.89, -33.881, -33.891],
+        "lon": [151.2, 151.21, 151.2, 151.21],
+        "bunched": [False, False, True, False],
+    })
+    live = LiveWindow(
+        lambda start: locations[locations["request_timestamp"] >= start],
+        clock=lambda: 130,
+    )
+    monkeypatch.setattr(dashboard, "live", live)
+
+    patch, (points, traces, max_points), latest = dashboard.update(1, None)
+    assert latest == 120
+    assert points["y"] == [[0, 1]]
+    assert traces == [0] and max_points == dashboard.MAX_POINTS
+    operations = patch.to_plotly_json()["operations"]
+    values = {tuple(op["location"]): op["params"]["value"] for op in operations}
+    assert values[("data", 0, "lat")] == [-33.881, -33.891]
+    assert values[("data", 1, "text")] == ["100"]
+
+    assert dashboard.update(2, latest) == (
+        dashboard.no_update, dashboard.no_update, dashboard.no_update
+    )
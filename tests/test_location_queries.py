@@ -0,0 +1,78 @@
+"Test location queries on SQLite"
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+from data.bulk import bulk_insert
+from data.location_queries import select_locations
+from data.model import Base
+
+
+@pytest.fixture
+def engine(tmp_path):
+    "Two routes with a trip in each direction and a location on each trip"
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.db'}")
+    Base.metadata.create_all(engine)
+    bulk_insert(pd.DataFrame({
+        'id': ['r1', 'r2'],
+        'agency_id': 'a',
+        'short_name': ['1', '2'],
+        'long_name': '',
+        'description': '',
+        'type': 3,
+        'color': '',
+        'text_color': '',
+    }), 'routes', engine)
+    bulk_insert(pd.DataFrame({
+        'id': ['t1', 't2', 't3', 't4'],
+        'route_id': ['r1', 'r1', 'r2', 'r2'],
+        'service_id': '1',
+        'shape_id': 's',
+        'trip_headsign': None,
+        'direction_id': [0, 1, 0, 1],
+        'wheelchair_accessible': 1,
+        'route_direction': '',
+    }), 'trips', engine)
+    bulk_insert(pd.DataFrame({
+        'id': ['a', 'b', 'c', 'd'],
+        'request_timestamp': [100, 100, 200, 300],
+        'trip_id': ['t1', 't2', 't3', 't4'],
+        'route_id': ['r1', 'r1', 'r2', 'r2'],
+        'schedule_relationship': 0,
+        'lat': [-33.8, -33.9, -34.0, -33.8],
+        'lon': [151.2, 151.2, 151.2, 150.0],
+        'bearing': 0.0,
+        'speed': 0.0,
+        'timestamp': 0,
+        'congestion_level': 0,
+        'stop_id': '',
+        'vehicle_id': '',
+        'label': '',
+    }), 'locations', engine)
+    return engine
+
+
+def test_filters(engine):
+    "Each filter keeps only the matching locations"
+    def ids(**filters):
+        stmt = select_locations(engine, columns=['id'], **filters)
+        return sorted(pd.read_sql(stmt, engine)['id'])
+
+    assert ids() == ['a', 'b', 'c', 'd']
+    assert ids(start=200) == ['c', 'd']
+    assert ids(start=100, end=300) == ['a', 'b', 'c']
+    assert ids(short_names=['2']) == ['c', 'd']
+    assert ids(direction_id=1) == ['b', 'd']
+    assert ids(bbox=(151, -33.95, 152, -33.7)) == ['a', 'b']
+    assert ids(short_names=['1'], direction_id=0) == ['a']
+
+
+def test_columns(engine):
+    "Only the requested columns are selected and tables joined"
+    stmt = select_locations(engine, columns=['lat', 'short_name'])
+    df = pd.read_sql(stmt, engine)
+    assert list(df.columns) == ['lat', 'short_name']
+    assert 'trips' not in str(stmt)
+
+    with pytest.raises(ValueError):
+        select_locations(engine, columns=['nope'])
@@ -34,3 +34,42 @@ def test_map():
     )
     fig = maps.routemap(df)
     assert isinstance(fig, Figure)
+
+
+def test_with_separators():
+    "Each group is followed by a null row"
+    df = pd.DataFrame({
+        "shape_id": ["b", "a", "b", "a", "c"],
+        "lat": [1.0, 2.0, 3.0, 4.0, 5.0],
+    })
+    lines = maps.with_separators(df, "shape_id", ["lat", "shape_id"])
+    assert lines["shape_id"].tolist() == [
+        "a", "a", None, "b", "b", None, "c", None
+    ]
+    assert lines["lat"].fillna(0).tolist() == [2, 4, 0, 1, 3, 0, 5, 0]
+
+
+def test_batched_maps():
+    "Shapes and positions are drawn as single traces"
+    shapes = pd.DataFrame({
+        "shape_id": ["s1", "s1", "s2", "s2"],
+        "shape_pt_sequence": [1, 2, 1, 2],
+        "lat": [-33.88, -33.89, -33.87, -33.86],
+        "lon": [151.2, 151.21, 151.2, 151.19],
+    })
+    fig = maps.routemap(shapes, zoom=14)
+    assert len(fig.data) == 1
+    assert list(fig.data[0].text) == ["s1", "s1", None, "s2", "s2", None]
+
+    unbatched = maps.routemap(shapes, batched=False)
+    assert len(unbatched.data) == 2
+
+    positions = pd.DataFrame({
+        "route_id": ["r1", "r2", "r1"],
+        "lat": [-33.88, -33.89, -33.87],
+        "lon": [151.2, 151.21, 151.2],
+    })
+    fig = maps.position_map(positions)
+    assert len(fig.data) == 1
+    colours = fig.data[0].marker.color
+    assert colours[0] == colours[2] != colours[1]
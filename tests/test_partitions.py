@@ -0,0 +1,82 @@
+"Test day partitions of locations on SQLite"
+from datetime import date, timedelta
+
+import pandas as pd
+from sqlalchemy import create_engine, inspect, select
+
+from data import partitions
+from data.model import Location, copy_table
+
+
+def make_locations(ids, timestamps) -> pd.DataFrame:
+    "Locations with only the details needed for partitioning"
+    return pd.DataFrame({
+        'id': ids,
+        'request_timestamp': timestamps,
+        'trip_id': 't1',
+        'route_id': 'r1',
+        'schedule_relationship': 0,
+        'lat': -33.8,
+        'lon': 151.2,
+        'bearing': 0.0,
+        'speed': 0.0,
+        'timestamp': timestamps,
+        'congestion_level': 0,
+        'stop_id': '',
+        'vehicle_id': ids,
+        'label': '',
+    })
+
+
+def test_service_days():
+    "Days start at midnight in Sydney"
+    days = partitions.service_days(pd.Series([1694440799, 1694440800]))
+    assert days.tolist() == [date(2023, 9, 11), date(2023, 9, 12)]
+    assert partitions.day_bounds(date(2023, 9, 12))[0] == 1694440800
+
+
+def test_partitions(tmp_path):
+    "Locations are written to day tables that can be read and dropped"
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.db'}")
+    partitions.create_partitioned_view(engine)
+    assert partitions.is_partitioned(engine)
+
+    df = make_locations(['a', 'b', 'a'], [1694440799, 1694440799, 1694440800])
+    assert partitions.write_locations(df, engine) == 3
+    assert partitions.write_locations(df, engine) == 0
+    assert partitions.list_partitions(engine) == [date(2023, 9, 11), date(2023, 9, 12)]
+    assert len(pd.read_sql("SELECT * FROM locations", engine)) == 3
+    indexes = inspect(engine).get_indexes('locations_20230911')
+    assert {i['name'] for i in indexes} == {
+        'ix_locations_20230911_request_timestamp_route_id',
+        'ix_locations_20230911_trip_id',
+    }
+
+    source = partitions.locations_source(engine, start=1694440800)
+    day = pd.read_sql(select(source.c.id, source.c.request_timestamp), engine)
+    assert day['request_timestamp'].tolist() == [1694440800]
+
+    partitions.drop_partitions_before(engine, date(2023, 9, 12))
+    assert partitions.list_partitions(engine) == [date(2023, 9, 12)]
+    assert len(pd.read_sql("SELECT * FROM locations", engine)) == 1
+
+
+def test_many_partitions(tmp_path):
+    "Views and unions over more day tables than SQLite allows in one SELECT"
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.db'}")
+    days = [
+        date(2023, 1, 1) + timedelta(days=i)
+        for i in range(partitions.MAX_COMPOUND_SELECT + 10)
+    ]
+    with engine.begin() as con:
+        for day in days:
+            copy_table(Location, partitions.partition_name(day)).create(con)
+    partitions.create_partitioned_view(engine)
+
+    timestamps = [partitions.day_bounds(day)[0] for day in (days[0], days[-1])]
+    partitions.write_locations(make_locations(['a', 'b'], timestamps), engine)
+    assert len(pd.read_sql("SELECT * FROM locations", engine)) == 2
+
+    source = partitions.locations_source(engine)
+    df = pd.read_sql(select(source.c.request_timestamp), engine)
+    assert sorted(df['request_timestamp']) == timestamps
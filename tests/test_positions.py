@@ -0,0 +1,64 @@
+"Test decoding of realtime vehicle positions"
+from google.transit import gtfs_realtime_pb2
+import numpy as np
+import pandas as pd
+
+from data import positions
+
+
+def make_feed() -> bytes:
+    "Two vehicles, the second without a position"
+    feed = gtfs_realtime_pb2.FeedMessage() #pylint: disable=E1101
+    feed.header.gtfs_realtime_version = "2.0"
+    feed.header.timestamp = 1694428320
+
+    entity = feed.entity.add(id="33553_26249868_2436_600_1")
+    entity.vehicle.trip.trip_id = "1954191"
+    entity.vehicle.trip.route_id = "2436_600"
+    entity.vehicle.trip.schedule_relationship = 0
+    entity.vehicle.position.latitude = -33.71885299682617
+    entity.vehicle.position.longitude = 151.10745239257812
+    entity.vehicle.position.bearing = 44.0
+    entity.vehicle.timestamp = 1694428312
+    entity.vehicle.congestion_level = 1
+    entity.vehicle.vehicle.id = "33553_26249868_2436_600_1"
+
+    entity = feed.entity.add(id="2")
+    entity.vehicle.trip.trip_id = "1954192"
+    entity.vehicle.timestamp = 1694428313
+    entity.vehicle.vehicle.id = "2"
+    entity.vehicle.vehicle.label = "label"
+    return feed.SerializeToString()
+
+
+def test_decode_positions_dataframe():
+    "Missing position fields are NaN and missing enums take their default"
+    df = positions.decode_positions_dataframe(make_feed())
+    expected_df = pd.DataFrame({
+        "id": ["33553_26249868_2436_600_1", "2"],
+        "trip_id": ["1954191", "1954192"],
+        "route_id": ["2436_600", ""],
+        "schedule_relationship": [0, 0],
+        "lat": [-33.71885299682617, np.nan],
+        "lon": [151.10745239257812, np.nan],
+        "bearing": [44.0, np.nan],
+        "speed": [np.nan, np.nan],
+        "timestamp": [1694428312, 1694428313],
+        "congestion_level": [1, 0],
+        "stop_id": ["", ""],
+        "vehicle_id": ["33553_26249868_2436_600_1", "2"],
+        "label": ["", "label"],
+        "request_timestamp": [1694428320, 1694428320],
+    })
+    pd.testing.assert_frame_equal(expected_df, df)
+
+
+def test_matches_flattened_positions(data_env):
+    "Decoding into columns gives the same dataframe as flattening entities"
+    from data import realtime
+
+    content = make_feed()
+    pd.testing.assert_frame_equal(
+        positions.decode_positions_dataframe(content),
+        realtime.get_positions_dataframe(realtime.decode_positions(content)),
+    )
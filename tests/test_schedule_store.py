@@ -0,0 +1,87 @@
+"Test the columnar schedule store"
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data.schedule_store import ScheduleStore, time_to_seconds
+
+FILES = {
+    "routes": """route_id,agency_id,route_short_name,route_long_name,route_desc,route_type,route_color,route_text_color
+R2,A,200,Two hundred,,700,00B5EF,FFFFFF
+R1,A,100,One hundred,,700,00B5EF,FFFFFF
+""",
+    "trips": """route_id,service_id,trip_id,shape_id,trip_headsign,direction_id,wheelchair_accessible,route_direction
+R1,1,T2,S1,City,0,1,x
+R2,1,T1,S2,Beach,1,1,y
+""",
+    "stops": """stop_id,stop_name,stop_lat,stop_lon,wheelchair_boarding
+B,Stop B,-33.2,151.2,1
+A,Stop A,-33.1,151.1,1
+""",
+    "stop_times": """trip_id,arrival_time,departure_time,stop_id,stop_sequence,stop_headsign,pickup_type,drop_off_type,shape_dist_traveled,timepoint,stop_note
+T1,25:00:00,25:01:00,B,2,,0,0,1.5,1,
+T2,08:00:00,08:00:00,A,1,,0,0,0,1,
+T1,24:50:00,24:50:00,A,1,,0,0,0,1,
+T2,08:10:00,08:10:00,B,2,,0,0,2.0,1,
+""",
+    "shapes": """shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence,shape_dist_traveled
+S2,-33.2,151.2,2,1.5
+S1,-33.1,151.1,1,0
+S2,-33.1,151.1,1,0
+S1,-33.2,151.2,2,2.0
+""",
+}
+
+
+@pytest.fixture
+def gtfs_zip(tmp_path):
+    path = tmp_path / "gtfs.zip"
+    with zipfile.ZipFile(path, "w") as z:
+        for name, content in FILES.items():
+            z.writestr(f"{name}.txt", content)
+    return path
+
+
+def test_time_to_seconds():
+    "Times after midnight are kept and missing times are -1"
+    times = pd.Series(["08:00:00", "25:01:30", None])
+    assert time_to_seconds(times).tolist() == [28800, 90090, -1]
+
+
+def test_from_gtfs_zip(gtfs_zip):
+    "Ids are interned and each trip's stop times are a contiguous range"
+    store = ScheduleStore.from_gtfs_zip(gtfs_zip)
+
+    assert store.ids["trip"].tolist() == ["T1", "T2"]
+    assert store.offsets["stop_times"].tolist() == [0, 2, 4]
+    stop_times = store.trip_stop_times("T1")
+    assert stop_times["stop_sequence"].tolist() == [1, 2]
+    assert store.ids["stop"][stop_times["stop_id"]].tolist() == ["A", "B"]
+    assert stop_times["arrival_time"].tolist() == [89400, 90000]
+
+    points = store.shape_points("S2")
+    assert points["sequence"].tolist() == [1, 2]
+    assert points["dist_traveled"].tolist() == [0, 1.5]
+
+    trips = store.to_frame("trips")
+    assert trips.set_index("id")["route_id"].to_dict() == {"T1": "R2", "T2": "R1"}
+
+    with pytest.raises(KeyError):
+        store.trip_stop_times("T3")
+
+
+def test_save_load(gtfs_zip, tmp_path):
+    "A saved store loads memory mapped with the same arrays"
+    store = ScheduleStore.from_gtfs_zip(gtfs_zip)
+    store.save(tmp_path / "store")
+    loaded = ScheduleStore.load(tmp_path / "store")
+
+    assert isinstance(loaded.offsets["shapes"], np.memmap)
+    assert loaded.ids.keys() == store.ids.keys()
+    for table, columns in store.tables.items():
+        for column, values in columns.items():
+            np.testing.assert_array_equal(loaded.tables[table][column], values)
+    pd.testing.assert_frame_equal(loaded.to_frame("stops"), store.to_frame("stops"))
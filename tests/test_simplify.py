@@ -0,0 +1,83 @@
+"Test shape simplification"
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from data import simplify
+
+# About 1m of longitude in degrees at Sydney
+METRE = 1 / (simplify.METRES_PER_DEGREE * np.cos(np.radians(-33.88)))
+
+
+def make_shapes() -> pd.DataFrame:
+    "A straight shape with a 1m and a 50m bump, and a closed loop"
+    return pd.DataFrame({
+        "shape_id": ["line"] * 5 + ["loop"] * 4,
+        "shape_pt_sequence": [5, 4, 3, 2, 1, 1, 2, 3, 4],
+        "lat": [-33.88] * 5 + [-33.88, -33.87, -33.87, -33.88],
+        "lon": np.array([400, 300, 200, 100, 0] + [0, 0, 1000, 0]) * METRE + 151,
+    })
+
+
+def test_simplification_levels():
+    "Points are kept at the levels whose tolerance they exceed"
+    shapes = make_shapes()
+    shapes.loc[1, "lat"] += 50 / simplify.METRES_PER_DEGREE
+    shapes.loc[3, "lat"] += 1 / simplify.METRES_PER_DEGREE
+
+    levels = simplify.simplification_levels(shapes)
+
+    line = levels[levels["shape_id"] == "line"]
+    assert line["shape_pt_sequence"].tolist() == [1, 2, 3, 4, 5]
+    # Ends are always kept and the 50m bump up to 40m. The point on the
+    # line is 33m from the line to the bump, and the 1m bump is only kept
+    # at full detail
+    top = len(simplify.TOLERANCES) - 1
+    assert line["level"].tolist() == [top, 0, 2, 3, top]
+    loop = levels[levels["shape_id"] == "loop"]
+    assert (loop["level"] > 0).all()
+
+    assert len(simplify.select_level(levels, 0)) == len(shapes)
+    assert simplify.select_level(levels, 2)["shape_pt_sequence"].tolist() == [
+        1, 3, 4, 5, 1, 2, 3, 4
+    ]
+
+
+def test_cached_levels(tmp_path):
+    "Levels are only computed for a new feed version"
+    calls = []
+
+    def get_shapes():
+        calls.append(1)
+        return make_shapes()
+
+    first = simplify.cached_levels(get_shapes, tmp_path, "v1")
+    again = simplify.cached_levels(get_shapes, tmp_path, "v1")
+    pd.testing.assert_frame_equal(again, first.reset_index(drop=True))
+    assert len(calls) == 1
+
+    simplify.cached_levels(get_shapes, tmp_path, "v2")
+    assert len(calls) == 2
+    assert [p.name for p in tmp_path.iterdir()] == ["shapes_v2.parquet"]
+
+
+def test_level_for_zoom():
+    "Closer zooms draw finer levels"
+    levels = [simplify.level_for_zoom(zoom) for zoom in range(6, 20)]
+    assert levels == sorted(levels, reverse=True)
+    assert levels[0] == len(simplify.TOLERANCES) - 1
+    assert levels[-1] == 0
+
+
+def test_feed_version(tmp_path):
+    "The feed version comes from feed_info.txt, or a hash of the file"
+    path = tmp_path / "gtfs.zip"
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("stops.txt", "stop_id\n1\n")
+    hashed = simplify.feed_version(path)
+    assert len(hashed) == 16
+
+    with zipfile.ZipFile(path, "a") as z:
+        z.writestr("feed_info.txt", "feed_publisher_name,feed_version\nTfNSW,20261018\n")
+    assert simplify.feed_version(path) == "20261018"
@@ -0,0 +1,240 @@
+"Test loading and refreshing GTFS tables on SQLite"
+import io
+import zipfile
+
+import pandas as pd
+import pytest
+from sqlalchemy import event, inspect, select
+
+from data import gtfs
+from data.model import Calendar, StopTime, _gtfs_table_registry_
+
+CALENDAR_CSV = """service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date
+1,1,1,1,1,1,0,0,20230901,20231231
+2,0,0,0,0,0,1,1,20230901,20231231
+"""
+
+
+@pytest.fixture
+def update_gtfs(engine):
+    import update_gtfs
+    return update_gtfs
+
+
+def read_calendar(csv: str) -> pd.DataFrame:
+    return gtfs.read_gtfs(Calendar, io.BytesIO(csv.encode()))
+
+
+def load_calendar(engine, update_gtfs, csv: str):
+    update_gtfs.refresh_table(Calendar, read_calendar(csv))
+    return pd.read_sql(select(Calendar.__table__), engine)
+
+
+def test_delete_integer_keys(engine, update_gtfs):
+    "Keys read as nullable Int64 still match their rows"
+    load_calendar(engine, update_gtfs, CALENDAR_CSV)
+    keys = read_calendar(CALENDAR_CSV)[['service_id']].iloc[:1]
+    assert str(keys['service_id'].dtype) == 'Int64'
+
+    update_gtfs.delete_keys(Calendar, keys)
+    remaining = pd.read_sql(select(Calendar.service_id), engine)
+    assert remaining['service_id'].tolist() == [2]
+
+
+def test_refresh_integer_keys(engine, update_gtfs):
+    "A changed row with an integer key is replaced rather than duplicated"
+    load_calendar(engine, update_gtfs, CALENDAR_CSV)
+    changed = CALENDAR_CSV.replace('1,1,20230901', '1,0,20230901')
+
+    counts = update_gtfs.refresh_table(Calendar, read_calendar(changed))
+    assert (counts['inserts'], counts['updates'], counts['deletes']) == (0, 1, 0)
+    df = pd.read_sql(select(Calendar.__table__), engine)
+    assert df.set_index('service_id')['sunday'].to_dict() == {1: 0, 2: 0}
+
+
+def make_feed() -> dict:
+    "Tables of a small feed with the model's column names"
+    return {
+        'agencies': pd.DataFrame({
+            'id': ['a'], 'name': ['Buses'], 'url': ['http://buses'],
+            'timezone': ['Australia/Sydney'], 'lang': ['en'], 'phone': [None],
+        }),
+        'calendar': read_calendar(CALENDAR_CSV),
+        'routes': pd.DataFrame({
+            'id': ['r1', 'r2'], 'agency_id': 'a', 'short_name': ['1', '2'],
+            'long_name': ['One', 'Two'], 'description': 'Bus', 'type': 700,
+            'color': '00B5EF', 'text_color': 'FFFFFF',
+        }),
+        'shapes': pd.DataFrame({
+            'id': ['s1', 's1'], 'sequence': [1, 2], 'lat': [-33.8, -33.9],
+            'lon': [151.2, 151.3], 'dist_traveled': [0.0, 100.0],
+        }),
+        'stops': pd.DataFrame({
+            'id': ['p1', 'p2'], 'name': ['Stop 1', 'Stop 2'],
+            'lat': [-33.8, -33.9], 'lon': [151.2, 151.3],
+            'wheelchair_boarding': 1,
+        }),
+        'trips': pd.DataFrame({
+            'id': ['t1', 't2'], 'route_id': ['r1', 'r2'], 'service_id': '1',
+            'shape_id': 's1', 'trip_headsign': ['City', 'Beach'],
+            'direction_id': [0, 1], 'wheelchair_accessible': 1,
+            'route_direction': ['In', 'Out'],
+        }),
+        'stop_times': pd.DataFrame({
+            'trip_id': ['t1', 't1', 't2'], 'stop_sequence': [1, 2, 1],
+            'arrival_time': ['08:00:00', '08:10:00', '09:00:00'],
+            'departure_time': ['08:00:00', '08:10:00', '09:00:00'],
+            'stop_id': ['p1', 'p2', 'p2'], 'stop_headsign': None,
+            'pickup_type': 0, 'drop_off_type': 0,
+            'shape_dist_traveled': [0.0, 100.0, 0.0], 'timepoint': 1,
+            'stop_note': None,
+        }),
+    }
+
+
+def write_feed(path, feed: dict):
+    "Save tables as a GTFS zip with the GTFS field names"
+    with zipfile.ZipFile(path, 'w') as z:
+        for table in _gtfs_table_registry_:
+            df = feed[table.__tablename__]
+            mapping = gtfs.column_mapping(table)
+            df = df.rename(columns={v: k for k, v in mapping.items()})
+            z.writestr(f'{table._gtfs_file_}.txt', df.to_csv(index=False))
+
+
+def read_tables(engine) -> dict:
+    "Every GTFS table in the database, sorted by primary key"
+    tables = {}
+    for table in _gtfs_table_registry_:
+        keys = [c.name for c in table.__table__.primary_key.columns]
+        df = pd.read_sql(select(table.__table__), engine)
+        tables[table.__tablename__] = df.sort_values(keys, ignore_index=True)
+    return tables
+
+
+def test_diff_table(update_gtfs):
+    "Rows are split into inserts, changed rows and deletes by key"
+    old = pd.DataFrame({'id': ['a', 'b', 'c'], 'name': ['A', 'B', 'C']})
+    new = pd.DataFrame({'id': ['b', 'c', 'd'], 'name': ['B', 'C2', 'D']})
+
+    inserts, updates, deletes = update_gtfs.diff_table(old, new, ['id'])
+    assert inserts.to_dict('records') == [{'id': 'd', 'name': 'D'}]
+    assert updates.to_dict('records') == [{'id': 'c', 'name': 'C2'}]
+    assert deletes['id'].tolist() == ['a']
+
+
+def test_refresh_gtfs_files(engine, update_gtfs, tmp_path, monkeypatch):
+    "A dry run only counts changes, and a refresh applies them in key order"
+    feed = make_feed()
+    path = tmp_path / 'gtfs.zip'
+    monkeypatch.setattr(update_gtfs, 'zip_path', path)
+    write_feed(path, feed)
+    update_gtfs.refresh_gtfs_files()
+    loaded = read_tables(engine)
+
+    # Route 2 and its trip go, a new stop is served and a route is renamed
+    changed = make_feed()
+    changed['routes'] = changed['routes'].iloc[:1].assign(long_name='First')
+    changed['trips'] = changed['trips'].iloc[:1]
+    changed['stops'] = pd.concat([
+        changed['stops'],
+        changed['stops'].iloc[:1].assign(id='p3', name='Stop 3'),
+    ])
+    changed['stop_times'] = pd.concat([
+        changed['stop_times'].iloc[:2],
+        changed['stop_times'].iloc[:1].assign(stop_sequence=3, stop_id='p3'),
+    ])
+    write_feed(path, changed)
+
+    counts = update_gtfs.refresh_gtfs_files(dry_run=True).set_index('table')
+    assert counts.loc['routes'].tolist() == [0, 1, 1]
+    assert counts.loc['stop_times'].tolist() == [1, 0, 1]
+    for name, df in read_tables(engine).items():
+        pd.testing.assert_frame_equal(df, loaded[name])
+
+    statements = []
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split('(')[0].split(' WHERE')[0].strip())
+
+    update_gtfs.refresh_gtfs_files()
+    writes = [s for s in statements if not s.startswith('SELECT')]
+    assert writes.index('DELETE FROM stop_times') < writes.index('DELETE FROM trips')
+    assert writes.index('DELETE FROM trips') < writes.index('DELETE FROM routes')
+    assert writes.index('INSERT INTO stops') < writes.index('INSERT INTO stop_times')
+    assert any(s.startswith('UPDATE routes') for s in writes)
+
+    refreshed = read_tables(engine)
+    assert refreshed['routes']['long_name'].tolist() == ['First']
+    assert refreshed['trips']['id'].tolist() == ['t1']
+    assert refreshed['stop_times'][['trip_id', 'stop_id']].values.tolist() == [
+        ['t1', 'p1'], ['t1', 'p2'], ['t1', 'p3']
+    ]
+    assert update_gtfs.refresh_gtfs_files(dry_run=True)[
+        ['inserts', 'updates', 'deletes']
+    ].to_numpy().sum() == 0
+
+
+def test_parallel_upload_matches(engine, update_gtfs, tmp_path, monkeypatch):
+    "Loading tables in parallel gives the same tables as loading in turn"
+    path = tmp_path / 'gtfs.zip'
+    monkeypatch.setattr(update_gtfs, 'zip_path', path)
+    write_feed(path, make_feed())
+
+    update_gtfs.upload_gtfs_files()
+    sequential = read_tables(engine)
+    assert len(sequential['stop_times']) == 3
+
+    update_gtfs.upload_gtfs_files_parallel()
+    for name, df in read_tables(engine).items():
+        pd.testing.assert_frame_equal(df, sequential[name])
+
+
+def test_reload_gtfs_files_shadow(engine, update_gtfs, tmp_path, monkeypatch):
+    "Every shadow is loaded before all tables are swapped in together"
+    path = tmp_path / 'gtfs.zip'
+    monkeypatch.setattr(update_gtfs, 'zip_path', path)
+    write_feed(path, make_feed())
+    update_gtfs.upload_gtfs_files()
+    loaded = read_tables(engine)
+
+    changed = make_feed()
+    changed['stops'] = changed['stops'].assign(name=['North', 'South'])
+    write_feed(path, changed)
+
+    # A failed load leaves every live table as it was
+    bulk_insert = update_gtfs.bulk_insert
+
+    def fail_stop_times(df, table_name, connection):
+        if table_name.startswith('stop_times'):
+            raise RuntimeError('load failed')
+        return bulk_insert(df, table_name, connection)
+
+    monkeypatch.setattr(update_gtfs, 'bulk_insert', fail_stop_times)
+    with pytest.raises(RuntimeError):
+        update_gtfs.reload_gtfs_files_shadow()
+    for name, df in read_tables(engine).items():
+        pd.testing.assert_frame_equal(df, loaded[name])
+    monkeypatch.setattr(update_gtfs, 'bulk_insert', bulk_insert)
+
+    statements = []
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    update_gtfs.reload_gtfs_files_shadow()
+    renames = [i for i, s in enumerate(statements) if 'RENAME TO' in s]
+    inserts = [i for i, s in enumerate(statements) if s.startswith('INSERT')]
+    assert len(renames) == 2 * len(_gtfs_table_registry_)
+    assert max(inserts) < min(renames)
+
+    refreshed = read_tables(engine)
+    assert refreshed['stops']['name'].tolist() == ['North', 'South']
+    pd.testing.assert_frame_equal(refreshed['stop_times'], loaded['stop_times'])
+    names = inspect(engine).get_table_names()
+    assert not [name for name in names if name.endswith(update_gtfs.SHADOW_SUFFIX)]
+    assert {i['name'] for i in inspect(engine).get_indexes('stop_times')} == {
+        i.name for i in StopTime.__table__.indexes
+    }